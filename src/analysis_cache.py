@@ -0,0 +1,188 @@
+# src/analysis_cache.py
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class AnalysisCache:
+    """
+    Caché de resultados de análisis de imágenes indexada por contenido.
+    La clave es un SHA-256 de (SHA-256 de la imagen + modelo + versión del prompt), de modo que
+    la misma foto subida dos veces reutiliza el resultado sin volver a llamar a la API.
+    - Expulsión por tamaño (LRU, max_entries) y por antigüedad (ttl_seconds).
+    - Persistencia opcional en disco (persist_dir): un archivo JSON por clave. La lectura, escritura y
+      limpieza de archivos se hacen fuera del lock: un acierto en memoria nunca espera al disco.
+    """
+
+    # Al limpiar el disco se deja este porcentaje de max_entries: la siguiente limpieza (que recorre
+    # todo el directorio) no hace falta hasta unas cuantas escrituras después
+    PRUNE_LOW_WATER = 0.9
+
+    def __init__(self, max_entries=256, ttl_seconds=86400, persist_dir=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_dir = persist_dir or None
+        self._entries = OrderedDict()  # clave -> (stored_at, resultado)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._disk_entries = None  # Cota superior de archivos en disco (None = sin contar todavía)
+        self._prune_lock = threading.Lock()
+
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes, model_name, prompt_version):
+        """Calcula la clave de caché para una imagen, un modelo y una versión del prompt."""
+        return AnalysisCache.make_key_for_hash(hashlib.sha256(image_bytes).hexdigest(), model_name, prompt_version)
+
+    @staticmethod
+    def make_key_for_hash(image_hash, model_name, prompt_version):
+        """
+        Igual que make_key a partir del SHA-256 (hexadecimal) de la imagen, sin volver a leerla:
+        así el hash del almacén de imágenes sirve directamente de clave.
+        """
+        digest = hashlib.sha256()
+        digest.update(image_hash.encode("ascii"))
+        digest.update(b"\0")
+        digest.update(model_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt_version.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _is_expired(self, stored_at):
+        return self.ttl_seconds > 0 and (time.time() - stored_at) > self.ttl_seconds
+
+    def _disk_path(self, key):
+        return os.path.join(self.persist_dir, f"{key}.json")
+
+    def _load_from_disk(self, key):
+        """Lee una entrada persistida. Devuelve (stored_at, resultado) o None."""
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            return payload["stored_at"], payload["result"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ AnalysisCache: Entrada en disco ilegible ({path}): {e}")
+            self._remove_from_disk(key)
+            return None
+
+    def _save_to_disk(self, key, stored_at, result):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"  # Único por hilo: put ya no escribe bajo el lock
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": stored_at, "result": result}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)  # Escritura atómica
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️ AnalysisCache: No se pudo persistir la entrada {key[:12]}: {e}")
+
+    def _remove_from_disk(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        """
+        Elimina del disco las entradas más antiguas si se supera max_entries, hasta dejar
+        PRUNE_LOW_WATER * max_entries. Si otro hilo ya está limpiando, no hace nada.
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            try:
+                files = [entry for entry in os.scandir(self.persist_dir) if entry.name.endswith(".json")]
+            except OSError:
+                return
+            remaining = len(files)
+            if remaining > self.max_entries:
+                files.sort(key=lambda entry: entry.stat().st_mtime)
+                for entry in files[:remaining - int(self.max_entries * self.PRUNE_LOW_WATER)]:
+                    try:
+                        os.remove(entry.path)
+                        remaining -= 1
+                    except OSError:
+                        pass
+            with self._lock:
+                self._disk_entries = remaining
+        finally:
+            self._prune_lock.release()
+
+    def get(self, key):
+        """Devuelve una copia del resultado almacenado o None si no existe o ha expirado."""
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is None and self.persist_dir:
+            cached = self._load_from_disk(key)  # Fuera del lock: no bloquea los aciertos en memoria
+
+        with self._lock:
+            if cached is not None and key not in self._entries:
+                self._entries[key] = cached
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+            if cached is None:
+                self.misses += 1
+                return None
+
+            stored_at, result = cached
+            expired = self._is_expired(stored_at)
+            if expired:
+                self._entries.pop(key, None)
+                self.expirations += 1
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(result)
+        if expired and self.persist_dir:
+            self._remove_from_disk(key)
+        return None
+
+    def put(self, key, result):
+        """Almacena un resultado (se guarda una copia para que el llamador pueda modificar el suyo)."""
+        if self.max_entries <= 0:
+            return
+        stored_at = time.time()
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = (stored_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if self.persist_dir and self._disk_entries is not None:
+                self._disk_entries += 1  # Cota superior: sobrescribir una clave no añade archivos
+            needs_prune = self._disk_entries is None or self._disk_entries > self.max_entries
+        if self.persist_dir:
+            # Fuera del lock: result ya es una copia privada y os.replace hace la escritura atómica
+            self._save_to_disk(key, stored_at, result)
+            if needs_prune:
+                self._prune_disk()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persist_dir": self.persist_dir,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -1,20 +1,31 @@
 import os
-from flask import Flask, request, jsonify, render_template  # ¡AÑADE render_template AQUÍ!
+import functools
+import hashlib
+from flask import Flask, request, jsonify, render_template, url_for, Response, stream_with_context, send_file  # ¡AÑADE render_template AQUÍ!
+from markupsafe import escape
 from flask_cors import CORS
-from datetime import datetime, date  # Importa 'date' también para mayor claridad
 import uuid
 import json  # Importado para pretty-print en debug logs
-import tempfile
 from werkzeug.utils import secure_filename
-from bson import ObjectId  # Importar ObjectId para manejar la conversión de IDs de MongoDB
 
 # Importar las clases y funciones de tus módulos existentes
 # Asegúrate de que estas rutas de importación sean correctas para tu estructura 'src'
 from src.gemini_analyzer import GeminiAnalyzer
-from src.data_logger import DataLogger
+from src.data_logger import create_data_logger, InvalidCursorError, HISTORY_PROJECTIONS
 from src.image_manager import ImageManager
-from src.food_utils import get_food_data_from_db  # Esto busca en tu FOOD_DATABASE local
+from src.food_utils import get_food_match_cache_stats  # Esto busca en tu FOOD_DATABASE local
+from src.meal_pipeline import MealPipeline
+from src.serializers import stream_json_array, to_display_entry
+from src.date_utils import parse_day, parse_timezone, day_range_bounds, timezone_shift
+from src.job_queue import create_job_queue, QueueFullError
+from src.response_cache import ResponseCache
 from src.config import FOOD_SECTIONS  # Esto debería contener las secciones de comida (ej. ["Desayuno", "Almuerzo"])
+from src.config import JOB_QUEUE_BACKEND, JOB_WORKERS, JOB_QUEUE_MAX_DEPTH, JOB_RESULT_TTL_SECONDS
+from src.config import BATCH_MAX_IMAGES, BATCH_WORKERS
+from src.config import HISTORY_DEFAULT_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, HISTORY_MAX_RANGE_DAYS, SUMMARY_MAX_RANGE_DAYS
+from src.config import STORAGE_BACKEND, MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS
+from src.config import THUMBNAIL_CACHE_MAX_AGE_SECONDS
+from src.config import HISTORY_RESPONSE_CACHE_ENABLED, HISTORY_RESPONSE_CACHE_MAX_ENTRIES, HISTORY_RESPONSE_CACHE_MAX_BODY_BYTES
 
 app = Flask(__name__)
 CORS(app)  # Habilita CORS para permitir solicitudes desde tu app Android
@@ -24,8 +35,16 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
 # Inicializa los módulos
 gemini_analyzer = GeminiAnalyzer()
-data_logger = DataLogger()
+data_logger = create_data_logger(STORAGE_BACKEND)  # MongoDB o SQLite según STORAGE_BACKEND
 image_manager = ImageManager()  # ImageManager se encargará de crear sus directorios
+meal_pipeline = MealPipeline(gemini_analyzer, data_logger, image_manager, batch_workers=BATCH_WORKERS)
+# El estado de los trabajos se guarda también en data_logger: GET /analizar/<job_id> responde en cualquier worker
+job_queue = create_job_queue(JOB_QUEUE_BACKEND, JOB_WORKERS, JOB_QUEUE_MAX_DEPTH, JOB_RESULT_TTL_SECONDS,
+                             job_store=data_logger)
+response_cache = None
+if HISTORY_RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(HISTORY_RESPONSE_CACHE_MAX_ENTRIES, HISTORY_RESPONSE_CACHE_MAX_BODY_BYTES)
+    data_logger.add_write_listener(response_cache.clear)  # Cada registro o borrado invalida la caché
 
 
 # --- FUNCIÓN allowed_file CORREGIDA: Ubicada correctamente ---
@@ -35,6 +54,166 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def normalize_meal_type(meal_type):
+    """Devuelve meal_type si es una sección válida, o la sección por defecto."""
+    if meal_type not in FOOD_SECTIONS:
+        return FOOD_SECTIONS[0]  # Valor por defecto si no es válido
+    return meal_type
+
+
+def save_uploaded_image(image_file):
+    """
+    Guarda una imagen subida en el almacén por contenido de ImageManager (una imagen repetida
+    no se vuelve a guardar). La subida se escribe primero en la carpeta de procesamiento y
+    después se renombra al almacén.
+    Devuelve (nombre "<hash><extensión>", ruta de la imagen en el almacén).
+    """
+    original_filename = secure_filename(image_file.filename)
+    file_extension = os.path.splitext(original_filename)[1].lower()
+    temp_image_path = os.path.join(image_manager.processing_dir, f"{uuid.uuid4()}{file_extension}")
+    image_file.save(temp_image_path)
+    try:
+        image_hash = image_manager.store_file(temp_image_path, file_extension)
+    except Exception:
+        if os.path.exists(temp_image_path):
+            os.remove(temp_image_path)
+        raise
+    return f"{image_hash}{file_extension}", image_manager.image_path(image_hash)
+
+
+def parse_page_limit(raw_limit):
+    """Valida el parámetro 'limit' de los endpoints paginados."""
+    if raw_limit is None or raw_limit == '':
+        return HISTORY_DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw_limit)
+    except ValueError:
+        raise ValueError("El parámetro 'limit' debe ser un número entero.")
+    if limit < 1:
+        raise ValueError("El parámetro 'limit' debe ser mayor que 0.")
+    return min(limit, HISTORY_MAX_PAGE_SIZE)
+
+
+def parse_history_limit(args):
+    """
+    'limit' de los endpoints JSON del historial. Sin 'limit' ni 'cursor' devuelve None: historial
+    completo emitido en streaming, como antes de la paginación (los clientes existentes no cambian).
+    """
+    if not args.get('limit') and not args.get('cursor'):
+        return None
+    return parse_page_limit(args.get('limit'))
+
+
+def parse_projection(raw_fields):
+    """
+    Convierte el parámetro 'campos' en una proyección de MongoDB.
+    Acepta un nombre predefinido (ej. "totales") o una lista de campos separados por comas.
+    """
+    if not raw_fields:
+        return None
+    if raw_fields in HISTORY_PROJECTIONS:
+        return HISTORY_PROJECTIONS[raw_fields]
+    fields = [field.strip() for field in raw_fields.split(',') if field.strip()]
+    if not fields or any(field.startswith('$') for field in fields):
+        raise ValueError("El parámetro 'campos' no es válido.")
+    projection = {field: 1 for field in fields}
+    projection["timestamp"] = 1  # Necesario para el cursor de paginación
+    return projection
+
+
+def parse_day_range(args, max_days):
+    """
+    Lee el rango de días de los parámetros 'date' (un solo día) o 'desde' y 'hasta' (ambos incluidos),
+    en formato YYYY-MM-DD. Devuelve (primer día, último día) como objetos date.
+    Lanza ValueError si faltan, no son válidos o el rango supera max_days días.
+    """
+    date_str = args.get('date')
+    desde_str = args.get('desde')
+    hasta_str = args.get('hasta')
+    if not date_str and not (desde_str and hasta_str):
+        raise ValueError("Parámetro 'date' (o 'desde' y 'hasta') es requerido en formato YYYY-MM-DD.")
+
+    try:
+        if date_str:
+            first_day = last_day = parse_day(date_str)
+        else:
+            first_day, last_day = parse_day(desde_str), parse_day(hasta_str)
+    except ValueError:
+        raise ValueError("Formato de fecha inválido. Use YYYY-MM-DD.")
+
+    if last_day < first_day:
+        raise ValueError("'hasta' no puede ser anterior a 'desde'.")
+    if (last_day - first_day).days + 1 > max_days:
+        raise ValueError(f"El rango no puede superar {max_days} días.")
+    return first_day, last_day
+
+
+def history_page_response(endpoint, entries, next_cursor):
+    """
+    Respuesta común de los endpoints paginados del historial: lista JSON de entradas emitida
+    en streaming desde el cursor de MongoDB y, si hay más páginas, las cabeceras 'X-Next-Cursor'
+    y 'Link: rel="next"' apuntando a endpoint.
+    """
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = url_for(endpoint, **dict(request.args.items(), cursor=next_cursor))
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return Response(stream_with_context(stream_json_array(entries)), status=200,
+                    mimetype='application/json', headers=headers)
+
+
+def conditional_history_response(build_response):
+    """
+    Respuesta de un endpoint de lectura del historial con GET condicional y caché:
+    - El ETag combina la versión del historial (DataLogger.get_version) con la ruta y los parámetros.
+    - Si coincide con el If-None-Match del cliente se responde 304 sin consultar el historial.
+    - Si hay una respuesta guardada con la versión actual se devuelve tal cual.
+    - Si no, se genera con build_response() y se guarda (las de streaming, al terminar de emitirse).
+    Sin versión disponible (MongoDB caído) se responde sin ETag ni caché.
+    """
+    # Con escritura diferida, las entradas recién aceptadas deben estar insertadas antes de leer la versión
+    data_logger.flush(MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS)
+    version = data_logger.get_version()
+    if version is None:
+        return build_response()
+
+    cache_key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    etag = f"{version}-{hashlib.sha1(repr(cache_key).encode('utf-8')).hexdigest()[:12]}"
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        cached = response_cache.get(cache_key, version) if response_cache else None
+        if cached:
+            body, content_type, headers = cached
+            response = Response(body, status=200, content_type=content_type, headers=headers)
+        else:
+            response = app.make_response(build_response())
+            if response.status_code != 200:
+                return response
+            if response_cache:
+                # Cabeceras propias de la respuesta que hay que conservar (paginación)
+                headers = {name: response.headers[name] for name in ("X-Next-Cursor", "Link") if name in response.headers}
+                if response.is_streamed:
+                    response.response = response_cache.tee(
+                        cache_key, version, response.response, response.content_type, headers)
+                else:
+                    response_cache.put(cache_key, version, response.get_data(), response.content_type, headers)
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"  # El cliente debe revalidar con If-None-Match
+    return response
+
+
+def cached_history_view(view):
+    """Decorador que aplica conditional_history_response a un endpoint de lectura del historial."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return conditional_history_response(lambda: view(*args, **kwargs))
+    return wrapper
+
+
 # --- ENDPOINTS DE LA API ---
 
 @app.route('/analizar', methods=['POST'])
@@ -42,6 +221,7 @@ def analizar_imagen_comida():
     """
     Endpoint para recibir una imagen, analizarla con Gemini, procesar la información
     nutricional (usando la BD local si aplica), registrarla en MongoDB y devolver un resumen.
+    Con 'async=1' (query o formulario) devuelve 202 y un job_id para consultar en /analizar/<job_id>.
     """
     if 'image' not in request.files:
         print("❌ Error: No se encontró la parte 'image' en la solicitud.")
@@ -56,270 +236,173 @@ def analizar_imagen_comida():
         print(f"❌ Error: Tipo de archivo no permitido: {image_file.filename}")
         return jsonify({"error": "Tipo de archivo no permitido."}), 400
 
-    original_filename = secure_filename(image_file.filename)
-    file_extension = os.path.splitext(original_filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-
-    # Guardar imagen en la carpeta de procesamiento temporal para GeminiAnalyzer
-    temp_image_path = os.path.join(image_manager.processing_dir, unique_filename)
     try:
-        image_file.save(temp_image_path)
-        print(f"🖼️ Imagen guardada temporalmente en: {temp_image_path}")
+        image_name, image_path = save_uploaded_image(image_file)
     except Exception as e:
         print(f"❌ Error al guardar la imagen recibida: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": "Error al guardar la imagen recibida."}), 500
 
-    meal_type = request.form.get('meal_type', FOOD_SECTIONS[0])
-    if meal_type not in FOOD_SECTIONS:
-        meal_type = FOOD_SECTIONS[0]  # Valor por defecto si no es válido
-
-    print(f"🔎 Iniciando análisis de la imagen {unique_filename} con Gemini...")
-    # Llama a GeminiAnalyzer, que ahora devuelve la estructura JSON completa
-    gemini_raw_analysis = gemini_analyzer.analyze_image(temp_image_path)
-
-    # --- INICIO DE LOS PRINTS DE DEPURACIÓN EN APP.PY (Puedes quitarlos después de verificar) ---
-    print(f"\n--- DEBUG APP.PY: ESTADO DESPUÉS DE LA LLAMADA A GEMINI ---")
-    print(f"DEBUG: Tipo de 'gemini_raw_analysis': {type(gemini_raw_analysis)}")
-
-    if isinstance(gemini_raw_analysis, dict):
-        print(f"DEBUG: 'gemini_raw_analysis' completo (JSON.DUMPS):\n{json.dumps(gemini_raw_analysis, indent=2)}")
-        print(
-            f"DEBUG: 'nombre_general_comida' (extraído con .get()): {gemini_raw_analysis.get('nombre_general_comida', 'NO_ENCONTRADO_DEFAULT_APP')}")
-        print(
-            f"DEBUG: 'alimentos_detallados' (extraído con .get()): {gemini_raw_analysis.get('alimentos_detallados', 'NO_ENCONTRADO_DEFAULT_APP')}")
-        print(
-            f"DEBUG: Longitud de 'alimentos_detallados' (extraída): {len(gemini_raw_analysis.get('alimentos_detallados', []))}")
-    else:
-        print(f"DEBUG: 'gemini_raw_analysis' no es un diccionario, contenido: {gemini_raw_analysis}")
-    print(f"---------------------------------------------------\n")
-    # --- FIN DE LOS PRINTS DE DEPURACIÓN EN APP.PY ---
-
-    # --- Manejo de la respuesta de Gemini ---
-    if not gemini_raw_analysis or gemini_raw_analysis.get("error"):
-        error_msg = gemini_raw_analysis.get("error", "Análisis de Gemini falló o no devolvió resultados válidos.")
-        image_manager.move_to_error(unique_filename)
-        # Eliminar el archivo temporal del directorio de procesamiento después de moverlo a error
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-        print(f"❌ Análisis fallido, moviendo a error y limpiando {temp_image_path}")
-        return jsonify({
-            "error": "No se pudieron identificar alimentos en la imagen o el análisis de Gemini falló.",
-            "details": error_msg
-        }), 400
-
-    # Extraer los datos principales de la respuesta de Gemini
-    nombre_general_comida = gemini_raw_analysis.get("nombre_general_comida", "Plato sin nombre")
-    alimentos_detallados_gemini = gemini_raw_analysis.get("alimentos_detallados", [])
-
-    # --- INICIO DE OTROS PRINTS DE DEPURACIÓN CRÍTICA ANTES DEL BUCLE (Puedes quitarlos después de verificar) ---
-    print(f"\n--- DEBUG APP.PY: ANTES DEL BUCLE DE PROCESAMIENTO DE ALIMENTOS ---")
-    print(f"DEBUG: Variable 'alimentos_detallados_gemini' que se usará en el bucle: {alimentos_detallados_gemini}")
-    print(f"DEBUG: Longitud final de 'alimentos_detallados_gemini' para el bucle: {len(alimentos_detallados_gemini)}")
-    print(f"-------------------------------------------------------------------\n")
-    # --- FIN DE OTROS PRINTS DE DEPURACIÓN CRÍTICA ---
-
-    # Inicializar totales generales, los acumularemos en el bucle
-    total_calorias = 0.0
-    total_proteinas = 0.0
-    total_grasas = 0.0
-    total_carbohidratos = 0.0
-
-    # Lista de alimentos con nutrientes finalizados para la base de datos y la respuesta de la app
-    final_processed_foods_for_db = []
-    response_foods_for_app = []  # Para la respuesta de la app, solo con nutrientes finales
-
-    for item_gemini in alimentos_detallados_gemini:
-        # --- PRINT DENTRO DEL BUCLE (Puedes quitarlos después de verificar) ---
-        print(f"DEBUG: Procesando item_gemini dentro del bucle: {item_gemini}")
-        # --- FIN PRINT DENTRO DEL BUCLE ---
-
-        # *************************************************************************
-        # CAMBIOS CLAVE AQUÍ: Ajuste de claves a la estructura REAL de gemini_analyzer
-        # *************************************************************************
-        nombre_alimento_gemini = item_gemini.get("nombre_alimento", "Desconocido").strip()
+    meal_type = normalize_meal_type(request.form.get('meal_type'))
+
+    # Modo asíncrono opcional: responde 202 con un id de trabajo en vez de esperar a Gemini
+    async_mode = (request.args.get('async') or request.form.get('async') or '').lower() in ('1', 'true', 'si', 'sí')
+    if async_mode:
+        try:
+            job_id = job_queue.submit(meal_pipeline.process_image, image_path, image_name, meal_type)
+        except QueueFullError as e:
+            print(f"⚠️ Cola de análisis llena, se rechaza {image_name}.")
+            meal_pipeline.finish(image_path, image_name, success=False)
+            return jsonify({"error": str(e)}), 503
+        print(f"📨 Análisis de {image_name} encolado como trabajo {job_id}.")
+        status_url = url_for('get_analysis_job_endpoint', job_id=job_id)
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+    response_data, status_code = meal_pipeline.process_image(image_path, image_name, meal_type)
+    return jsonify(response_data), status_code
+
+
+@app.route('/analizar_stream', methods=['POST'])
+def analizar_stream_endpoint():
+    """
+    Variante de /analizar que responde con server-sent events (text/event-stream).
+    Recibe lo mismo que /analizar y envía:
+    - 'ingrediente': cada alimento en cuanto Gemini lo identifica, ya cruzado con la BD local.
+    - 'resultado': la misma respuesta final que /analizar, una vez registrada la entrada.
+    - 'error': si el análisis o el registro fallan.
+    """
+    if 'image' not in request.files:
+        return jsonify({"error": "No se encontró el archivo de imagen en la solicitud."}), 400
+
+    image_file = request.files['image']
+    if image_file.filename == '' or not allowed_file(image_file.filename):
+        return jsonify({"error": "No se seleccionó ninguna imagen o el tipo de archivo no está permitido."}), 400
+
+    try:
+        image_name, image_path = save_uploaded_image(image_file)
+    except Exception as e:
+        print(f"❌ Error al guardar la imagen recibida: {e}")
+        return jsonify({"error": "Error al guardar la imagen recibida."}), 500
+
+    meal_type = normalize_meal_type(request.form.get('meal_type'))
+
+    def generate_events():
+        events = meal_pipeline.process_image_stream(image_path, image_name, meal_type)
+        try:
+            for event_type, data in events:
+                yield f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            # Si el cliente se desconecta, cerrar el generador del pipeline ya (no al recolectarlo)
+            # para que marque la imagen como error
+            events.close()
 
+    return Response(stream_with_context(generate_events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/analizar_lote', methods=['POST'])
+def analizar_lote_endpoint():
+    """
+    Endpoint para analizar varias imágenes en una sola solicitud (ej. todas las comidas del día).
+    Recibe los archivos en el campo 'images' y, opcionalmente, un 'meal_type' por imagen
+    (en el mismo orden) o uno solo para todas. Los análisis se ejecutan en paralelo y todas
+    las entradas se registran con una única escritura en la base de datos.
+    Devuelve un resultado o un error por imagen, en el mismo orden en que se enviaron.
+    """
+    image_files = request.files.getlist('images')
+    if not image_files:
+        return jsonify({"error": "No se encontraron imágenes en el campo 'images' de la solicitud."}), 400
+    if len(image_files) > BATCH_MAX_IMAGES:
+        return jsonify({"error": f"Se permiten como máximo {BATCH_MAX_IMAGES} imágenes por lote."}), 400
+
+    meal_types = request.form.getlist('meal_type')
+    if len(meal_types) not in (0, 1, len(image_files)):
+        return jsonify({"error": "Envía un 'meal_type' por imagen o uno solo para todo el lote."}), 400
+
+    results = [None] * len(image_files)
+    items = []
+    item_positions = []
+    for position, image_file in enumerate(image_files):
+        if image_file.filename == '' or not allowed_file(image_file.filename):
+            results[position] = {"filename": image_file.filename, "status": 400,
+                                 "error": "Tipo de archivo no permitido."}
+            continue
         try:
-            # Ahora la clave es 'cantidad_estimada_g' y puede ser float, la convertimos a int
-            cantidad_g_gemini = int(item_gemini.get("cantidad_estimada_g", 0.0))
-        except ValueError:
-            cantidad_g_gemini = 0
-            print(
-                f"⚠️ Cantidad_g para '{nombre_alimento_gemini}' no es un número válido o no se encontró 'cantidad_estimada_g', se usará 0.")
-
-        # Los nutrientes están anidados bajo la clave 'nutrientes_estimados'
-        nutrientes_estimados_dict = item_gemini.get("nutrientes_estimados", {})
-
-        nutrientes_gemini_para_cantidad = {
-            "calorias": float(nutrientes_estimados_dict.get("calorias", 0.0)),
-            "proteinas": float(nutrientes_estimados_dict.get("proteinas", 0.0)),
-            "grasas": float(nutrientes_estimados_dict.get("grasas", 0.0)),
-            "carbohidratos": float(nutrientes_estimados_dict.get("carbohidratos", 0.0))
-        }
-        es_estimado_ia_original = item_gemini.get("es_estimado", True)
-        # *************************************************************************
-        # FIN CAMBIOS CLAVE
-        # *************************************************************************
-
-        # Buscar el alimento en tu base de datos local
-        matched_food_data = get_food_data_from_db(nombre_alimento_gemini)
-
-        nutrientes_finales_por_item = {}
-        nombre_final_alimento = nombre_alimento_gemini
-        usado_bd_local = False
-        es_estimado_final = True  # Por defecto es estimado, a menos que usemos la BD local
-
-        if matched_food_data and cantidad_g_gemini > 0:
-            # Si se encuentra en la DB local, usa sus valores por 100g y escala a la cantidad_g_gemini
-            factor = cantidad_g_gemini / 100.0
-            nutrientes_finales_por_item["calorias"] = round(matched_food_data.get("calorias_por_100g", 0.0) * factor, 2)
-            nutrientes_finales_por_item["proteinas"] = round(matched_food_data.get("proteinas_por_100g", 0.0) * factor,
-                                                             2)
-            nutrientes_finales_por_item["grasas"] = round(matched_food_data.get("grasas_por_100g", 0.0) * factor, 2)
-            nutrientes_finales_por_item["carbohidratos"] = round(
-                matched_food_data.get("carbohidratos_por_100g", 0.0) * factor, 2)
-
-            nombre_final_alimento = matched_food_data.get("nombre", nombre_alimento_gemini).title()
-            usado_bd_local = True
-            es_estimado_final = False  # Ya no es estimado si usamos nuestra BD
-            print(
-                f"✅ Alimento '{nombre_alimento_gemini}' (Gemini) → '{nombre_final_alimento}' (BD Local) - Calculado para {cantidad_g_gemini}g.")
+            image_name, image_path = save_uploaded_image(image_file)
+        except Exception as e:
+            print(f"❌ Error al guardar la imagen {image_file.filename} del lote: {e}")
+            results[position] = {"filename": image_file.filename, "status": 500,
+                                 "error": "Error al guardar la imagen recibida."}
+            continue
+        if len(meal_types) == len(image_files):
+            meal_type = meal_types[position]
         else:
-            # Si no se encuentra en la DB local, usa directamente las estimaciones de Gemini
-            nutrientes_finales_por_item = {
-                "calorias": round(nutrientes_gemini_para_cantidad.get("calorias", 0.0), 2),
-                "proteinas": round(nutrientes_gemini_para_cantidad.get("proteinas", 0.0), 2),
-                "grasas": round(nutrientes_gemini_para_cantidad.get("grasas", 0.0), 2),
-                "carbohidratos": round(nutrientes_gemini_para_cantidad.get("carbohidratos", 0.0), 2)
-            }
-            nombre_final_alimento = nombre_alimento_gemini.title() + " (Estimado por IA)"  # Etiqueta para identificar
-            usado_bd_local = False
-            es_estimado_final = True
-            print(
-                f"⚠️ Alimento '{nombre_alimento_gemini}' no encontrado en la BD local. Usando estimaciones de Gemini para {cantidad_g_gemini}g.")
-
-        # Acumular los totales generales del plato
-        total_calorias += nutrientes_finales_por_item["calorias"]
-        total_proteinas += nutrientes_finales_por_item["proteinas"]
-        total_grasas += nutrientes_finales_por_item["grasas"]
-        total_carbohidratos += nutrientes_finales_por_item["carbohidratos"]
-
-        # Formato para guardar en la base de datos (DataLogger)
-        final_processed_foods_for_db.append({
-            "nombre_alimento": nombre_final_alimento,
-            "cantidad_g": cantidad_g_gemini,
-            "nutrientes": nutrientes_finales_por_item,  # Nutrientes para esa cantidad
-            "es_estimado_ia_original": es_estimado_ia_original,  # Si Gemini lo marcó como estimado
-            "usado_bd_local_para_calculo": usado_bd_local  # Indica si se usó la BD local para el cálculo
-        })
-
-        # Formato para la respuesta a la aplicación móvil (lo que espera ResultActivity)
-        response_foods_for_app.append({
-            "nombre": nombre_final_alimento,
-            "cantidad_g": cantidad_g_gemini,
-            "calorias": nutrientes_finales_por_item["calorias"],
-            "proteinas": nutrientes_finales_por_item["proteinas"],
-            "grasas": nutrientes_finales_por_item["grasas"],
-            "carbohidratos": nutrientes_finales_por_item["carbohidratos"],
-            "es_estimado": es_estimado_final  # Si el cálculo final es estimado o de BD
-        })
-
-    # Redondear totales generales del plato
-    total_calorias = round(total_calorias, 2)
-    total_proteinas = round(total_proteinas, 2)
-    total_grasas = round(total_grasas, 2)
-    total_carbohidratos = round(total_carbohidratos, 2)
-
-    # Preparar el objeto final para guardar en la base de datos (DataLogger)
-    full_meal_data_for_db = {
-        "nombre_general_comida": nombre_general_comida,  # Nombre general del plato de Gemini
-        "calorias_totales": total_calorias,
-        "proteinas_totales": total_proteinas,
-        "grasas_totales": total_grasas,
-        "carbohidratos_totales": total_carbohidratos,
-        "alimentos_detallados": final_processed_foods_for_db
-    }
-
-    # Llama a DataLogger para registrar la entrada completa
-    log_success = data_logger.log_food_entry(
-        analysis_result=full_meal_data_for_db,
-        image_name=unique_filename,
-        meal_type=meal_type,
-        log_time=datetime.now()  # Guarda el timestamp actual
-    )
+            meal_type = meal_types[0] if meal_types else None
+        items.append((image_path, image_name, normalize_meal_type(meal_type)))
+        item_positions.append(position)
+
+    for position, (body, status_code) in zip(item_positions, meal_pipeline.process_images(items)):
+        result = {"filename": image_files[position].filename, "status": status_code}
+        if status_code == 200:
+            result["resultado"] = body
+        else:
+            result.update(body)
+        results[position] = result
 
-    if not log_success:
-        print("❌ Falló el registro en MongoDB.")
-        image_manager.move_to_error(unique_filename)
-        # Eliminar el archivo temporal del directorio de procesamiento
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-        return jsonify({"error": "Error al registrar la entrada en la base de datos."}), 500
-
-    # Mover la imagen a la carpeta de procesados después de un éxito total
-    image_manager.move_to_processed(unique_filename)
-    # Eliminar el archivo temporal del directorio de procesamiento
-    if os.path.exists(temp_image_path):
-        os.remove(temp_image_path)
-    print(f"✅ Análisis completado y entrada registrada para {unique_filename}.")
-
-    # --- Construyendo la respuesta final para la aplicación móvil (ResultActivity) ---
-    response_data = {
-        "nombre": nombre_general_comida,
-        "calorias": total_calorias,
-        "proteinas": total_proteinas,
-        "grasas": total_grasas,
-        "carbohidratos": total_carbohidratos,
-        "alimentos_detallados": response_foods_for_app
-    }
-    return jsonify(response_data), 200
+    ok_count = sum(1 for result in results if result["status"] == 200)
+    return jsonify({"total": len(results), "exitosos": ok_count, "resultados": results}), 200
+
+
+@app.route('/analizar/<string:job_id>', methods=['GET'])
+def get_analysis_job_endpoint(job_id):
+    """
+    Endpoint para consultar un análisis lanzado en modo asíncrono.
+    'status' es "queued", "running", "done" o "error"; 'result' contiene la misma respuesta
+    que devolvería /analizar en modo síncrono cuando el trabajo terminó.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"No se encontró el trabajo {job_id} (puede haber expirado)."}), 404
+
+    return jsonify({
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "result": job["result"],
+        "http_status": job["http_status"],
+        "error": job["error"]
+    }), 200
 
 
 @app.route('/historial', methods=['GET'])
+@cached_history_view
 def get_food_history_endpoint():
     """
-    Endpoint para obtener el historial de todas las comidas registradas.
-    Convierte ObjectId y datetime a string para ser serializable en JSON.
+    Endpoint para obtener el historial de comidas registradas, paginado de más reciente a más antiguo.
+    Parámetros opcionales:
+    - limit: entradas por página (máximo HISTORY_MAX_PAGE_SIZE). Sin 'limit' ni 'cursor' se devuelve
+      el historial completo, en streaming; con 'cursor' y sin 'limit', páginas de HISTORY_DEFAULT_PAGE_SIZE.
+    - cursor: valor de la cabecera 'X-Next-Cursor' de la página anterior.
+    - campos: "totales" (sin 'alimentos_detallados') o lista de campos separados por comas.
+    El cuerpo sigue siendo una lista JSON; el cursor de la página siguiente va en 'X-Next-Cursor'
+    (y en 'Link: rel="next"'), ausentes en la última página.
+    ObjectId y datetime se convierten a string con el encoder de src/serializers.py.
+    Admite GET condicional: devuelve 304 si 'If-None-Match' coincide con el 'ETag' actual.
     """
     try:
-        entries = data_logger.get_food_entries()
-
-        serialized_entries = []
-        for entry in entries:
-            serialized_entry = entry.copy()
-
-            # Convertir ObjectId a string
-            if '_id' in serialized_entry:
-                serialized_entry['_id'] = str(serialized_entry['_id'])
-
-            # Convertir datetime a ISO 8601 string
-            # Esto generará 'YYYY-MM-DDTHH:MM:SS.ffffff' (microsegundos, sin 'Z' si es naive)
-            if 'timestamp' in serialized_entry and isinstance(serialized_entry['timestamp'], datetime):
-                serialized_entry['timestamp'] = serialized_entry['timestamp'].isoformat()
-
-            # Asegurar que los campos numéricos sean floats
-            for key in ["calorias_totales", "proteinas_totales", "grasas_totales", "carbohidratos_totales"]:
-                if key in serialized_entry and not isinstance(serialized_entry[key], (float, int)):
-                    try:
-                        serialized_entry[key] = float(serialized_entry[key])
-                    except (ValueError, TypeError):
-                        serialized_entry[key] = 0.0
-
-            if "alimentos_detallados" in serialized_entry:
-                for food_item in serialized_entry["alimentos_detallados"]:
-                    if "nutrientes" in food_item:
-                        for nutrient_key in ["calorias", "proteinas", "grasas", "carbohidratos"]:
-                            if nutrient_key in food_item["nutrientes"] and not isinstance(
-                                    food_item["nutrientes"][nutrient_key], (float, int)):
-                                try:
-                                    food_item["nutrientes"][nutrient_key] = float(food_item["nutrientes"][nutrient_key])
-                                except (ValueError, TypeError):
-                                    food_item["nutrientes"][nutrient_key] = 0.0
-
-            serialized_entries.append(serialized_entry)
-
-        return jsonify(serialized_entries), 200
+        limit = parse_history_limit(request.args)
+        projection = parse_projection(request.args.get('campos'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        entries, next_cursor = data_logger.stream_food_entries_page(
+            limit, cursor=request.args.get('cursor'), projection=projection)
+    except InvalidCursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return history_page_response('get_food_history_endpoint', entries, next_cursor)
     except Exception as e:
         print(f"❌ Error al obtener el historial de comidas: {e}")
         import traceback
@@ -354,85 +437,37 @@ def delete_food_history_item_endpoint(item_id):
 
 
 @app.route('/historial_por_fecha', methods=['GET'])
+@cached_history_view
 def get_food_history_by_date_endpoint():
     """
-    Endpoint para obtener el historial de comidas registradas para una fecha específica.
-    Recibe la fecha como parámetro de query en formato 'YYYY-MM-DD'.
+    Endpoint para obtener el historial de comidas de un día o de un rango de días.
+    Parámetros de query:
+    - date: un día concreto en formato 'YYYY-MM-DD', o bien
+    - desde / hasta: rango de días 'YYYY-MM-DD' (ambos incluidos, máximo HISTORY_MAX_RANGE_DAYS días).
+    - tz (opcional): zona horaria IANA en la que se interpretan los días (ej. "America/Argentina/Buenos_Aires");
+      por defecto, la hora local del servidor.
+    - limit, cursor, campos: igual que en /historial (sin 'limit' ni 'cursor', todas las entradas del rango).
+    El filtro y el orden (más reciente primero) los resuelve MongoDB usando el índice de timestamp.
     """
-    date_str = request.args.get('date')  # Obtener la fecha del query parameter
-    if not date_str:
-        return jsonify({"error": "Parámetro 'date' es requerido en formato YYYY-MM-DD."}), 400
+    try:
+        first_day, last_day = parse_day_range(request.args, HISTORY_MAX_RANGE_DAYS)
+        tz = parse_timezone(request.args.get('tz'))
+        limit = parse_history_limit(request.args)
+        projection = parse_projection(request.args.get('campos'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_date, end_date = day_range_bounds(first_day, last_day, tz)
 
     try:
-        # Intentar parsear la fecha del string a un objeto datetime
-        start_of_day = datetime.strptime(date_str, "%Y-%m-%d")
-        end_of_day = start_of_day.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        # *** ¡IMPORTANTE! ***
-        # Para que este endpoint sea eficiente para grandes volúmenes de datos,
-        # tu método `get_food_entries` en `src/data_logger.py` debería ser modificado
-        # para aceptar parámetros `start_date` y `end_date` y filtrar directamente en MongoDB.
-        # Por ejemplo, en data_logger.py:
-        # def get_food_entries(start_date=None, end_date=None):
-        #     query = {}
-        #     if start_date and end_date:
-        #         query["timestamp"] = {"$gte": start_date, "$lte": end_of_day}
-        #     return list(self.collection.find(query).sort("timestamp", 1)) # Opcional: ordenar por timestamp
-        #
-        # Si no modificas `data_logger.py`, esta función seguirá obteniendo *todo* el historial
-        # y filtrando en Python, lo cual es menos eficiente pero funcionará.
-        # *** FIN IMPORTANTE ***
-
-        # Obtener todas las entradas y luego filtrar por fecha en Python
-        # (Idealmente, get_food_entries filtraría esto directamente de la DB)
-        all_entries = data_logger.get_food_entries()
-        entries_for_date = []
-        for entry in all_entries:
-            if 'timestamp' in entry and isinstance(entry['timestamp'], datetime):
-                # Compara si el timestamp de la entrada está dentro del rango del día
-                if start_of_day <= entry['timestamp'] <= end_of_day:
-                    entries_for_date.append(entry)
-
-        serialized_entries = []
-        for entry in entries_for_date:
-            serialized_entry = entry.copy()
-
-            if '_id' in serialized_entry:
-                serialized_entry['_id'] = str(serialized_entry['_id'])
-
-            if 'timestamp' in serialized_entry and isinstance(serialized_entry['timestamp'], datetime):
-                serialized_entry['timestamp'] = serialized_entry['timestamp'].isoformat()
-
-            # Asegurar que los campos numéricos sean floats
-            for key in ["calorias_totales", "proteinas_totales", "grasas_totales", "carbohidratos_totales"]:
-                if key in serialized_entry and not isinstance(serialized_entry[key], (float, int)):
-                    try:
-                        serialized_entry[key] = float(serialized_entry[key])
-                    except (ValueError, TypeError):
-                        serialized_entry[key] = 0.0
-
-            if "alimentos_detallados" in serialized_entry:
-                for food_item in serialized_entry["alimentos_detallados"]:
-                    if "nutrientes" in food_item:
-                        for nutrient_key in ["calorias", "proteinas", "grasas", "carbohidratos"]:
-                            if nutrient_key in food_item["nutrientes"] and not isinstance(
-                                    food_item["nutrientes"][nutrient_key], (float, int)):
-                                try:
-                                    food_item["nutrientes"][nutrient_key] = float(food_item["nutrientes"][nutrient_key])
-                                except (ValueError, TypeError):
-                                    food_item["nutrientes"][nutrient_key] = 0.0
-
-            serialized_entries.append(serialized_entry)
-
-        # Opcional: Ordenar las entradas por timestamp antes de enviarlas
-        # Collections.sort(serialized_entries, key=lambda x: x.get('timestamp', '')) # Esto asume que timestamp es comparable
-        # Mejor ordenarlo por el objeto datetime real si se modifica get_food_entries para devolverlos así
-        # O si ya están ordenados por la consulta a MongoDB.
-
-        return jsonify(serialized_entries), 200
+        entries, next_cursor = data_logger.stream_food_entries_page(
+            limit, cursor=request.args.get('cursor'), projection=projection,
+            start_date=start_date, end_date=end_date)
+    except InvalidCursorError as e:
+        return jsonify({"error": str(e)}), 400
 
-    except ValueError:
-        return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD."}), 400
+    try:
+        return history_page_response('get_food_history_by_date_endpoint', entries, next_cursor)
     except Exception as e:
         print(f"❌ Error al obtener el historial por fecha: {e}")
         import traceback
@@ -440,54 +475,130 @@ def get_food_history_by_date_endpoint():
         return jsonify({"error": "Error interno del servidor al obtener historial por fecha."}), 500
 
 
+# Valores aceptados en el parámetro 'agrupar' de /resumen -> periodo de DataLogger.get_nutrition_summary
+SUMMARY_PERIODS = {"dia": "day", "semana": "week", "mes": "month"}
+
+
+@app.route('/resumen', methods=['GET'])
+def get_nutrition_summary_endpoint():
+    """
+    Endpoint con los totales nutricionales agregados por periodo en una sola consulta.
+    Parámetros de query:
+    - date, o desde / hasta: igual que en /historial_por_fecha (máximo SUMMARY_MAX_RANGE_DAYS días).
+    - agrupar (opcional): "dia" (por defecto), "semana" (ISO, ej. "2026-W42") o "mes".
+    - por_comida (opcional): "1" para separar cada periodo por meal_type.
+    - meal_type (opcional): limitar el resumen a una sección de comida.
+    - tz (opcional): zona horaria IANA en la que se interpretan los días y se agrupan los periodos.
+    Solo se devuelven los periodos que tienen alguna comida registrada.
+    """
+    period_param = request.args.get('agrupar', 'dia')
+    if period_param not in SUMMARY_PERIODS:
+        return jsonify({"error": f"Parámetro 'agrupar' inválido. Valores permitidos: {', '.join(SUMMARY_PERIODS)}."}), 400
+
+    try:
+        first_day, last_day = parse_day_range(request.args, SUMMARY_MAX_RANGE_DAYS)
+        tz = parse_timezone(request.args.get('tz'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    meal_type = request.args.get('meal_type')
+    if meal_type and meal_type not in FOOD_SECTIONS:
+        return jsonify({"error": f"meal_type inválido. Valores permitidos: {', '.join(FOOD_SECTIONS)}."}), 400
+
+    start_date, end_date = day_range_bounds(first_day, last_day, tz)
+    data_logger.flush(MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS)
+    summary = data_logger.get_nutrition_summary(
+        start_date, end_date,
+        period=SUMMARY_PERIODS[period_param],
+        by_meal_type=request.args.get('por_comida') in ('1', 'true'),
+        meal_type=meal_type,
+        timezone_shift=timezone_shift(tz, start_date))
+    if summary is None:
+        if not data_logger.is_healthy():
+            return jsonify({"error": "Base de datos no disponible, inténtalo de nuevo más tarde."}), 503
+        return jsonify({"error": "Error interno del servidor al calcular el resumen."}), 500
+
+    return jsonify({
+        "desde": first_day.isoformat(),
+        "hasta": last_day.isoformat(),
+        "agrupar": period_param,
+        "tz": request.args.get('tz'),
+        "periodos": summary
+    }), 200
+
+
 @app.route('/saludo', methods=['GET'])
 def saludo():
     """Endpoint simple para verificar que la API está funcionando."""
     return jsonify({"mensaje": "¡Hola desde FoodScan Backend! La API está funcionando."}), 200
 
 
-# --- NUEVO ENDPOINT PARA LA PÁGINA WEB ---
-@app.route('/web_historial', methods=['GET'])
-def web_historial():
+@app.route('/estadisticas', methods=['GET'])
+def estadisticas():
+    """Endpoint de diagnóstico con las estadísticas de las cachés internas."""
+    return jsonify({
+        "food_match_cache": get_food_match_cache_stats(),
+        "analysis_cache": gemini_analyzer.cache.stats() if gemini_analyzer.cache else None,
+        "openrouter": gemini_analyzer.client.stats(),
+        "job_queue": job_queue.stats(),
+        "storage": data_logger.get_health(),
+        "storage_indexes": data_logger.get_index_stats(),
+        "history_response_cache": response_cache.stats() if response_cache else None,
+        "write_behind": data_logger.get_write_behind_stats()
+    }), 200
+
+
+@app.route('/imagenes/<string:image_hash>/<int:size>', methods=['GET'])
+def imagen_miniatura(image_hash, size):
     """
-    Endpoint para mostrar el historial de comidas en una página web.
+    Miniatura (WebP por defecto) de una foto analizada, con lado máximo 'size' (uno de THUMBNAIL_SIZES).
+    La URL depende del contenido de la foto, así que la respuesta no cambia nunca: se sirve con caché
+    de larga duración e 'immutable'. Si la miniatura aún no existe, se genera en el momento.
     """
-    try:
-        entries = data_logger.get_food_entries()
+    image_hash = image_hash.lower()
+    if not ImageManager.is_valid_hash(image_hash) or size not in image_manager.thumbnail_sizes:
+        return jsonify({"error": "Imagen o tamaño no válido."}), 404
 
-        # Procesar las entradas para que sean más fáciles de consumir en Jinja2
-        # y manejar los tipos de datos de MongoDB (ObjectId, datetime)
-        processed_entries = []
-        for entry in entries:
-            # Crea una copia para no modificar el objeto original de MongoDB
-            display_entry = entry.copy()
+    thumbnail_path = image_manager.get_thumbnail(image_hash, size)
+    if thumbnail_path is None:
+        return jsonify({"error": "Imagen no encontrada."}), 404
 
-            if '_id' in display_entry and isinstance(display_entry['_id'], ObjectId):
-                display_entry['_id'] = str(display_entry['_id'])
+    response = send_file(thumbnail_path, mimetype=image_manager.thumbnail_mime_type,
+                         max_age=THUMBNAIL_CACHE_MAX_AGE_SECONDS, conditional=True, etag=True)
+    response.headers["Cache-Control"] = f"public, max-age={THUMBNAIL_CACHE_MAX_AGE_SECONDS}, immutable"
+    return response
 
-            if 'timestamp' in display_entry and isinstance(display_entry['timestamp'], datetime):
-                # Formatear la fecha y hora para una visualización amigable
-                display_entry['formatted_timestamp'] = display_entry['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                display_entry['formatted_timestamp'] = "Fecha desconocida"
 
-            # Asegurar que los totales sean flotantes y con 2 decimales para la visualización
-            for key in ["calorias_totales", "proteinas_totales", "grasas_totales", "carbohidratos_totales"]:
-                display_entry[key] = round(float(display_entry.get(key, 0.0)), 2)
-
-            if "alimentos_detallados" in display_entry:
-                for food_item in display_entry["alimentos_detallados"]:
-                    if "nutrientes" in food_item:
-                        for nutrient_key in ["calorias", "proteinas", "grasas", "carbohidratos"]:
-                            food_item["nutrientes"][nutrient_key] = round(
-                                float(food_item["nutrientes"].get(nutrient_key, 0.0)), 2)
+# --- NUEVO ENDPOINT PARA LA PÁGINA WEB ---
+def web_history_page():
+    """
+    Lee una página del historial para la web según 'limit' y 'cursor' (como /historial).
+    Devuelve (entradas listas para la plantilla, next_cursor, limit indicado por el usuario o None).
+    Lanza ValueError o InvalidCursorError si los parámetros no son válidos.
+    """
+    raw_limit = request.args.get('limit')
+    limit = parse_page_limit(raw_limit)
+    entries, next_cursor = data_logger.get_food_entries_page(limit, cursor=request.args.get('cursor'))
+    # Ya vienen ordenadas por fecha descendente (más recientes primero) desde la consulta por clave
+    return [to_display_entry(entry) for entry in entries], next_cursor, raw_limit or None
 
-            processed_entries.append(display_entry)
 
-        # Ordenar las entradas por fecha descendente (más recientes primero)
-        processed_entries.sort(key=lambda x: x.get('timestamp', datetime.min), reverse=True)
+@app.route('/web_historial', methods=['GET'])
+@cached_history_view
+def web_historial():
+    """
+    Endpoint para mostrar el historial de comidas en una página web.
+    Solo se renderiza la primera página (o la indicada por 'cursor'); las siguientes las pide
+    la propia página al hacer scroll a /web_historial/fragmento.
+    """
+    try:
+        entries, next_cursor, limit = web_history_page()
+    except (ValueError, InvalidCursorError) as e:
+        return f"<h1>Parámetros no válidos.</h1><p>{escape(str(e))}</p>", 400
 
-        return render_template('web_history.html', entries=processed_entries)
+    try:
+        return render_template('web_history.html', entries=entries, next_cursor=next_cursor, limit=limit,
+                               thumbnail_sizes=image_manager.thumbnail_sizes)
     except Exception as e:
         print(f"❌ Error al generar la página web de historial: {e}")
         import traceback
@@ -495,6 +606,31 @@ def web_historial():
         return "<h1>Error al cargar el historial de comidas.</h1><p>Por favor, revisa los logs del servidor.</p>", 500
 
 
+@app.route('/web_historial/fragmento', methods=['GET'])
+@cached_history_view
+def web_historial_fragment():
+    """
+    Fragmento HTML con las tarjetas de una página del historial (parámetros 'cursor' y 'limit'),
+    seguido del marcador de la página siguiente si la hay. Lo usa el scroll infinito de /web_historial.
+    Cada fragmento se guarda en la caché de respuestas por cursor hasta la siguiente escritura.
+    """
+    try:
+        entries, next_cursor, limit = web_history_page()
+    except (ValueError, InvalidCursorError) as e:
+        return escape(str(e)), 400
+
+    try:
+        html = render_template('_history_entries.html', entries=entries, next_cursor=next_cursor, limit=limit,
+                               thumbnail_sizes=image_manager.thumbnail_sizes)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return Response(html, status=200, mimetype='text/html', headers=headers)
+    except Exception as e:
+        print(f"❌ Error al generar el fragmento del historial: {e}")
+        import traceback
+        traceback.print_exc()
+        return "Error al cargar más entradas.", 500
+
+
 if __name__ == '__main__':
     print("🚀 Iniciando servidor Flask. Accede a http://127.0.0.1:5000/saludo para probar.")
     print("🌐 Para ver el historial web, accede a http://127.0.0.1:5000/web_historial")
@@ -0,0 +1,387 @@
+# src/backfill.py
+"""
+Reanálisis masivo de fotos de comidas archivadas (ej. tras cambiar de modelo o la BD de alimentos).
+
+    python -m src.backfill fotos/2025/              # Recorre el árbol de carpetas
+    python -m src.backfill --processed              # Imágenes de processed_images/
+    python -m src.backfill --store                  # Imágenes del almacén por contenido con estado "processed"
+    python -m src.backfill fotos/ --rate 1 --concurrency 8 --dry-run
+
+Cada imagen se analiza con GeminiAnalyzer (con --concurrency análisis a la vez y como mucho --rate
+llamadas por segundo a la API; los aciertos de la caché de análisis no cuentan), se cruza con la BD
+local y se registra con log_food_entries, en lotes de --batch-size. Con --mode replace (por defecto)
+la nueva entrada sustituye a las que ya hubiera de la misma imagen (mismo image_hash): conserva su sección
+y su fecha, y las anteriores se borran con delete_food_entry para mantener los totales diarios y la versión
+del historial; --mode append las conserva y añade una entrada más.
+
+El progreso se guarda en --state al escribir cada lote: si se interrumpe (Ctrl+C, caída...), basta con
+volver a lanzar el mismo comando para continuar donde se quedó. Las imágenes cuyo análisis falló
+quedan marcadas y no se reintentan salvo con --retry-errors; --reset empieza de cero.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from src.config import STORAGE_BACKEND, PROCESSED_IMAGE_DIR, INGEST_DEFAULT_MEAL_TYPE, FOOD_SECTIONS
+from src.config import BACKFILL_CONCURRENCY, BACKFILL_RATE_PER_SECOND, BACKFILL_BATCH_SIZE, BACKFILL_STATE_PATH
+from src.image_manager import ImageManager, INPUT_IMAGE_EXTENSIONS, STATUS_PROCESSED
+from src.ingest_daemon import meal_type_for
+
+STATE_VERSION = 1
+STATE_OK = "ok"
+STATE_ERROR = "error"
+
+# Imagen por reanalizar. key identifica la imagen en el archivo de estado (ruta absoluta o hash del almacén);
+# image_hash solo se conoce de antemano para las imágenes del almacén: el resto lo calcula _analyze.
+BackfillItem = namedtuple("BackfillItem", ["key", "path", "image_name", "image_hash", "meal_type"])
+
+
+class RateLimiter:
+    """Limitador de llamadas por segundo (cubeta de fichas) compartido por varios hilos. rate <= 0 desactiva el límite."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class BackfillState:
+    """Progreso de un reanálisis en un archivo JSON: clave de cada imagen terminada → "ok" o "error"."""
+
+    def __init__(self, path, sources, reset=False):
+        self.path = path
+        self.sources = sources
+        self.done = {}
+        self.created_at = datetime.now().isoformat()
+        if reset or not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != STATE_VERSION:
+            raise ValueError(f"Versión de archivo de estado no soportada en {path}: {data.get('version')}")
+        if data.get("sources") != sources:
+            print(f"⚠️ El archivo de estado {path} es de otro origen ({', '.join(data.get('sources') or [])}); "
+                  f"se reutiliza igualmente. Usa --reset o --state para empezar de cero.")
+        self.done = data.get("done", {})
+        self.created_at = data.get("created_at", self.created_at)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": STATE_VERSION,
+                "sources": self.sources,
+                "created_at": self.created_at,
+                "updated_at": datetime.now().isoformat(),
+                "done": self.done,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)  # Escritura atómica: una interrupción nunca deja el estado a medias
+
+
+def guess_meal_type(path, default):
+    """Sección de comida por el prefijo del nombre ("cena_1.jpg") o por la carpeta ("cena/1.jpg"), o default."""
+    return (meal_type_for(os.path.basename(path), default=None)
+            or meal_type_for(os.path.basename(os.path.dirname(path)), default=default))
+
+
+def iter_directory_items(root, default_meal_type):
+    """Imágenes de un árbol de carpetas, en orden estable (para que el progreso sea comparable entre ejecuciones)."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(INPUT_IMAGE_EXTENSIONS) and not name.startswith('.'):
+                path = os.path.abspath(os.path.join(dirpath, name))
+                yield BackfillItem(path, path, name, None, guess_meal_type(path, default_meal_type))
+
+
+def iter_store_items(image_manager, statuses, default_meal_type):
+    """Imágenes del almacén por contenido cuyo estado esté en statuses (todas si statuses está vacío)."""
+    for dirpath, dirnames, filenames in os.walk(image_manager.store_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not ImageManager.is_valid_hash(name):
+                continue  # Metadatos (.json) y miniaturas
+            metadata = image_manager.get_metadata(name) or {}
+            if statuses and metadata.get("status") not in statuses:
+                continue
+            image_name = f"{name}{metadata.get('extension', '')}"
+            yield BackfillItem(name, os.path.join(dirpath, name), image_name, name, default_meal_type)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+class Backfill:
+    """
+    Reanaliza una lista de imágenes con un pool acotado de hilos y registra los resultados por lotes.
+    Solo el hilo principal escribe en la base de datos y en el archivo de estado.
+    """
+
+    def __init__(self, gemini_analyzer, data_logger, state, concurrency=BACKFILL_CONCURRENCY,
+                 rate_per_second=BACKFILL_RATE_PER_SECOND, batch_size=BACKFILL_BATCH_SIZE,
+                 log_time="mtime", progress_interval=5.0, mode="replace"):
+        self.gemini_analyzer = gemini_analyzer
+        self.data_logger = data_logger
+        self.state = state
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.batch_size = batch_size
+        self.log_time = log_time
+        self.progress_interval = progress_interval
+        self.mode = mode
+        self._results = []  # (item, análisis) terminados y aún sin registrar
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(concurrency * 2)  # Análisis en cola o en curso
+        self.total = 0
+        self.logged = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.replaced = 0
+        self.started_at = None
+
+    def _analyze(self, item):
+        """Análisis de una imagen; nunca lanza (los errores se devuelven como resultado con 'error')."""
+        try:
+            item = item._replace(image_hash=item.image_hash or ImageManager.compute_hash(item.path))
+            analysis = self.gemini_analyzer.analyze_image(item.path, image_hash=item.image_hash,
+                                                          rate_limiter=self.rate_limiter)
+        except Exception as e:
+            print(f"❌ Backfill: Error inesperado al analizar {item.path}: {e}")
+            traceback.print_exc()
+            analysis = {"error": f"Error inesperado en el análisis: {e}"}
+        with self._lock:
+            self._results.append((item, analysis))
+        self._in_flight.release()
+
+    def _take_results(self):
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def _write_batch(self, results):
+        """
+        Registra un lote de análisis con una sola escritura masiva y guarda el progreso.
+        En modo "replace" la nueva entrada conserva la sección y la fecha de la más reciente de las anteriores
+        de la misma imagen, y después se borran las anteriores (solo de las registradas: si la escritura
+        falla, se conservan). Devuelve False si no se registró nada.
+        """
+        # Importado aquí para que el módulo (y --help) no arrastre la BD local de alimentos
+        from src.meal_pipeline import MealPipeline
+
+        previous = {}
+        if self.mode == "replace":
+            image_hashes = {item.image_hash for item, analysis in results
+                            if item.image_hash and analysis and not analysis.get("error")}
+            previous = self.data_logger.get_entries_by_image_hash(image_hashes) if image_hashes else {}
+            if previous is None:
+                print("❌ Backfill: No se pudieron buscar las entradas anteriores del lote; no se registra para no duplicarlas.")
+                return False
+
+        entries = []
+        written_items = []
+        batch_hashes = set()
+        for item, analysis in results:
+            if not analysis or analysis.get("error"):
+                print(f"🟥 Backfill: Análisis fallido de {item.path}: {(analysis or {}).get('error')}")
+                self.state.done[item.key] = STATE_ERROR
+                self.errors += 1
+                continue
+            if self.mode == "replace" and item.image_hash in batch_hashes:
+                # Copia idéntica de otra imagen del lote: tendría la misma entrada
+                print(f"♻️ Backfill: {item.path} es la misma imagen que otra del lote; se omite.")
+                self.state.done[item.key] = STATE_OK
+                self.logged += 1
+                continue
+            batch_hashes.add(item.image_hash)
+            if analysis.get("cache_status") == "hit":
+                self.cache_hits += 1
+            full_meal_data_for_db, _ = MealPipeline.build_entry(analysis)
+            full_meal_data_for_db["image_hash"] = item.image_hash
+            replaced_entries = previous.get(item.image_hash)
+            if replaced_entries:
+                # Sustituye a una entrada ya registrada: la comida sigue siendo la misma sección y la misma hora
+                meal_type = replaced_entries[0]["meal_type"]
+                log_time = replaced_entries[0]["timestamp"]
+            else:
+                meal_type = item.meal_type
+                log_time = datetime.fromtimestamp(os.path.getmtime(item.path)) if self.log_time == "mtime" else datetime.now()
+            entries.append({
+                "analysis_result": full_meal_data_for_db,
+                "image_name": item.image_name,
+                "meal_type": meal_type,
+                "log_time": log_time,
+            })
+            written_items.append(item)
+
+        logged = self.data_logger.log_food_entries(entries)
+        for item, success in zip(written_items, logged):
+            if success:
+                for replaced_entry in previous.get(item.image_hash, []):
+                    if self.data_logger.delete_food_entry(replaced_entry["_id"]):
+                        self.replaced += 1
+                self.state.done[item.key] = STATE_OK  # Las no registradas se reintentan en la próxima ejecución
+                self.logged += 1
+        self.state.save()
+        return not entries or any(logged)
+
+    def report_progress(self, final=False):
+        finished = self.logged + self.errors
+        elapsed = time.monotonic() - self.started_at
+        throughput = finished / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - finished
+        eta = format_duration(remaining / throughput) if throughput > 0 else "?"
+        percent = 100 * finished / self.total if self.total else 100.0
+        print(f"{'✅' if final else '⏳'} Backfill: {finished}/{self.total} ({percent:.1f}%) · "
+              f"{throughput * 60:.1f} img/min · {'tiempo ' + format_duration(elapsed) if final else 'ETA ' + eta} · "
+              f"{self.errors} errores · {self.cache_hits} desde caché · {self.replaced} entradas reemplazadas")
+
+    def run(self, items):
+        """Procesa items (ya sin los terminados). Devuelve True si terminó, False si se interrumpió o falló la base de datos."""
+        self.total = len(items)
+        self.started_at = time.monotonic()
+        last_report = self.started_at
+        completed = True
+
+        def maybe_report():
+            nonlocal last_report
+            if time.monotonic() - last_report >= self.progress_interval:
+                self.report_progress()
+                last_report = time.monotonic()
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="foodscan-backfill")
+        try:
+            for item in items:
+                # Contrapresión: no se encolan más análisis mientras haya demasiados pendientes
+                while not self._in_flight.acquire(timeout=0.5):
+                    maybe_report()
+                executor.submit(self._analyze, item)
+                with self._lock:
+                    ready = len(self._results) >= self.batch_size
+                if ready and not self._write_batch(self._take_results()):
+                    print("❌ Backfill: No se pudo registrar ningún resultado del lote; se detiene. "
+                          "Vuelve a ejecutar el mismo comando para continuar.")
+                    completed = False
+                    break
+                maybe_report()
+        except KeyboardInterrupt:
+            print("\n⚠️ Backfill: Interrumpido; se registran los análisis en curso y se guarda el progreso...")
+            completed = False
+        finally:
+            executor.shutdown(wait=True, cancel_futures=not completed)  # Si se interrumpe, no se empiezan más análisis
+            results = self._take_results()
+            while results:
+                self._write_batch(results[:self.batch_size])
+                results = results[self.batch_size:]
+            self.state.save()
+        self.report_progress(final=completed)
+        return completed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reanaliza y registra de forma masiva fotos de comidas archivadas.")
+    parser.add_argument("paths", nargs="*", help="Carpetas a recorrer (recursivamente).")
+    parser.add_argument("--processed", action="store_true", help=f"Incluye {PROCESSED_IMAGE_DIR}.")
+    parser.add_argument("--store", action="store_true", help="Incluye las imágenes del almacén por contenido.")
+    parser.add_argument("--store-status", default=STATUS_PROCESSED,
+                        help="Estados del almacén a incluir, separados por comas; vacío = todos (por defecto 'processed').")
+    parser.add_argument("--meal-type", default=INGEST_DEFAULT_MEAL_TYPE, choices=FOOD_SECTIONS,
+                        help="Sección si no se deduce del nombre del archivo o de su carpeta "
+                             "(con --mode replace, las que sustituyen a otra conservan su sección).")
+    parser.add_argument("--mode", choices=["replace", "append"], default="replace",
+                        help="replace (por defecto): la nueva entrada sustituye a las anteriores de la misma imagen; "
+                             "append: se añade sin borrar nada.")
+    parser.add_argument("--log-time", choices=["mtime", "now"], default="mtime",
+                        help="Fecha de las entradas: la de modificación del archivo (por defecto) o la actual. "
+                             "Con --mode replace, las que sustituyen a otra conservan su fecha.")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY,
+                        help=f"Análisis simultáneos (por defecto {BACKFILL_CONCURRENCY}).")
+    parser.add_argument("--rate", type=float, default=BACKFILL_RATE_PER_SECOND,
+                        help=f"Llamadas por segundo a Gemini, 0 = sin límite (por defecto {BACKFILL_RATE_PER_SECOND}).")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE,
+                        help=f"Entradas por escritura masiva (por defecto {BACKFILL_BATCH_SIZE}).")
+    parser.add_argument("--state", default=BACKFILL_STATE_PATH, help=f"Archivo de progreso (por defecto {BACKFILL_STATE_PATH}).")
+    parser.add_argument("--reset", action="store_true", help="Ignora el progreso guardado y empieza de cero.")
+    parser.add_argument("--retry-errors", action="store_true", help="Vuelve a analizar las imágenes que fallaron.")
+    parser.add_argument("--limit", type=int, help="Procesa como mucho este número de imágenes.")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Segundos entre informes de progreso.")
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta las imágenes pendientes.")
+    args = parser.parse_args(argv)
+
+    if not args.paths and not args.processed and not args.store:
+        parser.error("indica al menos una carpeta, --processed o --store")
+    for path in args.paths:
+        if not os.path.isdir(path):
+            parser.error(f"no es una carpeta: {path}")
+
+    sources = [os.path.abspath(path) for path in args.paths]
+    if args.processed:
+        sources.append(PROCESSED_IMAGE_DIR)
+    try:
+        state = BackfillState(args.state, sources + (["store"] if args.store else []), reset=args.reset)
+    except (OSError, ValueError) as e:
+        print(f"❌ No se pudo leer el archivo de estado {args.state}: {e}")
+        return 2
+
+    items = []
+    for source in sources:
+        items.extend(iter_directory_items(source, args.meal_type))
+    if args.store:
+        statuses = {status.strip() for status in args.store_status.split(",") if status.strip()}
+        items.extend(iter_store_items(ImageManager(), statuses, args.meal_type))
+
+    skip = {STATE_OK} if args.retry_errors else {STATE_OK, STATE_ERROR}
+    pending = [item for item in items if state.done.get(item.key) not in skip]
+    print(f"🗂️ Backfill: {len(items)} imágenes encontradas, {len(items) - len(pending)} ya procesadas, "
+          f"{len(pending)} por procesar.")
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    if args.dry_run or not pending:
+        return 0
+
+    # Importados aquí para que --help y --dry-run no conecten con la base de datos ni configuren Gemini
+    from src.data_logger import create_data_logger
+    from src.gemini_analyzer import GeminiAnalyzer
+
+    data_logger = create_data_logger(STORAGE_BACKEND)
+    try:
+        if not data_logger.is_healthy():
+            print("❌ No hay conexión con la base de datos.")
+            return 2
+        backfill = Backfill(GeminiAnalyzer(), data_logger, state, concurrency=args.concurrency,
+                            rate_per_second=args.rate, batch_size=args.batch_size, log_time=args.log_time,
+                            progress_interval=args.progress_interval, mode=args.mode)
+        return 0 if backfill.run(pending) else 1
+    finally:
+        data_logger.close_connection()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
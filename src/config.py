@@ -9,22 +9,121 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "foodscan_db")
 MONGO_COLLECTION_NAME = os.getenv("MONGO_COLLECTION_NAME", "food_entries")
+MONGO_MANAGE_INDEXES = os.getenv("MONGO_MANAGE_INDEXES", "true").lower() in ("1", "true", "yes")  # Crear índices al conectar
+# Pool de conexiones y timeouts del MongoClient (milisegundos)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))  # Espera máxima por una conexión libre del pool
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+# Preferencia de lectura ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest").
+# Leer de secundarios puede devolver un historial ligeramente desfasado respecto a la última escritura.
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+# Write concern: número de nodos o "majority", confirmación en el journal y espera máxima
+MONGO_WRITE_CONCERN_W = os.getenv("MONGO_WRITE_CONCERN_W", "1")
+MONGO_WRITE_CONCERN_JOURNAL = os.getenv("MONGO_WRITE_CONCERN_JOURNAL", "false").lower() in ("1", "true", "yes")
+MONGO_WRITE_CONCERN_WTIMEOUT_MS = int(os.getenv("MONGO_WRITE_CONCERN_WTIMEOUT_MS", "5000"))
+# Reconexión en segundo plano (backoff exponencial) mientras MongoDB no responde
+MONGO_RECONNECT_BACKOFF_BASE_SECONDS = float(os.getenv("MONGO_RECONNECT_BACKOFF_BASE_SECONDS", "1.0"))
+MONGO_RECONNECT_BACKOFF_MAX_SECONDS = float(os.getenv("MONGO_RECONNECT_BACKOFF_MAX_SECONDS", "30.0"))
+# Colección con los totales diarios por meal_type, mantenida en cada escritura/borrado (ver src/rollups.py)
+MONGO_ROLLUP_COLLECTION_NAME = os.getenv("MONGO_ROLLUP_COLLECTION_NAME", "daily_rollups")
+DAILY_ROLLUPS_ENABLED = os.getenv("DAILY_ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Colección con el contador de versión del historial (ETag de los endpoints de historial)
+MONGO_COUNTERS_COLLECTION_NAME = os.getenv("MONGO_COUNTERS_COLLECTION_NAME", "counters")
+# Colección con el estado de los trabajos de /analizar?async=1, compartido entre procesos (ver LocalJobQueue)
+MONGO_JOBS_COLLECTION_NAME = os.getenv("MONGO_JOBS_COLLECTION_NAME", "analysis_jobs")
+# Escritura diferida de log_food_entry: las entradas se encolan y se insertan por lotes en segundo plano
+MONGO_WRITE_BEHIND_ENABLED = os.getenv("MONGO_WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+MONGO_WRITE_BEHIND_MAX_QUEUE = int(os.getenv("MONGO_WRITE_BEHIND_MAX_QUEUE", "1000"))
+MONGO_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("MONGO_WRITE_BEHIND_BATCH_SIZE", "50"))
+MONGO_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = float(os.getenv("MONGO_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", "0.5"))
+MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS = float(os.getenv("MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS", "5"))  # Espera máxima de flush() en lecturas
 
 # --- Configuración de OpenRouter API para Gemini ---
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 GEMINI_MODEL_NAME = "google/gemini-2.5-flash-preview"
 
+# Cliente HTTP de OpenRouter: pool keep-alive, reintentos con backoff y circuito
+OPENROUTER_POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "10"))
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "3"))
+OPENROUTER_BACKOFF_BASE_SECONDS = float(os.getenv("OPENROUTER_BACKOFF_BASE_SECONDS", "1.0"))
+OPENROUTER_BACKOFF_MAX_SECONDS = float(os.getenv("OPENROUTER_BACKOFF_MAX_SECONDS", "20.0"))
+OPENROUTER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENROUTER_READ_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_READ_TIMEOUT_SECONDS", "60"))
+OPENROUTER_TOTAL_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_TOTAL_TIMEOUT_SECONDS", "90"))  # Plazo total de una llamada, reintentos incluidos
+OPENROUTER_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("OPENROUTER_CIRCUIT_FAILURE_THRESHOLD", "5"))
+OPENROUTER_CIRCUIT_RESET_SECONDS = float(os.getenv("OPENROUTER_CIRCUIT_RESET_SECONDS", "30"))
+
 # Asegúrate de que la API Key esté cargada
 if not OPENROUTER_API_KEY:
     raise ValueError("OPENROUTER_API_KEY no encontrada en el archivo .env. Por favor, configúrala.")
 
+# --- Caché de análisis por contenido de imagen (evita repetir llamadas a OpenRouter) ---
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "256"))
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))  # 0 = sin expiración
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR")  # Si se define, la caché también se persiste en disco
+
+# --- Preprocesado de imágenes antes de enviarlas a Gemini ---
+IMAGE_MAX_EDGE_PX = int(os.getenv("IMAGE_MAX_EDGE_PX", "1024"))  # Lado máximo de la imagen enviada
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG")  # "JPEG" o "WEBP"
+IMAGE_PASSTHROUGH_MAX_BYTES = int(os.getenv("IMAGE_PASSTHROUGH_MAX_BYTES", "300000"))  # Imágenes menores se envían tal cual
+
+# --- Miniaturas de las fotos de comidas (historial web y móvil, endpoint /imagenes/<hash>/<tamaño>) ---
+THUMBNAIL_SIZES = [int(size) for size in os.getenv("THUMBNAIL_SIZES", "128,512").split(",") if size.strip()]  # Lado máximo en px
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP")  # "WEBP" o "JPEG"
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))  # Hilos que generan miniaturas en segundo plano
+THUMBNAIL_CACHE_MAX_AGE_SECONDS = int(os.getenv("THUMBNAIL_CACHE_MAX_AGE_SECONDS", "31536000"))  # Cache-Control de /imagenes
+
+# --- Modo asíncrono de /analizar (cola de trabajos en segundo plano) ---
+# Solo "local" por ahora: los trabajos se ejecutan en el proceso que los recibe y su estado se comparte
+# a través de STORAGE_BACKEND, así que funciona con varios workers de gunicorn
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "local")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # Análisis simultáneos
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "32"))  # Trabajos en espera antes de responder 503
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))  # Cuánto se guarda el resultado
+
+# --- Análisis por lotes (/analizar_lote) ---
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "20"))  # Imágenes por solicitud
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))  # Llamadas simultáneas a Gemini en lotes
+
+# --- Paginación del historial ---
+HISTORY_DEFAULT_PAGE_SIZE = int(os.getenv("HISTORY_DEFAULT_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+# Número máximo de días que puede abarcar una consulta de /historial_por_fecha con desde/hasta
+HISTORY_MAX_RANGE_DAYS = int(os.getenv("HISTORY_MAX_RANGE_DAYS", "366"))
+# Número máximo de días que puede abarcar una consulta de /resumen
+SUMMARY_MAX_RANGE_DAYS = int(os.getenv("SUMMARY_MAX_RANGE_DAYS", "1830"))
+# Caché en memoria de las respuestas de /historial, /historial_por_fecha y /web_historial
+HISTORY_RESPONSE_CACHE_ENABLED = os.getenv("HISTORY_RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+HISTORY_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_RESPONSE_CACHE_MAX_ENTRIES", "128"))
+HISTORY_RESPONSE_CACHE_MAX_BODY_BYTES = int(os.getenv("HISTORY_RESPONSE_CACHE_MAX_BODY_BYTES", "2000000"))
+
 # --- Configuración del monitoreo de imágenes (mantener para ImageManager, aunque Flask recibe directo) ---
-MONITOR_INTERVAL_SECONDS = 5 # Mantener si se usa para otras partes, pero no crítico para Flask API
+MONITOR_INTERVAL_SECONDS = float(os.getenv("MONITOR_INTERVAL_SECONDS", "5"))  # Recorrido de input_images/ cuando no hay inotify
+
+# --- Caché de coincidencias con la base de datos local de alimentos ---
+FOOD_MATCH_CACHE_SIZE = int(os.getenv("FOOD_MATCH_CACHE_SIZE", "2048"))  # Nombres normalizados en caché (0 = sin caché)
 
 # --- Secciones de comida ---
 FOOD_SECTIONS = ["desayuno", "almuerzo", "aperitivo", "cena"] # ¡APERITIVO AÑADIDO Y CENA EN LUGAR DE ONCE!
 
+# --- Demonio de ingesta de input_images/ (python -m src.ingest_daemon) ---
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))  # Imágenes que se procesan a la vez
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "32"))  # Cola interna; llena, se deja de leer la carpeta
+INGEST_SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", "1"))  # Al recorrer la carpeta, ignora archivos modificados hace menos
+INGEST_RESCAN_SECONDS = float(os.getenv("INGEST_RESCAN_SECONDS", "60"))  # Recorrido de seguridad aunque haya inotify
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))  # Intentos si falla el registro (ej. base de datos caída)
+INGEST_RETRY_DELAY_SECONDS = float(os.getenv("INGEST_RETRY_DELAY_SECONDS", "5"))
+# Sección de las imágenes cuyo nombre no empieza por una de FOOD_SECTIONS (ej. "cena_foto.jpg")
+INGEST_DEFAULT_MEAL_TYPE = os.getenv("INGEST_DEFAULT_MEAL_TYPE", FOOD_SECTIONS[0])
+
 # Rutas de imágenes (relativas al directorio raíz del proyecto)
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..')) # La raíz del proyecto FoodScan
 
@@ -32,7 +131,21 @@ INPUT_IMAGE_DIR = os.path.join(BASE_DIR, 'images', 'input_images')
 PROCESSING_IMAGE_DIR = os.path.join(BASE_DIR, 'images', 'processing_images')
 PROCESSED_IMAGE_DIR = os.path.join(BASE_DIR, 'images', 'processed_images')
 ERROR_IMAGE_DIR = os.path.join(BASE_DIR, 'images', 'error_images')
+# Almacén de imágenes por contenido (SHA-256): cada imagen se guarda una sola vez (ver ImageManager)
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(BASE_DIR, 'images', 'store'))
+
+# --- Almacenamiento del historial ---
+# "mongo" (servidor MongoDB, ver MONGO_*) o "sqlite" (archivo local embebido, sin servidor)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(BASE_DIR, 'data', 'foodscan.db'))
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", "5"))  # Espera máxima si otro proceso está escribiendo
+
+# --- Reanálisis masivo de fotos archivadas (python -m src.backfill) ---
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))  # Análisis simultáneos
+BACKFILL_RATE_PER_SECOND = float(os.getenv("BACKFILL_RATE_PER_SECOND", "2"))  # Llamadas a Gemini por segundo (0 = sin límite)
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "50"))  # Entradas por escritura masiva
+BACKFILL_STATE_PATH = os.getenv("BACKFILL_STATE_PATH", os.path.join(BASE_DIR, 'data', 'backfill_state.json'))
 
 # Crea los directorios si no existen al iniciar el backend
-for _dir in [INPUT_IMAGE_DIR, PROCESSING_IMAGE_DIR, PROCESSED_IMAGE_DIR, ERROR_IMAGE_DIR]:
+for _dir in [INPUT_IMAGE_DIR, PROCESSING_IMAGE_DIR, PROCESSED_IMAGE_DIR, ERROR_IMAGE_DIR, IMAGE_STORE_DIR]:
     os.makedirs(_dir, exist_ok=True)
\ No newline at end of file
@@ -1,13 +1,394 @@
+import atexit
+import base64
+import json
 import os
-from datetime import datetime
-from pymongo import MongoClient, errors
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone, time as dt_time
+from pymongo import MongoClient, errors, ASCENDING, DESCENDING, UpdateOne, ReplaceOne, ReturnDocument
 from bson.objectid import ObjectId
 # Asegúrate de que estas variables estén en src/config.py
-from src.config import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME
+from src.config import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME, MONGO_MANAGE_INDEXES
+from src.config import MONGO_ROLLUP_COLLECTION_NAME, DAILY_ROLLUPS_ENABLED, MONGO_COUNTERS_COLLECTION_NAME
+from src.config import MONGO_JOBS_COLLECTION_NAME
+from src.config import (MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                        MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                        MONGO_READ_PREFERENCE, MONGO_WRITE_CONCERN_W, MONGO_WRITE_CONCERN_JOURNAL,
+                        MONGO_WRITE_CONCERN_WTIMEOUT_MS, MONGO_RECONNECT_BACKOFF_BASE_SECONDS,
+                        MONGO_RECONNECT_BACKOFF_MAX_SECONDS)
+from src.config import (MONGO_WRITE_BEHIND_ENABLED, MONGO_WRITE_BEHIND_MAX_QUEUE, MONGO_WRITE_BEHIND_BATCH_SIZE,
+                        MONGO_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS, MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS)
+from src.serializers import validate_entry
+from src.write_behind import WriteBehindQueue
 
 
-class DataLogger:
+# Orden estable del historial: más recientes primero, _id como desempate
+HISTORY_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+# Proyecciones predefinidas para el historial ('campos' en la API)
+HISTORY_PROJECTIONS = {
+    "totales": {"alimentos_detallados": 0},  # Solo totales, sin el desglose por alimento
+}
+
+
+# Formato de la clave de cada periodo de los resúmenes ($dateToString de MongoDB).
+# Las semanas son ISO 8601 (lunes a domingo), ej. "2026-W42".
+SUMMARY_PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%G-W%V",
+    "month": "%Y-%m",
+}
+
+# Campos de totales que se suman en los resúmenes: campo del documento -> clave del resultado
+SUMMARY_TOTAL_FIELDS = {
+    "calorias_totales": "total_calorias",
+    "proteinas_totales": "total_proteinas",
+    "grasas_totales": "total_grasas",
+    "carbohidratos_totales": "total_carbohidratos",
+}
+
+# Código de error de MongoDB para una clave única duplicada
+DUPLICATE_KEY_ERROR = 11000
+
+# Entradas por lote al recorrer un cursor del historial en streaming
+STREAM_BATCH_SIZE = 100
+
+# Formato del día de los documentos de daily_rollups (día local del servidor, como los timestamps)
+ROLLUP_DAY_FORMAT = "%Y-%m-%d"
+
+
+class InvalidCursorError(ValueError):
+    """El token de paginación no es válido."""
+
+
+def encode_cursor(entry):
+    """Genera el token de paginación que apunta justo después de 'entry' (usa su timestamp y _id)."""
+    payload = {"t": entry["timestamp"].isoformat(), "i": str(entry["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token):
+    """Convierte un token de paginación en (timestamp, ObjectId). Lanza InvalidCursorError si es inválido."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), ObjectId(payload["i"])
+    except Exception as e:
+        raise InvalidCursorError(f"Cursor de paginación inválido: {token}") from e
+
+
+class DataLogger(ABC):
+    """
+    Interfaz del almacenamiento del historial de comidas.
+    app.py, MealPipeline y src/rollups.py solo usan estos métodos, de modo que el backend
+    (MongoDB o SQLite embebido, ver create_data_logger) se elige por configuración.
+    Las entradas se devuelven como diccionarios con '_id' (ObjectId) y 'timestamp' (datetime
+    naive en hora local del servidor), igual en todos los backends.
+    Aquí vive también la lógica común: listeners de escritura, paginación, resúmenes a partir
+    de los totales diarios y verificación de esos totales.
+    """
+
     def __init__(self):
+        self._write_listeners = []
+        self.write_behind = None  # Cola de escritura diferida (solo si el backend la usa)
+
+    # --- Estado y diagnóstico ---
+
+    @abstractmethod
+    def is_healthy(self):
+        """True si el almacenamiento está disponible."""
+
+    @abstractmethod
+    def get_health(self):
+        """Estado del almacenamiento para diagnóstico (/estadisticas)."""
+
+    @abstractmethod
+    def get_index_stats(self):
+        """Índices de la tabla/colección de entradas (y su uso, si el backend lo registra), o None."""
+
+    @abstractmethod
+    def get_version(self):
+        """Versión actual del historial (string), que cambia con cada registro o borrado; None si hubo un error."""
+
+    def add_write_listener(self, callback):
+        """Registra callback() para que se llame tras cada registro o borrado (ej. invalidar cachés)."""
+        self._write_listeners.append(callback)
+
+    def _notify_write_listeners(self):
+        for listener in self._write_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"⚠️ DataLogger: Error en un listener de escritura: {e}")
+
+    # --- Escrituras ---
+
+    @staticmethod
+    def _build_document(analysis_result, image_name, meal_type, log_time=None):
+        """Documento de una entrada de comida tal como se guarda (totales y nutrientes como float)."""
+        # analysis_result ya es el diccionario completo que queremos guardar
+        return validate_entry({
+            "timestamp": log_time or datetime.now(),  # Python datetime object
+            "image_name": image_name,
+            "meal_type": meal_type,
+            **analysis_result  # Desempaqueta el diccionario analysis_result aquí
+        })
+
+    @abstractmethod
+    def log_food_entry(self, analysis_result, image_name, meal_type, log_time=None):
+        """Registra una entrada de comida. Devuelve True si se registró (o se aceptó para registrarla)."""
+
+    def log_food_entries(self, entries):
+        """
+        Registra varias entradas de comida con una sola escritura masiva.
+        entries: lista de diccionarios con 'analysis_result', 'image_name', 'meal_type' y opcionalmente 'log_time'.
+        Devuelve una lista de booleanos (uno por entrada, en el mismo orden) indicando si se registró.
+        """
+        if not entries:
+            return []
+
+        documents = [
+            self._build_document(entry["analysis_result"], entry["image_name"], entry["meal_type"], entry.get("log_time"))
+            for entry in entries
+        ]
+        return self._insert_documents(documents)
+
+    @abstractmethod
+    def _insert_documents(self, documents):
+        """Inserta documentos ya preparados. Devuelve una lista de booleanos, uno por documento."""
+
+    @abstractmethod
+    def delete_food_entry(self, entry_id):
+        """Elimina una entrada por su _id (string u ObjectId). Devuelve True si existía y se eliminó."""
+
+    @abstractmethod
+    def get_entries_by_image_hash(self, image_hashes):
+        """
+        Entradas registradas para esas imágenes (campo 'image_hash'): diccionario image_hash -> lista de
+        {"_id", "meal_type", "timestamp"}, de la más reciente a la más antigua (solo los hashes con alguna
+        entrada), o None si hubo un error.
+        """
+
+    def flush(self, timeout=None):
+        """
+        Espera a que se inserten las entradas encoladas por la escritura diferida (read-your-write).
+        Devuelve False si se agotó timeout; sin escritura diferida devuelve True enseguida.
+        """
+        if self.write_behind is None:
+            return True
+        if not self.is_healthy():
+            return False  # Sin conexión las entradas no pueden insertarse: no bloquear la petición
+        flushed = self.write_behind.flush(timeout)
+        if not flushed:
+            print(f"⚠️ DataLogger: flush() agotó el tiempo de espera ({timeout}s) con entradas pendientes.")
+        return flushed
+
+    def get_write_behind_stats(self):
+        """Métricas de la escritura diferida (profundidad de la cola, latencia de los lotes...), o None si está desactivada."""
+        return self.write_behind.stats() if self.write_behind is not None else None
+
+    # --- Lecturas ---
+
+    @abstractmethod
+    def get_food_entries(self, start_date=None, end_date=None, meal_type=None, query_filter=None,
+                         limit=None, cursor=None, projection=None):
+        """
+        Obtiene entradas de comida con filtros opcionales, ordenadas por (timestamp, _id) descendente.
+        - limit: número máximo de entradas (None = todas).
+        - cursor: token devuelto por encode_cursor; devuelve solo las entradas posteriores a él.
+        - projection: proyección al estilo MongoDB (ej. HISTORY_PROJECTIONS["totales"]).
+        Lanza InvalidCursorError si el cursor no es válido.
+        """
+
+    def get_food_entries_page(self, limit, cursor=None, projection=None, **filters):
+        """
+        Obtiene una página del historial. Devuelve (entradas, next_cursor);
+        next_cursor es None cuando no hay más páginas.
+        """
+        entries = self.get_food_entries(limit=limit + 1, cursor=cursor, projection=projection, **filters)
+        if len(entries) > limit:
+            entries = entries[:limit]
+            return entries, encode_cursor(entries[-1])
+        return entries, None
+
+    @abstractmethod
+    def stream_food_entries_page(self, limit, cursor=None, projection=None, **filters):
+        """
+        Variante de get_food_entries_page que no carga la página en memoria.
+        Con limit=None se emiten todas las entradas (desde cursor, si lo hay) y next_cursor es None.
+        Devuelve (iterador de entradas, next_cursor). Lanza InvalidCursorError si el cursor no es válido.
+        """
+
+    @abstractmethod
+    def get_nutrition_summary(self, start_date, end_date, period="day", by_meal_type=False, meal_type=None,
+                              timezone_shift=None):
+        """
+        Resumen nutricional agregado por periodo entre start_date y end_date (ambos incluidos).
+        - period: "day", "week" o "month" (ver SUMMARY_PERIOD_FORMATS).
+        - by_meal_type: si es True, separa cada periodo por meal_type.
+        - meal_type: filtra una sola sección de comida.
+        - timezone_shift: desfase "+HH:MM"/"-HH:MM" entre la hora local del servidor (la de los
+          timestamps guardados) y la zona en la que se quieren los periodos (ver date_utils.timezone_shift).
+        Devuelve una lista ordenada de diccionarios con 'periodo', 'comidas', los 'total_*'
+        y 'meal_type' si by_meal_type, o None si hubo un error.
+        """
+
+    def _summary_from_rollups(self, first_day, last_day, by_meal_type, meal_type):
+        """Resumen diario en el formato de get_nutrition_summary leído de los totales diarios."""
+        rollups = self.get_daily_rollups(first_day, last_day, meal_type=meal_type)
+        if rollups is None:
+            return None
+        grouped = {}
+        for rollup in rollups:
+            if rollup.get("comidas", 0) <= 0:
+                continue  # Día sin entradas tras borrarlas
+            key = (rollup["date"], rollup.get("meal_type")) if by_meal_type else (rollup["date"],)
+            item = grouped.setdefault(key, {"periodo": rollup["date"], "comidas": 0,
+                                            **{total_key: 0.0 for total_key in SUMMARY_TOTAL_FIELDS.values()}})
+            if by_meal_type:
+                item["meal_type"] = rollup.get("meal_type")
+            item["comidas"] += rollup["comidas"]
+            for field, total_key in SUMMARY_TOTAL_FIELDS.items():
+                item[total_key] += rollup.get(field) or 0.0
+        summary = [grouped[key] for key in sorted(grouped, key=lambda k: tuple(part or "" for part in k))]
+        for item in summary:
+            for total_key in SUMMARY_TOTAL_FIELDS.values():
+                item[total_key] = round(item[total_key], 2)
+        return summary
+
+    def get_summary_by_date(self, target_date):
+        """
+        Calcula el resumen nutricional (calorías, proteínas, grasas, carbohidratos)
+        para un día específico.
+        target_date: objeto datetime que representa el día a resumir.
+        """
+        start_of_day = datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0)
+        end_of_day = datetime(target_date.year, target_date.month, target_date.day, 23, 59, 59, 999999)
+
+        summary = self.get_nutrition_summary(start_of_day, end_of_day, period="day")
+        if summary is None:
+            return None
+
+        day_totals = summary[0] if summary else {}
+        result = {"date": target_date.strftime("%Y-%m-%d")}
+        for total_key in SUMMARY_TOTAL_FIELDS.values():
+            result[total_key] = day_totals.get(total_key, 0.0)
+        return result
+
+    # --- Totales diarios ---
+
+    @abstractmethod
+    def has_daily_rollups(self):
+        """True si el backend mantiene los totales diarios (DAILY_ROLLUPS_ENABLED)."""
+
+    @abstractmethod
+    def daily_rollups_complete(self):
+        """
+        True si los totales diarios cubren todo el historial y se puede responder con ellos.
+        Lo marca rebuild_daily_rollups, o el primer uso sobre una base sin entradas (desde ahí cada
+        escritura los mantiene). Con DAILY_ROLLUPS_ENABLED activado sobre un historial existente es False
+        hasta ejecutar 'python -m src.rollups --rebuild': mientras tanto los resúmenes se agregan
+        desde las entradas. Desactivar DAILY_ROLLUPS_ENABLED borra la marca.
+        """
+
+    @staticmethod
+    def _rollup_amounts(document):
+        """Cantidades que aporta una entrada a su documento de totales diarios."""
+        amounts = {"comidas": 1}
+        for field in SUMMARY_TOTAL_FIELDS:
+            value = document.get(field)
+            # Igual que $sum en la agregación: los valores no numéricos no suman
+            amounts[field] = value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+        return amounts
+
+    @abstractmethod
+    def get_daily_rollups(self, first_day, last_day, meal_type=None):
+        """
+        Totales diarios entre first_day y last_day (objetos date, ambos incluidos), ordenados por
+        día y meal_type: diccionarios con 'date', 'meal_type', 'comidas' y los campos de totales.
+        Devuelve None si los totales diarios están desactivados o hubo un error.
+        """
+
+    @abstractmethod
+    def compute_daily_rollups(self):
+        """Recalcula los totales diarios desde las entradas: diccionario (día, meal_type) -> totales."""
+
+    @abstractmethod
+    def _stored_daily_rollups(self):
+        """Todos los totales diarios guardados: diccionario (día, meal_type) -> totales."""
+
+    def verify_daily_rollups(self, tolerance=0.01):
+        """
+        Compara los totales diarios guardados con los recalculados desde las entradas.
+        Devuelve {"checked", "mismatches": [...], "ok"}; cada diferencia incluye lo esperado y lo guardado.
+        """
+        if not self.has_daily_rollups() or not self.is_healthy():
+            return None
+        expected = self.compute_daily_rollups()
+        stored = self._stored_daily_rollups()
+
+        mismatches = []
+        for key in sorted(set(expected) | set(stored), key=lambda k: (k[0], k[1] or "")):
+            want = expected.get(key)
+            have = stored.get(key)
+            if want is None and have is not None and have.get("comidas", 0) == 0:
+                continue  # Documento vacío tras borrar todas las entradas del día: equivalente a no tenerlo
+            if want is None or have is None or want["comidas"] != have.get("comidas") or any(
+                    abs(want[field] - (have.get(field) or 0.0)) > tolerance for field in SUMMARY_TOTAL_FIELDS):
+                mismatches.append({"date": key[0], "meal_type": key[1], "esperado": want, "guardado": have})
+        return {"checked": len(set(expected) | set(stored)), "mismatches": mismatches, "ok": not mismatches}
+
+    @abstractmethod
+    def rebuild_daily_rollups(self):
+        """Reescribe los totales diarios desde las entradas. Devuelve {"written", "removed"} o None."""
+
+    # --- Estado de los trabajos en segundo plano (LocalJobQueue) ---
+    # Con varios procesos (ej. gunicorn con varios workers) el trabajo se ejecuta en el proceso que lo
+    # recibió, pero su estado se guarda aquí para que GET /analizar/<job_id> funcione en cualquiera.
+
+    @abstractmethod
+    def save_job(self, job, ttl_seconds):
+        """Guarda (o actualiza) el estado de un trabajo durante ttl_seconds. Devuelve True si se guardó."""
+
+    @abstractmethod
+    def get_job(self, job_id):
+        """Estado guardado de un trabajo, o None si no existe o ya expiró."""
+
+    @abstractmethod
+    def delete_job(self, job_id):
+        """Borra el estado guardado de un trabajo. Devuelve True si se borró."""
+
+    @abstractmethod
+    def close_connection(self):
+        """Vacía lo pendiente y cierra la conexión con el almacenamiento."""
+
+
+class MongoDataLogger(DataLogger):
+    """
+    Historial en MongoDB (pymongo): colección de entradas, totales diarios y contador de versión,
+    con reconexión en segundo plano y escritura diferida opcional.
+    """
+
+    # Índices que necesitan las consultas de historial y resúmenes: nombre -> claves.
+    # Se crean/ajustan al conectar (ver _ensure_indexes).
+    # Para cambiar las claves de un índice se le da un nombre nuevo y el anterior pasa a RETIRED_INDEXES:
+    # así el nuevo se construye mientras el viejo sigue sirviendo consultas, y solo después se borra.
+    INDEXES = {
+        "timestamp_id_desc": [("timestamp", DESCENDING), ("_id", DESCENDING)],
+        "meal_type_timestamp_id": [("meal_type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+        "image_hash": [("image_hash", ASCENDING)],  # Reemplazo de entradas al reanalizar (src/backfill.py)
+    }
+    # Índices de versiones anteriores (sin _id como desempate); se borran cuando INDEXES ya está completo
+    RETIRED_INDEXES = ("timestamp_desc", "meal_type_timestamp")
+    # Índice único de la colección de totales diarios: un documento por (día, meal_type)
+    ROLLUP_INDEXES = {
+        "date_meal_type": [("date", ASCENDING), ("meal_type", ASCENDING)],
+    }
+
+    def __init__(self):
+        super().__init__()
         self.mongo_uri = MONGO_URI
         self.db_name = MONGO_DB_NAME
         self.collection_name = MONGO_COLLECTION_NAME
@@ -19,73 +400,498 @@ class DataLogger:
         self.client = None
         self.db = None
         self.collection = None
+        self.rollups = None  # Colección daily_rollups (None si DAILY_ROLLUPS_ENABLED está desactivado)
+        self.counters = None  # Colección con el contador de versión del historial
+        self.jobs = None  # Colección con el estado de los trabajos asíncronos
+        self._rollups_complete = False  # Caché de daily_rollups_complete (una vez completos, siguen así)
+
+        # Estado de salud: mientras MongoDB no responde, los métodos fallan enseguida
+        # y un hilo en segundo plano reintenta la conexión con backoff
+        self._healthy = threading.Event()
+        self._state_lock = threading.Lock()
+        self._reconnect_thread = None
+        self._closed = False
+        self.state_since = time.time()
+        self.last_error = None
+        self.reconnect_attempts = 0
+        self.connection_failures = 0
+        self.fast_failures = 0
         self._connect_to_mongodb()
 
+        # Escritura diferida opcional de log_food_entry (ver WriteBehindQueue)
+        if MONGO_WRITE_BEHIND_ENABLED:
+            self.write_behind = WriteBehindQueue(
+                self._insert_documents,
+                is_ready=self.is_healthy,  # Durante una caída las entradas esperan en la cola
+                max_queue=MONGO_WRITE_BEHIND_MAX_QUEUE,
+                batch_size=MONGO_WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=MONGO_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS)
+            atexit.register(self.write_behind.close)  # Vaciar la cola al apagar el proceso
+
+    @staticmethod
+    def _client_options():
+        """Opciones del MongoClient: pool, timeouts, preferencia de lectura y write concern (src/config.py)."""
+        write_concern = int(MONGO_WRITE_CONCERN_W) if MONGO_WRITE_CONCERN_W.isdigit() else MONGO_WRITE_CONCERN_W
+        return {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "readPreference": MONGO_READ_PREFERENCE,
+            "w": write_concern,
+            "journal": MONGO_WRITE_CONCERN_JOURNAL,
+            "wTimeoutMS": MONGO_WRITE_CONCERN_WTIMEOUT_MS,
+        }
+
     def _connect_to_mongodb(self):
-        """Intenta conectar a MongoDB."""
+        """
+        Crea el MongoClient (una sola vez: el propio driver gestiona el pool y las reconexiones de sockets)
+        y comprueba la conexión con un ping acotado por MONGO_SERVER_SELECTION_TIMEOUT_MS.
+        Si el ping falla, DataLogger queda "unhealthy" y se reintenta en segundo plano.
+        """
         try:
-            self.client = MongoClient(self.mongo_uri)
-            self.client.admin.command('ping')  # Comando para verificar la conexión
+            self.client = MongoClient(self.mongo_uri, **self._client_options())
             self.db = self.client[self.db_name]
             self.collection = self.db[self.collection_name]
-            print("✅ DataLogger: Conexión a MongoDB establecida con éxito.")
-        except errors.ConnectionFailure as e:
-            print(f"❌ DataLogger: Error de conexión a MongoDB: {e}")
-            self.client = None  # Resetea la conexión para intentar de nuevo
-            self.db = None
-            self.collection = None
+            if DAILY_ROLLUPS_ENABLED:
+                self.rollups = self.db[MONGO_ROLLUP_COLLECTION_NAME]
+            self.counters = self.db[MONGO_COUNTERS_COLLECTION_NAME]
+            self.jobs = self.db[MONGO_JOBS_COLLECTION_NAME]
         except Exception as e:
-            print(f"❌ DataLogger: Ocurrió un error inesperado al conectar a MongoDB: {e}")
+            # URI u opciones inválidas: no tiene sentido reintentar
+            print(f"❌ DataLogger: Ocurrió un error inesperado al crear el cliente de MongoDB: {e}")
             self.client = None
             self.db = None
             self.collection = None
+            self.rollups = None
+            self.counters = None
+            self.jobs = None
+            self.last_error = str(e)
+            return
+
+        try:
+            self.client.admin.command('ping')  # Comando para verificar la conexión
+            self._mark_healthy()
+        except Exception as e:
+            print(f"❌ DataLogger: Error de conexión a MongoDB: {e}")
+            self._mark_unhealthy(e)
+
+    def _mark_healthy(self):
+        with self._state_lock:
+            was_healthy = self._healthy.is_set()
+            self._healthy.set()
+            self.state_since = time.time()
+            self.reconnect_attempts = 0
+        if not was_healthy:
+            print("✅ DataLogger: Conexión a MongoDB establecida con éxito.")
+            if not DAILY_ROLLUPS_ENABLED:
+                self._clear_rollups_marker()
+            if MONGO_MANAGE_INDEXES:
+                # En segundo plano: construir un índice sobre una colección grande puede tardar
+                threading.Thread(target=self._ensure_indexes, name="foodscan-indexes", daemon=True).start()
+
+    def _mark_unhealthy(self, error):
+        """Pasa a "unhealthy" y lanza (si no está ya en marcha) la reconexión en segundo plano."""
+        with self._state_lock:
+            self.last_error = str(error)
+            if self._healthy.is_set():
+                self._healthy.clear()
+                self.state_since = time.time()
+                self.connection_failures += 1
+                print(f"🔌 DataLogger: MongoDB no disponible ({error}); las peticiones fallarán rápido hasta reconectar.")
+            if self.client is None or self._closed:
+                return
+            if self._reconnect_thread is None or not self._reconnect_thread.is_alive():
+                self._reconnect_thread = threading.Thread(
+                    target=self._reconnect_loop, name="foodscan-mongo-reconnect", daemon=True)
+                self._reconnect_thread.start()
+
+    def _reconnect_loop(self):
+        """Hace ping a MongoDB con backoff exponencial (con jitter) hasta que vuelve a responder."""
+        while not self._closed and not self._healthy.is_set():
+            with self._state_lock:
+                self.reconnect_attempts += 1
+                attempt = self.reconnect_attempts
+            delay = min(MONGO_RECONNECT_BACKOFF_MAX_SECONDS, MONGO_RECONNECT_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+            time.sleep(random.uniform(delay / 2, delay))
+            try:
+                self.client.admin.command('ping')
+                print(f"🔁 DataLogger: MongoDB responde de nuevo tras {attempt} intentos de reconexión.")
+                self._mark_healthy()
+            except Exception as e:
+                with self._state_lock:
+                    self.last_error = str(e)
+                print(f"🔁 DataLogger: Reconexión a MongoDB fallida (intento {attempt}): {e}")
+
+    def _handle_error(self, error):
+        """Si error indica que MongoDB no responde, marca DataLogger como "unhealthy"."""
+        if isinstance(error, errors.ConnectionFailure):  # Incluye AutoReconnect, NetworkTimeout y ServerSelectionTimeoutError
+            self._mark_unhealthy(error)
+
+    def is_healthy(self):
+        """True si hay conexión con MongoDB según la última operación o el último ping."""
+        return self._healthy.is_set()
+
+    def _available(self, action):
+        """
+        Comprobación rápida antes de cada operación: sin conexión no se toca la red
+        (la reconexión sigue en segundo plano). action describe la operación para el log.
+        """
+        if self.collection is not None and self._healthy.is_set():
+            return True
+        with self._state_lock:
+            self.fast_failures += 1
+        print(f"⚠️ DataLogger: MongoDB no disponible, no se puede {action}.")
+        return False
+
+    def get_health(self):
+        """Estado de la conexión a MongoDB para diagnóstico (/estadisticas)."""
+        with self._state_lock:
+            return {
+                "backend": "mongo",
+                "state": "healthy" if self._healthy.is_set() else "unhealthy",
+                "since": datetime.fromtimestamp(self.state_since).isoformat(),
+                "last_error": self.last_error,
+                "reconnect_attempts": self.reconnect_attempts,
+                "connection_failures": self.connection_failures,
+                "fast_failures": self.fast_failures,
+                "pool": {"max": MONGO_MAX_POOL_SIZE, "min": MONGO_MIN_POOL_SIZE},
+                "read_preference": MONGO_READ_PREFERENCE,
+                "write_concern": MONGO_WRITE_CONCERN_W,
+            }
+
+    def _ensure_indexes(self):
+        """Crea/ajusta los índices de las entradas, de los totales diarios y el TTL de los trabajos."""
+        self._ensure_collection_indexes(self.collection, self.INDEXES, retired=self.RETIRED_INDEXES)
+        self._ensure_collection_indexes(self.rollups, self.ROLLUP_INDEXES, unique=True)
+        if self.jobs is not None:
+            try:
+                # Índice TTL: MongoDB borra por su cuenta los trabajos expirados
+                self.jobs.create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+            except Exception as e:
+                print(f"❌ DataLogger: Error al crear el índice TTL de los trabajos: {e}")
+
+    @staticmethod
+    def _ensure_collection_indexes(collection, indexes, unique=False, retired=()):
+        """
+        Compara los índices existentes de collection con indexes y crea los que faltan.
+        Si existe un índice con el mismo nombre pero distintas claves, se reconstruye (mientras tanto las
+        consultas no tienen ese índice: para cambiar claves es mejor usar un nombre nuevo y retired).
+        Los índices de retired se borran solo cuando todos los de indexes están construidos.
+        """
+        if collection is None:
+            return
+        try:
+            existing = {index["name"]: list(index["key"].items()) for index in collection.list_indexes()}
+        except Exception as e:
+            print(f"❌ DataLogger: No se pudieron listar los índices: {e}")
+            return
+
+        complete = True
+        for name, keys in indexes.items():
+            current = existing.get(name)
+            if current == keys:
+                continue
+            try:
+                if current is not None:
+                    print(f"⚠️ DataLogger: El índice '{name}' tiene claves distintas ({current}); se reconstruirá.")
+                    collection.drop_index(name)
+                else:
+                    print(f"⚠️ DataLogger: Falta el índice '{name}' {keys}; construyéndolo...")
+                started_at = time.monotonic()
+                collection.create_index(keys, name=name, unique=unique)
+                print(f"✅ DataLogger: Índice '{name}' listo en {time.monotonic() - started_at:.1f}s.")
+            except Exception as e:
+                complete = False
+                print(f"❌ DataLogger: Error al crear el índice '{name}': {e}")
+
+        if not complete:
+            return  # Los índices antiguos siguen sirviendo las consultas hasta que los nuevos existan
+        for name in retired:
+            if name not in existing or name in indexes:
+                continue
+            try:
+                collection.drop_index(name)
+                print(f"🗑️ DataLogger: Índice antiguo '{name}' eliminado.")
+            except Exception as e:
+                print(f"❌ DataLogger: Error al eliminar el índice antiguo '{name}': {e}")
+
+    def get_index_stats(self):
+        """
+        Devuelve el uso de cada índice de la colección ($indexStats): número de accesos y desde cuándo.
+        Sirve para comprobar que las consultas de historial realmente usan los índices.
+        """
+        if self.collection is None or not self.is_healthy():
+            return None
+        try:
+            return [
+                {
+                    "name": stat["name"],
+                    "key": dict(stat["key"]),
+                    "accesses": stat["accesses"]["ops"],
+                    "since": stat["accesses"]["since"].isoformat(),
+                    "managed": stat["name"] in self.INDEXES,
+                }
+                for stat in self.collection.aggregate([{"$indexStats": {}}])
+            ]
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al obtener estadísticas de índices: {e}")
+            return None
+
+    # --- Versión del historial (ETag) ---
+
+    def _version_counter_id(self):
+        return f"{self.collection_name}_version"
+
+    def get_version(self):
+        """
+        Versión actual del historial como string "<época>-<contador>". El contador sube con cada
+        registro o borrado; la época (aleatoria, creada con el contador) evita repetir versiones si
+        la base de datos se vacía. Devuelve None si no hay conexión o hubo un error.
+        """
+        if self.counters is None or not self.is_healthy():
+            return None
+        try:
+            counter = self.counters.find_one({"_id": self._version_counter_id()})
+            if counter is None:
+                counter = self.counters.find_one_and_update(
+                    {"_id": self._version_counter_id()},
+                    {"$setOnInsert": {"epoch": uuid.uuid4().hex[:8], "value": 0}},
+                    upsert=True, return_document=ReturnDocument.AFTER)
+            return f"{counter['epoch']}-{counter['value']}"
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al leer la versión del historial: {e}")
+            return None
+
+    def _bump_version(self):
+        """Incrementa la versión del historial y avisa a los listeners de escritura."""
+        if self.counters is not None:
+            try:
+                self.counters.update_one(
+                    {"_id": self._version_counter_id()},
+                    {"$inc": {"value": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+                    upsert=True)
+            except Exception as e:
+                self._handle_error(e)
+                print(f"❌ DataLogger: Error al incrementar la versión del historial: {e}")
+        self._notify_write_listeners()
+
+    # --- Totales diarios (daily_rollups) ---
+
+    def _apply_rollups(self, documents, sign):
+        """
+        Suma (sign=1) o resta (sign=-1) las entradas en daily_rollups con $inc atómicos,
+        agrupadas por (día, meal_type) para enviar una sola operación por documento de totales.
+        Un fallo aquí no deshace la escritura de las entradas: 'python -m src.rollups --verify' lo detecta.
+        """
+        if self.rollups is None or not documents:
+            return
+        increments = {}
+        for document in documents:
+            key = (document["timestamp"].strftime(ROLLUP_DAY_FORMAT), document.get("meal_type"))
+            totals = increments.setdefault(key, {"comidas": 0, **{field: 0.0 for field in SUMMARY_TOTAL_FIELDS}})
+            for field, amount in self._rollup_amounts(document).items():
+                totals[field] += sign * amount
+
+        operations = [
+            UpdateOne({"date": day, "meal_type": meal_type},
+                      {"$inc": totals, "$set": {"updated_at": datetime.now()}},
+                      upsert=True)
+            for (day, meal_type), totals in increments.items()
+        ]
+        try:
+            self.rollups.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al actualizar los totales diarios: {e}")
+            import traceback
+            traceback.print_exc()
+
+    def get_daily_rollups(self, first_day, last_day, meal_type=None):
+        """
+        Documentos de daily_rollups entre first_day y last_day (objetos date, ambos incluidos),
+        ordenados por día y meal_type. Consulta por rango sobre el índice (date, meal_type).
+        Devuelve None si los totales diarios están desactivados o hubo un error.
+        """
+        if self.rollups is None or not self.is_healthy():
+            return None
+        query = {"date": {"$gte": first_day.strftime(ROLLUP_DAY_FORMAT), "$lte": last_day.strftime(ROLLUP_DAY_FORMAT)}}
+        if meal_type:
+            query["meal_type"] = meal_type
+        try:
+            return list(self.rollups.find(query, {"_id": 0, "updated_at": 0}).sort(
+                [("date", ASCENDING), ("meal_type", ASCENDING)]))
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al leer los totales diarios: {e}")
+            return None
+
+    def compute_daily_rollups(self):
+        """
+        Recalcula los totales diarios desde las entradas con una agregación.
+        Devuelve un diccionario (día, meal_type) -> documento de totales.
+        """
+        pipeline = [
+            {"$group": {
+                "_id": {"date": {"$dateToString": {"format": ROLLUP_DAY_FORMAT, "date": "$timestamp"}},
+                        "meal_type": "$meal_type"},
+                "comidas": {"$sum": 1},
+                **{field: {"$sum": f"${field}"} for field in SUMMARY_TOTAL_FIELDS},
+            }},
+        ]
+        expected = {}
+        for row in self.collection.aggregate(pipeline, allowDiskUse=True):
+            key = (row["_id"]["date"], row["_id"].get("meal_type"))
+            expected[key] = {"date": key[0], "meal_type": key[1], "comidas": row["comidas"],
+                             **{field: row.get(field) or 0.0 for field in SUMMARY_TOTAL_FIELDS}}
+        return expected
+
+    def has_daily_rollups(self):
+        return self.rollups is not None
+
+    def _rollups_marker_id(self):
+        return f"{MONGO_ROLLUP_COLLECTION_NAME}_complete"
+
+    def _set_rollups_marker(self):
+        self.counters.update_one({"_id": self._rollups_marker_id()}, {"$set": {"since": datetime.now()}}, upsert=True)
+        self._rollups_complete = True
+
+    def _clear_rollups_marker(self):
+        """Sin mantenimiento de totales, las escrituras de ahora en adelante los dejarían incompletos."""
+        if self.counters is None:
+            return
+        try:
+            self.counters.delete_one({"_id": self._rollups_marker_id()})
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al borrar la marca de totales diarios completos: {e}")
+
+    def daily_rollups_complete(self):
+        if self.rollups is None or self.counters is None or not self.is_healthy():
+            return False
+        if self._rollups_complete:
+            return True
+        try:
+            if self.counters.find_one({"_id": self._rollups_marker_id()}) is None:
+                if self.collection.find_one({}, {"_id": 1}) is not None:
+                    return False  # Historial anterior a los totales diarios: falta --rebuild
+                # Base vacía: los totales se mantienen desde la primera entrada
+                self._set_rollups_marker()
+            self._rollups_complete = True
+            return True
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al comprobar la marca de totales diarios: {e}")
+            return False
+
+    def _stored_daily_rollups(self):
+        return {(doc["date"], doc.get("meal_type")): doc for doc in self.rollups.find({}, {"_id": 0, "updated_at": 0})}
+
+    def rebuild_daily_rollups(self):
+        """
+        Reescribe daily_rollups con los totales recalculados desde las entradas, sin vaciar antes la
+        colección (las lecturas siguen viendo totales durante la reconstrucción). Las escrituras
+        concurrentes con la reconstrucción pueden quedar desajustadas: conviene verificar después.
+        Devuelve el número de documentos escritos y eliminados, o None si no hay conexión.
+        """
+        if self.collection is None or self.rollups is None or not self.is_healthy():
+            return None
+        expected = self.compute_daily_rollups()
+        now = datetime.now()
+        operations = [
+            ReplaceOne({"date": day, "meal_type": meal_type}, dict(document, updated_at=now), upsert=True)
+            for (day, meal_type), document in expected.items()
+        ]
+        stale = [doc["_id"] for doc in self.rollups.find({}, {"date": 1, "meal_type": 1})
+                 if (doc["date"], doc.get("meal_type")) not in expected]
+        if operations:
+            self.rollups.bulk_write(operations, ordered=False)
+        if stale:
+            self.rollups.delete_many({"_id": {"$in": stale}})
+        self._set_rollups_marker()  # Desde ahora los resúmenes pueden leerse de daily_rollups
+        print(f"✅ DataLogger: Totales diarios reconstruidos: {len(operations)} escritos, {len(stale)} eliminados.")
+        return {"written": len(operations), "removed": len(stale)}
 
     def log_food_entry(self, analysis_result, image_name, meal_type, log_time=None):
         """
         Registra una entrada de comida en la base de datos.
         analysis_result debe ser el diccionario completo que queremos guardar (de app.py).
         Este diccionario ya incluye "nombre_general_comida", totales y "alimentos_detallados".
+        Con MONGO_WRITE_BEHIND_ENABLED la entrada se encola y se inserta en el siguiente lote:
+        True significa "aceptada"; quien necesite leerla enseguida debe llamar antes a flush().
         """
-        if self.collection is None:
-            print("Error: No hay conexión a la base de datos para registrar la entrada. Intentando reconectar...")
-            self._connect_to_mongodb()  # Intenta reconectar
-            if self.collection is None:  # Si aún no hay conexión, falla
-                print("Error: Fallo en la reconexión a la base de datos.")
-                return False
+        # Totales y nutrientes como float: las lecturas no los revisan
+        food_entry = self._build_document(analysis_result, image_name, meal_type, log_time)
 
-        if log_time is None:
-            log_time = datetime.now()
+        if self.write_behind is not None:
+            # El _id se asigna ya: identifica la entrada aunque un lote se reintente
+            food_entry["_id"] = ObjectId()
+            if self.write_behind.submit(food_entry):
+                return True
+            print("⚠️ DataLogger: Cola de escritura diferida llena; registrando la entrada de forma síncrona.")
 
-        # analysis_result ya es el diccionario completo que queremos guardar
-        food_entry = {
-            "timestamp": log_time,  # Python datetime object
-            "image_name": image_name,
-            "meal_type": meal_type,
-            **analysis_result  # Desempaqueta el diccionario analysis_result aquí
-        }
+        if not self._available("registrar la entrada"):
+            return False
 
         try:
             result = self.collection.insert_one(food_entry)
             print(f"✅ DataLogger: Entrada de comida registrada con ID: {result.inserted_id}")
+            self._apply_rollups([food_entry], 1)
+            self._bump_version()
             return True
         except Exception as e:
+            self._handle_error(e)
             print(f"❌ DataLogger: Error al registrar la entrada de comida: {e}")
             import traceback
             traceback.print_exc()
             return False
 
-    def get_food_entries(self, start_date=None, end_date=None, meal_type=None, query_filter=None):
+    def _insert_documents(self, documents):
         """
-        Obtiene entradas de comida de la base de datos con filtros opcionales.
-        Devuelve una lista de diccionarios. La conversión de ObjectId/datetime a string
-        se hará en el Flask app.py para la serialización JSON.
+        Inserta documentos ya preparados con insert_many y actualiza totales diarios y versión.
+        Lo usan log_food_entries y los lotes de la escritura diferida.
+        Un documento cuyo _id ya existe cuenta como registrado (reintento de un lote que sí llegó a escribirse).
+        Devuelve una lista de booleanos, uno por documento.
         """
-        if self.collection is None:
-            print("Error: No hay conexión a la base de datos para obtener entradas. Intentando reconectar...")
-            self._connect_to_mongodb()
-            if self.collection is None:
-                return []
+        if not documents:
+            return []
+
+        if not self._available("registrar las entradas"):
+            return [False] * len(documents)
 
+        try:
+            # ordered=False: un documento con error no impide insertar el resto
+            result = self.collection.insert_many(documents, ordered=False)
+            print(f"✅ DataLogger: {len(result.inserted_ids)} entradas de comida registradas en bloque.")
+            self._apply_rollups(documents, 1)
+            self._bump_version()
+            return [True] * len(documents)
+        except errors.BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            failed = {error["index"] for error in write_errors if error.get("code") != DUPLICATE_KEY_ERROR}
+            duplicated = {error["index"] for error in write_errors if error.get("code") == DUPLICATE_KEY_ERROR}
+            print(f"⚠️ DataLogger: Registro en bloque parcial, {len(failed)} de {len(documents)} entradas fallaron"
+                  f" ({len(duplicated)} ya estaban registradas).")
+            # Las duplicadas vienen de un intento anterior que falló sin confirmación (y sin sumar
+            # en los totales diarios): cuentan como registradas y suman ahora
+            self._apply_rollups([doc for index, doc in enumerate(documents) if index not in failed], 1)
+            self._bump_version()
+            return [index not in failed for index in range(len(documents))]
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al registrar las entradas de comida en bloque: {e}")
+            import traceback
+            traceback.print_exc()
+            return [False] * len(documents)
+
+    @staticmethod
+    def _history_query(start_date=None, end_date=None, meal_type=None, query_filter=None, cursor=None):
+        """Construye la consulta del historial. Lanza InvalidCursorError si el cursor no es válido."""
         query = {}
 
         if query_filter:
@@ -101,59 +907,175 @@ class DataLogger:
         if meal_type:
             query["meal_type"] = meal_type
 
+        if cursor:
+            cursor_timestamp, cursor_id = decode_cursor(cursor)
+            keyset_condition = {"$or": [
+                {"timestamp": {"$lt": cursor_timestamp}},
+                {"timestamp": cursor_timestamp, "_id": {"$lt": cursor_id}},
+            ]}
+            query = {"$and": [query, keyset_condition]} if query else keyset_condition
+
+        return query
+
+    def get_food_entries(self, start_date=None, end_date=None, meal_type=None, query_filter=None,
+                         limit=None, cursor=None, projection=None):
+        """
+        Obtiene entradas de comida de la base de datos con filtros opcionales.
+        Devuelve una lista de diccionarios ordenada por (timestamp, _id) descendente.
+        - limit: número máximo de entradas (None = todas).
+        - cursor: token devuelto por encode_cursor; devuelve solo las entradas posteriores a él
+          (paginación por clave, sin skip, usando el índice de timestamp).
+        - projection: proyección de MongoDB (ej. HISTORY_PROJECTIONS["totales"]).
+        La conversión de ObjectId/datetime a string la hace src/serializers.py al responder.
+        Lanza InvalidCursorError si el cursor no es válido.
+        """
+        if not self._available("obtener entradas"):
+            return []
+
+        query = self._history_query(start_date, end_date, meal_type, query_filter, cursor)
+
         try:
             # Ordenar por timestamp descendente para ver las más recientes primero
-            entries = list(self.collection.find(query).sort("timestamp", -1))
-            return entries
+            mongo_cursor = self.collection.find(query, projection).sort(HISTORY_SORT)
+            if limit:
+                mongo_cursor = mongo_cursor.limit(limit)
+            return list(mongo_cursor)
         except Exception as e:
+            self._handle_error(e)
             print(f"❌ DataLogger: Error al obtener entradas de comida: {e}")
             import traceback
             traceback.print_exc()
             return []
 
-    def get_summary_by_date(self, target_date):
+    def stream_food_entries_page(self, limit, cursor=None, projection=None, **filters):
         """
-        Calcula el resumen nutricional (calorías, proteínas, grasas, carbohidratos)
-        para un día específico.
-        target_date: objeto datetime que representa el día a resumir.
+        Variante de get_food_entries_page que no carga la página en memoria.
+        Devuelve (iterador de entradas, next_cursor): primero lee solo las claves (timestamp, _id)
+        de limit + 1 entradas, cubiertas por el índice, para saber dónde acaba la página y si hay
+        otra; después las entradas completas se van leyendo del cursor de MongoDB por lotes.
+        Lanza InvalidCursorError si el cursor no es válido.
         """
-        if self.collection is None:
-            print("Error: No hay conexión a la base de datos para obtener el resumen. Intentando reconectar...")
-            self._connect_to_mongodb()
-            if self.collection is None:
-                return None
+        if not self._available("obtener entradas"):
+            return iter(()), None
 
-        start_of_day = datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0)
-        end_of_day = datetime(target_date.year, target_date.month, target_date.day, 23, 59, 59, 999999)
+        query = self._history_query(cursor=cursor, **filters)
+        keys = []
+        if limit is not None:
+            try:
+                keys = list(self.collection.find(query, {"timestamp": 1}).sort(HISTORY_SORT).limit(limit + 1))
+            except Exception as e:
+                self._handle_error(e)
+                print(f"❌ DataLogger: Error al obtener entradas de comida: {e}")
+                import traceback
+                traceback.print_exc()
+                return iter(()), None
 
-        query = {
-            "timestamp": {"$gte": start_of_day, "$lte": end_of_day}
-        }
+        next_cursor = None
+        if limit is not None:
+            if not keys:
+                return iter(()), None
+            # La lectura completa se acota por clave y no por número, para que coincida exactamente con
+            # las claves leídas: por arriba la acota el cursor o, en la primera página, la primera clave
+            # (las entradas registradas entre ambas lecturas no se cuelan en la página)
+            page_conditions = []
+            if cursor is None:
+                first = keys[0]
+                page_conditions.append({"$or": [
+                    {"timestamp": {"$lt": first["timestamp"]}},
+                    {"timestamp": first["timestamp"], "_id": {"$lte": first["_id"]}},
+                ]})
+            if len(keys) > limit:
+                # La página termina en la última clave (incluida)
+                last = keys[limit - 1]
+                next_cursor = encode_cursor(last)
+                page_conditions.append({"$or": [
+                    {"timestamp": {"$gt": last["timestamp"]}},
+                    {"timestamp": last["timestamp"], "_id": {"$gte": last["_id"]}},
+                ]})
+            if page_conditions:
+                query = {"$and": [query, *page_conditions] if query else page_conditions}
+
+        mongo_cursor = self.collection.find(query, projection).sort(HISTORY_SORT).batch_size(STREAM_BATCH_SIZE)
+        return self._iterate_cursor(mongo_cursor), next_cursor
 
+    def _iterate_cursor(self, mongo_cursor):
+        """
+        Recorre un cursor de MongoDB cerrándolo al terminar. Un error a mitad se registra y se vuelve
+        a lanzar: la respuesta se corta en vez de terminar como una lista válida pero incompleta.
+        """
         try:
-            daily_entries = self.collection.find(query)
+            for document in mongo_cursor:
+                yield document
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al leer entradas de comida del cursor: {e}")
+            import traceback
+            traceback.print_exc()
+            raise
+        finally:
+            mongo_cursor.close()
 
-            total_calorias = 0.0
-            total_proteinas = 0.0
-            total_grasas = 0.0
-            total_carbohidratos = 0.0
+    def get_nutrition_summary(self, start_date, end_date, period="day", by_meal_type=False, meal_type=None,
+                              timezone_shift=None):
+        """
+        Resumen nutricional agregado por periodo entre start_date y end_date (ambos incluidos),
+        calculado por MongoDB con un único $group: solo viajan los totales, no los documentos.
+        Los resúmenes por día completo sin desfase horario se leen directamente de daily_rollups
+        cuando están completos (ver daily_rollups_complete).
+        - period: "day", "week" o "month" (ver SUMMARY_PERIOD_FORMATS).
+        - by_meal_type: si es True, separa cada periodo por meal_type.
+        - meal_type: filtra una sola sección de comida.
+        - timezone_shift: desfase "+HH:MM"/"-HH:MM" entre la hora local del servidor (la de los
+          timestamps guardados) y la zona en la que se quieren los periodos (ver date_utils.timezone_shift).
+        Devuelve una lista ordenada de diccionarios con 'periodo', 'comidas', los 'total_*'
+        y 'meal_type' si by_meal_type, o None si hubo un error.
+        """
+        if period not in SUMMARY_PERIOD_FORMATS:
+            raise ValueError(f"Periodo de resumen no soportado: {period}")
 
-            for entry in daily_entries:
-                # Los campos ahora son calorias_totales, proteinas_totales, etc.
-                total_calorias += entry.get("calorias_totales", 0.0)
-                total_proteinas += entry.get("proteinas_totales", 0.0)
-                total_grasas += entry.get("grasas_totales", 0.0)
-                total_carbohidratos += entry.get("carbohidratos_totales", 0.0)
+        if not self._available("obtener el resumen"):
+            return None
 
-            return {
-                "date": target_date.strftime("%Y-%m-%d"),
-                "total_calorias": round(total_calorias, 2),
-                "total_proteinas": round(total_proteinas, 2),
-                "total_grasas": round(total_grasas, 2),
-                "total_carbohidratos": round(total_carbohidratos, 2)
-            }
+        # Días completos en hora del servidor: se responde con los totales diarios ya calculados
+        if (period == "day" and not timezone_shift and start_date.time() == dt_time.min
+                and end_date.time() == dt_time.max and self.daily_rollups_complete()):
+            summary = self._summary_from_rollups(start_date.date(), end_date.date(), by_meal_type, meal_type)
+            if summary is not None:
+                return summary
+
+        match = {"timestamp": {"$gte": start_date, "$lte": end_date}}
+        if meal_type:
+            match["meal_type"] = meal_type
+
+        period_expression = {"format": SUMMARY_PERIOD_FORMATS[period], "date": "$timestamp"}
+        if timezone_shift:
+            period_expression["timezone"] = timezone_shift
+        group_key = {"periodo": {"$dateToString": period_expression}}
+        if by_meal_type:
+            group_key["meal_type"] = "$meal_type"
+
+        group = {"_id": group_key, "comidas": {"$sum": 1}}
+        for field, total_key in SUMMARY_TOTAL_FIELDS.items():
+            group[total_key] = {"$sum": f"${field}"}
+
+        pipeline = [
+            {"$match": match},  # Usa el índice de timestamp (o el de meal_type + timestamp)
+            {"$group": group},
+            {"$sort": {"_id.periodo": 1, "_id.meal_type": 1}},
+        ]
+
+        try:
+            summary = []
+            for row in self.collection.aggregate(pipeline):
+                item = dict(row.pop("_id"))
+                item["comidas"] = row["comidas"]
+                for total_key in SUMMARY_TOTAL_FIELDS.values():
+                    item[total_key] = round(row.get(total_key) or 0.0, 2)
+                summary.append(item)
+            return summary
         except Exception as e:
-            print(f"❌ DataLogger: Error al obtener el resumen diario: {e}")
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al calcular el resumen nutricional: {e}")
             import traceback
             traceback.print_exc()
             return None
@@ -163,20 +1085,22 @@ class DataLogger:
         Elimina una entrada de comida de la base de datos por su _id.
         entry_id: El ID de la entrada a eliminar (puede ser un string o ObjectId).
         """
-        if self.collection is None:
-            print("Error: No hay conexión a la base de datos para eliminar la entrada. Intentando reconectar...")
-            self._connect_to_mongodb()
-            if self.collection is None:
-                return False
+        self.flush(MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS)  # La entrada puede estar aún en la cola diferida
+        if not self._available("eliminar la entrada"):
+            return False
 
         try:
             # Asegurarse de que entry_id sea un ObjectId
             if not isinstance(entry_id, ObjectId):
                 entry_id = ObjectId(str(entry_id))
 
-            result = self.collection.delete_one({"_id": entry_id})
-            if result.deleted_count == 1:
+            # find_one_and_delete devuelve lo borrado: hace falta para restarlo de los totales diarios
+            deleted = self.collection.find_one_and_delete(
+                {"_id": entry_id}, projection={"timestamp": 1, "meal_type": 1, **{field: 1 for field in SUMMARY_TOTAL_FIELDS}})
+            if deleted is not None:
                 print(f"✅ DataLogger: Entrada con ID {entry_id} eliminada con éxito.")
+                self._apply_rollups([deleted], -1)
+                self._bump_version()
                 return True
             else:
                 print(f"⚠️ DataLogger: No se encontró la entrada con ID {entry_id} para eliminar.")
@@ -185,13 +1109,81 @@ class DataLogger:
             print(f"❌ DataLogger: Error: El ID '{entry_id}' no es un ObjectId válido.")
             return False
         except Exception as e:
+            self._handle_error(e)
             print(f"❌ DataLogger: Error al eliminar la entrada de comida: {e}")
             import traceback
             traceback.print_exc()
             return False
 
+    def save_job(self, job, ttl_seconds):
+        if self.jobs is None or not self._available("guardar el estado del trabajo"):
+            return False
+        try:
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+            self.jobs.replace_one({"_id": job["job_id"]}, dict(job, _id=job["job_id"], expires_at=expires_at),
+                                  upsert=True)
+            return True
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al guardar el estado del trabajo {job['job_id']}: {e}")
+            return False
+
+    def get_job(self, job_id):
+        if self.jobs is None or not self._available("leer el estado del trabajo"):
+            return None
+        try:
+            # El índice TTL borra con hasta un minuto de retraso: se filtra también aquí
+            return self.jobs.find_one({"_id": job_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                                      projection={"_id": 0, "expires_at": 0})
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al leer el estado del trabajo {job_id}: {e}")
+            return None
+
+    def delete_job(self, job_id):
+        if self.jobs is None or not self._available("borrar el estado del trabajo"):
+            return False
+        try:
+            self.jobs.delete_one({"_id": job_id})
+            return True
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al borrar el estado del trabajo {job_id}: {e}")
+            return False
+
+    def get_entries_by_image_hash(self, image_hashes):
+        self.flush(MONGO_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS)  # Entradas aún en la cola diferida
+        if not self._available("buscar entradas por imagen"):
+            return None
+        try:
+            found = {}
+            documents = self.collection.find({"image_hash": {"$in": list(image_hashes)}},
+                                             {"image_hash": 1, "meal_type": 1, "timestamp": 1}).sort(HISTORY_SORT)
+            for document in documents:
+                found.setdefault(document.pop("image_hash"), []).append(
+                    {"_id": document["_id"], "meal_type": document.get("meal_type"),
+                     "timestamp": document.get("timestamp")})
+            return found
+        except Exception as e:
+            self._handle_error(e)
+            print(f"❌ DataLogger: Error al buscar entradas por imagen: {e}")
+            return None
+
     def close_connection(self):
-        """Cierra la conexión a la base de datos MongoDB."""
+        """Vacía la cola de escritura diferida y cierra la conexión a la base de datos MongoDB."""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self._closed = True  # Detiene la reconexión en segundo plano
         if self.client:
             self.client.close()
-            print("✅ DataLogger: Conexión a MongoDB cerrada.")
\ No newline at end of file
+            print("✅ DataLogger: Conexión a MongoDB cerrada.")
+
+
+def create_data_logger(backend):
+    """Crea el almacenamiento configurado: "mongo" (MongoDB) o "sqlite" (archivo local, ver SQLITE_PATH)."""
+    if backend == "mongo":
+        return MongoDataLogger()
+    if backend == "sqlite":
+        from src.sqlite_logger import SQLiteDataLogger  # Import diferido: sqlite_logger importa este módulo
+        return SQLiteDataLogger()
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
@@ -0,0 +1,62 @@
+# src/date_utils.py
+from datetime import datetime, timedelta, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def parse_day(date_str):
+    """Convierte un string 'YYYY-MM-DD' en un objeto date. Lanza ValueError si el formato no es válido."""
+    return datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+def parse_timezone(tz_name):
+    """
+    Devuelve la zona horaria IANA indicada (ej. "America/Argentina/Buenos_Aires"),
+    o None si no se indicó ninguna. Lanza ValueError si la zona no existe.
+    """
+    if not tz_name:
+        return None
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Zona horaria desconocida: {tz_name}")
+
+
+def _to_server_local(moment, tz):
+    """
+    Convierte un datetime naive expresado en la zona tz a la hora local del servidor (naive),
+    que es como se guardan los timestamps en MongoDB (datetime.now()).
+    """
+    if tz is None:
+        return moment
+    return moment.replace(tzinfo=tz).astimezone().replace(tzinfo=None)
+
+
+def day_range_bounds(first_day, last_day, tz=None):
+    """
+    Límites [inicio, fin] (ambos incluidos) de los días first_day..last_day en la zona tz,
+    expresados en la hora local del servidor para poder compararlos con los timestamps guardados.
+    Sin tz, los días se interpretan en la hora local del servidor.
+    """
+    start = _to_server_local(datetime.combine(first_day, time.min), tz)
+    end_exclusive = _to_server_local(datetime.combine(last_day + timedelta(days=1), time.min), tz)
+    return start, end_exclusive - timedelta(microseconds=1)
+
+
+def timezone_shift(tz, reference):
+    """
+    Desfase "+HH:MM"/"-HH:MM" que hay que aplicar a los timestamps guardados (hora local del servidor)
+    para obtener la hora en la zona tz, en el formato que acepta el 'timezone' de MongoDB.
+    Se calcula en el instante reference (hora local del servidor); si el rango cruza un cambio
+    de horario de verano, las comidas de esa hora pueden caer en el periodo vecino.
+    Devuelve None si no hay desfase.
+    """
+    if tz is None:
+        return None
+    local_reference = reference.astimezone()
+    delta = local_reference.astimezone(tz).utcoffset() - local_reference.utcoffset()
+    minutes = int(delta.total_seconds() // 60)
+    if minutes == 0:
+        return None
+    sign = "+" if minutes > 0 else "-"
+    minutes = abs(minutes)
+    return f"{sign}{minutes // 60:02d}:{minutes % 60:02d}"
@@ -1,32 +1,360 @@
 # src/food_utils.py
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from src.config import FOOD_MATCH_CACHE_SIZE
 # CAMBIO: Importar food_database desde el paquete src
 from src.food_database import FOOD_DATABASE
+from src.nutrient_table import NUTRIENT_COLUMNS, NutrientTable
+
+# Palabras vacías que no aportan información para distinguir alimentos
+_STOPWORDS = frozenset({"de", "del", "la", "el", "los", "las", "en", "con", "y", "al", "a", "para"})
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text):
+    """Elimina tildes y diacríticos (ej. 'salmón' -> 'salmon', 'champiñones' -> 'champinones')."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
 
 
 def normalize_food_name(name):
     """Normaliza un nombre de alimento para facilitar la búsqueda."""
-    return name.lower().strip()
+    return " ".join(fold_accents(name).lower().split())
+
+
+def _stem(token):
+    """Reducción mínima de plurales ('papas' -> 'papa', 'tomates' -> 'tomate')."""
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize_food_name(name):
+    """Devuelve el conjunto de tokens significativos de un nombre de alimento ya normalizado o no."""
+    return frozenset(
+        _stem(token) for token in _TOKEN_RE.findall(normalize_food_name(name))
+        if token not in _STOPWORDS
+    )
+
+
+def food_database_fingerprint(food_database):
+    """
+    Huella del contenido de una tabla de alimentos (claves y valores). Cambia con cualquier edición:
+    altas, bajas, renombrados o valores modificados. Cuesta ~0.1 ms con la BD actual.
+    """
+    return hash(tuple((key, tuple(values.items())) for key, values in food_database.items()))
+
+
+class _FoodIndex:
+    """
+    Índice invertido token -> entradas de FOOD_DATABASE, construido una sola vez.
+    Permite resolver coincidencias parciales sin recorrer toda la base de datos y
+    elegir siempre el mismo candidato para un mismo nombre (puntuación determinista).
+    """
+
+    def __init__(self, food_database):
+        self.source_fingerprint = food_database_fingerprint(food_database)  # Para detectar cambios en FOOD_DATABASE
+        self.keys = []  # posición -> clave original en FOOD_DATABASE
+        self.tokens = []  # posición -> frozenset de tokens
+        self.exact = {}  # nombre normalizado -> clave original
+        self.postings = {}  # token -> lista de posiciones
+
+        for key in food_database:
+            normalized_key = normalize_food_name(key)
+            # Si dos claves colisionan tras normalizar, gana la primera (orden del diccionario)
+            self.exact.setdefault(normalized_key, key)
+            key_tokens = tokenize_food_name(key)
+            if not key_tokens:
+                continue
+            position = len(self.keys)
+            self.keys.append(key)
+            self.tokens.append(key_tokens)
+            for token in key_tokens:
+                self.postings.setdefault(token, []).append(position)
+
+        # Peso IDF por token: los tokens raros ('salmon') pesan más que los comunes ('cocido')
+        total = max(len(self.keys), 1)
+        self.idf = {token: 1.0 + (total / len(positions)) ** 0.5 for token, positions in self.postings.items()}
+        self.weights = [sum(self.idf[t] for t in key_tokens) for key_tokens in self.tokens]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match(self, normalized_name):
+        """
+        Devuelve la clave de FOOD_DATABASE que mejor corresponde a normalized_name
+        (ya pasado por normalize_food_name), o None.
+        1. Coincidencia exacta del nombre normalizado (sin tildes, minúsculas).
+        2. Coincidencia por tokens: todos los tokens de la clave están en el nombre o viceversa
+           (equivalente a la antigua coincidencia por subcadena, pero a nivel de palabra).
+           Entre los candidatos se elige el de mayor similitud ponderada (Dice con IDF);
+           los empates se resuelven por menos tokens y luego por orden alfabético.
+        """
+        exact_key = self.exact.get(normalized_name)
+        if exact_key is not None:
+            return exact_key
+
+        query_tokens = tokenize_food_name(normalized_name)
+        if not query_tokens:
+            return None
+
+        # Acumular el peso compartido solo de las entradas que comparten algún token
+        shared_weight = {}
+        for token in query_tokens:
+            weight = self.idf.get(token)
+            if weight is None:
+                continue
+            for position in self.postings[token]:
+                shared_weight[position] = shared_weight.get(position, 0.0) + weight
+
+        if not shared_weight:
+            return None
+
+        query_weight = sum(self.idf.get(t, 1.0) for t in query_tokens)
+        best_rank = None
+        best_position = None
+        for position, shared in shared_weight.items():
+            key_tokens = self.tokens[position]
+            if not (key_tokens <= query_tokens or query_tokens <= key_tokens):
+                continue
+            score = 2.0 * shared / (query_weight + self.weights[position])
+            rank = (-score, len(key_tokens), self.keys[position])
+            if best_rank is None or rank < best_rank:
+                best_rank = rank
+                best_position = position
+
+        return self.keys[best_position] if best_position is not None else None
+
+
+class _MatchCache:
+    """
+    Caché LRU acotada: nombre normalizado -> clave de FOOD_DATABASE (o None si no hubo coincidencia).
+    Guarda también los resultados negativos para no repetir la búsqueda por tokens.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, normalized_name):
+        """Devuelve (encontrado, clave). encontrado=False si el nombre no está en caché."""
+        with self._lock:
+            if normalized_name in self._entries:
+                self._entries.move_to_end(normalized_name)
+                self.hits += 1
+                return True, self._entries[normalized_name]
+            self.misses += 1
+            return False, None
+
+    def put(self, normalized_name, key):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[normalized_name] = key
+            self._entries.move_to_end(normalized_name)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            negatives = sum(1 for key in self._entries.values() if key is None)
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "negative_entries": negatives,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "miss_rate": round(self.misses / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Índice de búsqueda y tabla de nutrientes de una misma construcción, en una sola tupla para que
+# nunca se lea el índice de una y la tabla de otra. Se reconstruyen si cambia FOOD_DATABASE.
+_food_tables = (_FoodIndex(FOOD_DATABASE), NutrientTable.from_food_database(FOOD_DATABASE))
+_match_cache = _MatchCache(FOOD_MATCH_CACHE_SIZE)
+_index_lock = threading.Lock()
+
+
+def refresh_food_index():
+    """
+    Reconstruye el índice de búsqueda y la tabla de nutrientes a partir de FOOD_DATABASE
+    e invalida la caché de coincidencias. Se llama automáticamente cuando cambia el contenido
+    de FOOD_DATABASE (ver food_database_fingerprint).
+    """
+    global _food_tables
+    with _index_lock:
+        _food_tables = (_FoodIndex(FOOD_DATABASE), NutrientTable.from_food_database(FOOD_DATABASE))
+        _match_cache.clear()
+    print(f"🔄 Índice de alimentos reconstruido ({len(_food_tables[0])} entradas).")
+
+
+def _current_food_tables():
+    """(índice, tabla de nutrientes) al día con FOOD_DATABASE, reconstruyéndolos si cambió su contenido."""
+    tables = _food_tables
+    if tables[0].source_fingerprint != food_database_fingerprint(FOOD_DATABASE):
+        refresh_food_index()
+        tables = _food_tables
+    return tables
+
+
+def _match_food_key(food_index, food_name):
+    """Busca food_name en food_index pasando por la caché de coincidencias."""
+    normalized_name = normalize_food_name(food_name)
+    found, key = _match_cache.get(normalized_name)
+    if found:
+        return key
+    key = food_index.match(normalized_name)
+    _match_cache.put(normalized_name, key)
+    return key
+
+
+def find_food_key(food_name):
+    """Devuelve la clave de FOOD_DATABASE que corresponde a food_name, o None si no hay coincidencia."""
+    if not food_name:
+        return None
+    food_index, _ = _current_food_tables()
+    return _match_food_key(food_index, food_name)
+
+
+def get_food_match_cache_stats():
+    """Estadísticas de la caché de coincidencias (aciertos, fallos, expulsiones, tamaño)."""
+    return _match_cache.stats()
 
 
 def get_food_data_from_db(food_name):
     """
     Busca un alimento en FOOD_DATABASE y devuelve sus datos nutricionales.
-    Intenta una coincidencia exacta normalizada y luego una parcial.
+    Intenta una coincidencia exacta normalizada y luego una parcial por tokens
+    usando el índice invertido construido al importar el módulo.
     """
-    normalized_name = normalize_food_name(food_name)
+    key = find_food_key(food_name)
+    if key is None:
+        return None
+    return FOOD_DATABASE.get(key)  # None si la entrada desapareció justo después de buscarla
+
+
+NUTRIENT_KEYS = NUTRIENT_COLUMNS
+
+
+def _parse_quantity(value):
+    """Convierte la cantidad estimada por Gemini a gramos enteros (0 si no es válida)."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def resolve_meal(alimentos_detallados):
+    """
+    Resuelve en una sola pasada todos los ingredientes devueltos por GeminiAnalyzer.analyze_image.
+    alimentos_detallados: lista de dicts con 'nombre_alimento', 'cantidad_estimada_g',
+    'nutrientes_estimados' y 'es_estimado'.
+
+    Para cada ingrediente busca su entrada en FOOD_DATABASE (cada nombre distinto se resuelve
+    una sola vez). Los ingredientes encontrados se escalan juntos con la tabla de nutrientes
+    (gather de filas x gramos / 100); el resto usa las estimaciones de Gemini. Devuelve un diccionario con:
+    - "alimentos_detallados": formato que se guarda en MongoDB (DataLogger).
+    - "alimentos_respuesta": formato que espera la aplicación móvil.
+    - "calorias_totales", "proteinas_totales", "grasas_totales", "carbohidratos_totales".
+    - "coincidencias_bd": cuántos ingredientes se calcularon con la BD local.
+    """
+    items = list(alimentos_detallados or [])
+    # Índice y tabla de la misma construcción durante toda la llamada (aunque otra la reconstruya)
+    food_index, nutrient_table = _current_food_tables()
+    resolved_rows = {}
+    names = []
+    grams = np.zeros(len(items), dtype=np.float64)
+    # Matriz (n_items, 4): parte de las estimaciones de Gemini y se sobrescribe con la BD local
+    nutrients = np.zeros((len(items), len(NUTRIENT_KEYS)), dtype=np.float64)
+    matched_positions = []
+    matched_rows = []
+
+    for position, item in enumerate(items):
+        nombre = (item.get("nombre_alimento") or "Desconocido").strip()
+        names.append(nombre)
+        grams[position] = _parse_quantity(item.get("cantidad_estimada_g", 0))
+
+        if nombre not in resolved_rows:
+            key = _match_food_key(food_index, nombre) if nombre else None
+            # row() devuelve None si la clave no está en esta tabla (caché llenada por otra construcción)
+            resolved_rows[nombre] = nutrient_table.row(key) if key is not None else None
+        row = resolved_rows[nombre]
+
+        if row is not None and grams[position] > 0:
+            matched_positions.append(position)
+            matched_rows.append(row)
+        else:
+            estimados = item.get("nutrientes_estimados") or {}
+            for column, nutrient in enumerate(NUTRIENT_KEYS):
+                try:
+                    nutrients[position, column] = float(estimados.get(nutrient, 0.0) or 0.0)
+                except (TypeError, ValueError):
+                    nutrients[position, column] = 0.0
+
+    if matched_positions:
+        # Un único gather-multiplicación sobre la tabla columnar para todos los ingredientes encontrados
+        nutrients[matched_positions] = nutrient_table.scale(matched_rows, grams[matched_positions])
+    # Redondeo con round() de Python valor a valor y totales sumados en orden, como antes de la tabla:
+    # np.round redondea distinto algunos valores en el límite (ej. 0.405 -> 0.4 en vez de 0.41)
+    nutrients = [[round(value, 2) for value in row] for row in nutrients.tolist()]
+    totals = [0.0] * len(NUTRIENT_KEYS)
+    for row in nutrients:
+        for column, value in enumerate(row):
+            totals[column] += value
 
-    # Coincidencia exacta primero
-    if normalized_name in FOOD_DATABASE:
-        return FOOD_DATABASE[normalized_name]
+    matched = np.zeros(len(items), dtype=bool)
+    matched[matched_positions] = True
 
-    # Coincidencia parcial: si el nombre de Gemini está contenido en la clave, o viceversa
-    # Esto puede devolver la primera coincidencia, lo cual es razonable para una base de datos de este tipo.
-    for db_food_name, db_data in FOOD_DATABASE.items():
-        if normalized_name in normalize_food_name(db_food_name) or normalize_food_name(db_food_name) in normalized_name:
-            return db_data
+    foods_for_db = []
+    foods_for_app = []
+    for position, item in enumerate(items):
+        usado_bd_local = bool(matched[position])
+        cantidad_g = int(grams[position])
+        item_nutrients = dict(zip(NUTRIENT_KEYS, nutrients[position]))
+        if usado_bd_local:
+            nombre_final = names[position].title()
+        else:
+            nombre_final = names[position].title() + " (Estimado por IA)"  # Etiqueta para identificar
 
-    return None
+        foods_for_db.append({
+            "nombre_alimento": nombre_final,
+            "cantidad_g": cantidad_g,
+            "nutrientes": item_nutrients,  # Nutrientes para esa cantidad
+            "es_estimado_ia_original": item.get("es_estimado", True),  # Si Gemini lo marcó como estimado
+            "usado_bd_local_para_calculo": usado_bd_local  # Indica si se usó la BD local para el cálculo
+        })
+        foods_for_app.append({
+            "nombre": nombre_final,
+            "cantidad_g": cantidad_g,
+            **item_nutrients,
+            "es_estimado": not usado_bd_local  # Si el cálculo final es estimado o de BD
+        })
 
-# NOTA IMPORTANTE: La función 'recalculate_meal_totals' ha sido eliminada.
-# La lógica de cálculo de totales ahora reside completamente en 'app.py'
-# para integrar los resultados de Gemini con tu base de datos local de manera eficiente.
\ No newline at end of file
+    result = {
+        "alimentos_detallados": foods_for_db,
+        "alimentos_respuesta": foods_for_app,
+        "coincidencias_bd": len(matched_positions),
+    }
+    for column, nutrient in enumerate(NUTRIENT_KEYS):
+        result[f"{nutrient}_totales"] = round(totals[column], 2)
+    return result
@@ -1,12 +1,63 @@
 import os
-import io
 import json
 import base64
+import hashlib
 import requests
 import re  # <-- Add this import for more robust JSON parsing
 
-from PIL import Image
-from src.config import OPENROUTER_API_KEY, OPENROUTER_URL, GEMINI_MODEL_NAME
+from src.analysis_cache import AnalysisCache
+from src.image_preprocessor import preprocess_image
+from src.openrouter_client import OpenRouterClient, CircuitBreaker, is_transient_error
+from src.stream_parser import IncrementalFoodParser
+from src.config import (
+    OPENROUTER_API_KEY, OPENROUTER_URL, GEMINI_MODEL_NAME,
+    ANALYSIS_CACHE_ENABLED, ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_TTL_SECONDS, ANALYSIS_CACHE_DIR,
+    OPENROUTER_POOL_SIZE, OPENROUTER_MAX_RETRIES, OPENROUTER_BACKOFF_BASE_SECONDS, OPENROUTER_BACKOFF_MAX_SECONDS,
+    OPENROUTER_CONNECT_TIMEOUT_SECONDS, OPENROUTER_READ_TIMEOUT_SECONDS, OPENROUTER_TOTAL_TIMEOUT_SECONDS,
+    OPENROUTER_CIRCUIT_FAILURE_THRESHOLD, OPENROUTER_CIRCUIT_RESET_SECONDS,
+    IMAGE_MAX_EDGE_PX, IMAGE_QUALITY, IMAGE_OUTPUT_FORMAT, IMAGE_PASSTHROUGH_MAX_BYTES,
+)
+
+# --- PROMPT MEJORADO SIGNIFICATIVAMENTE ---
+ANALYSIS_PROMPT = (
+    "Eres un experto en nutrición y reconocimiento de alimentos. Tu tarea es analizar detalladamente la imagen de comida proporcionada. "
+    "**Debes identificar el nombre típico o general del plato si es un conjunto (ej. 'Chorrillana', 'Ensalada César', 'Tazón de Avena').** "
+    "Si no es un plato combinado, usa el nombre del único alimento (ej. 'Manzana Roja'). "
+    "Luego, **desglosa el plato en CADA UNO DE SUS INGREDIENTES INDIVIDUALES PRINCIPALES Y ESPECÍFICOS** visibles."
+    "Para CADA ingrediente individual identificado (ej. 'carne de res', 'papas fritas', 'cebolla acaramelizada', 'huevo frito' para una chorrillana): "
+    "1. Proporciona su 'nombre' (lo más específico posible, en español, ej. 'Filete de Res', 'Papas Fritas Caseras')."
+    "2. Estima su 'cantidad_g' (peso aproximado en gramos, número entero). "
+    "3. Estima sus valores nutricionales: 'calorias', 'proteinas' (g), 'grasas' (g), y 'carbohidratos' (g) **para esa 'cantidad_g' estimada**."
+    "4. Indica con un booleano 'es_estimado' (true/false) si estas estimaciones son aproximadas basadas en la IA."
+    "Finalmente, calcula y proporciona también las 'calorias_totales', 'proteinas_totales', 'grasas_totales', y 'carbohidratos_totales' del **plato completo** (sumatoria de todos los ingredientes)."
+
+    "La respuesta debe ser EXCLUSIVAMENTE un objeto JSON válido, sin ningún texto adicional antes o después, y debe seguir esta estructura EXACTA:"
+    "\n```json\n"  # <-- Importante pedir el formato en un bloque de código JSON
+    "{\n"
+    "  \"nombre_general_comida\": \"Nombre típico del plato (ej. Chorrillana Clásica, Desayuno con Huevos y Tocino)\",\n"
+    "  \"calorias_totales\": float,\n"
+    "  \"proteinas_totales\": float,\n"
+    "  \"grasas_totales\": float,\n"
+    "  \"carbohidratos_totales\": float,\n"
+    "  \"alimentos_detallados\": [\n"
+    "    {\n"
+    "      \"nombre\": \"nombre del ingrediente (ej. Carne de res, Papas fritas)\",\n"
+    "      \"cantidad_g\": int,\n"
+    "      \"calorias\": float,\n"
+    "      \"proteinas\": float,\n"
+    "      \"grasas\": float,\n"
+    "      \"carbohidratos\": float,\n"
+    "      \"es_estimado\": boolean\n"
+    "    }\n"
+    "  ]\n"
+    "}\n"
+    "```\n"
+    "Si la imagen no contiene alimentos claros o el plato no puede ser desglosado de forma significativa, devuelve el JSON con 'alimentos_detallados' vacío y los totales en 0, y 'nombre_general_comida' como 'No se pudo identificar un plato claro'."
+    "Asegúrate de que la salida sea SOLO el objeto JSON y nada más. Si puedes, proporciona los valores nutricionales con hasta 2 decimales."
+)
+
+# La versión del prompt forma parte de la clave de caché: cualquier cambio en el texto invalida los resultados previos
+PROMPT_VERSION = hashlib.sha256(ANALYSIS_PROMPT.encode("utf-8")).hexdigest()[:12]
 
 
 class GeminiAnalyzer:
@@ -17,156 +68,250 @@ class GeminiAnalyzer:
 
         print(f"Configurando para OpenRouter con modelo '{GEMINI_MODEL_NAME}' en URL '{OPENROUTER_URL}'.")
 
-    def analyze_image(self, image_path):
+        self.client = OpenRouterClient(
+            api_key=OPENROUTER_API_KEY,
+            url=OPENROUTER_URL,
+            pool_size=OPENROUTER_POOL_SIZE,
+            max_retries=OPENROUTER_MAX_RETRIES,
+            backoff_base=OPENROUTER_BACKOFF_BASE_SECONDS,
+            backoff_max=OPENROUTER_BACKOFF_MAX_SECONDS,
+            connect_timeout=OPENROUTER_CONNECT_TIMEOUT_SECONDS,
+            read_timeout=OPENROUTER_READ_TIMEOUT_SECONDS,
+            total_timeout=OPENROUTER_TOTAL_TIMEOUT_SECONDS,
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=OPENROUTER_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=OPENROUTER_CIRCUIT_RESET_SECONDS,
+            ),
+        )
+
+        self.cache = None
+        if ANALYSIS_CACHE_ENABLED:
+            self.cache = AnalysisCache(
+                max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+                ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS,
+                persist_dir=ANALYSIS_CACHE_DIR,
+            )
+
+    def _cache_key(self, image_path, image_hash=None):
+        """
+        Clave de caché de la imagen, o None si la caché está desactivada o no se puede leer el archivo.
+        Con image_hash (SHA-256 del contenido, ej. el del almacén de ImageManager) no hace falta leer la imagen.
+        """
+        if self.cache is None:
+            return None
+        if image_hash:
+            return AnalysisCache.make_key_for_hash(image_hash, GEMINI_MODEL_NAME, PROMPT_VERSION)
+        try:
+            with open(image_path, "rb") as f:
+                return AnalysisCache.make_key(f.read(), GEMINI_MODEL_NAME, PROMPT_VERSION)
+        except OSError as e:
+            print(f"⚠️ No se pudo leer la imagen para la caché de análisis: {e}")
+            return None
+
+    def _get_cached(self, cache_key):
+        """Devuelve el resultado en caché (con cache_status="hit") o None."""
+        if cache_key is None:
+            return None
+        cached_result = self.cache.get(cache_key)
+        if cached_result is not None:
+            print(f"♻️ Caché de análisis: HIT ({cache_key[:12]}). Se omite la llamada a OpenRouter.")
+            cached_result["cache_status"] = "hit"
+            return cached_result
+        print(f"🆕 Caché de análisis: MISS ({cache_key[:12]}).")
+        return None
+
+    def _store_result(self, cache_key, result):
+        """Guarda un análisis correcto en caché y marca su cache_status."""
+        if cache_key is None:
+            result["cache_status"] = "disabled"
+            return result
+        if not result.get("error"):
+            # Solo se guardan análisis correctos; los errores deben poder reintentarse
+            self.cache.put(cache_key, result)
+        result["cache_status"] = "miss"
+        return result
+
+    def analyze_image(self, image_path, image_hash=None, rate_limiter=None):
         """
         Analiza una imagen utilizando la API de OpenRouter (para Gemini) y extrae información de los alimentos.
-        Intenta identificar alimentos, estimar su cantidad en gramos y sus nutrientes.
-        Devuelve la respuesta en un formato estructurado (diccionario) listo para ser procesado.
+        Antes de llamar a la API consulta la caché por contenido (hash de la imagen + modelo + versión del prompt).
+        Devuelve la respuesta en un formato estructurado (diccionario) listo para ser procesado, con la clave
+        'cache_status' en "hit", "miss" o "disabled". image_hash: SHA-256 de la imagen, si ya se conoce.
+        rate_limiter: objeto con acquire() que se llama antes de cada llamada real a la API (no en los aciertos de caché).
+        """
+        cache_key = self._cache_key(image_path, image_hash)
+        cached_result = self._get_cached(cache_key)
+        if cached_result is not None:
+            return cached_result
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        return self._store_result(cache_key, self._analyze_uncached(image_path))
+
+    def analyze_image_stream(self, image_path, image_hash=None):
+        """
+        Variante en streaming de analyze_image. Es un generador de eventos (tipo, datos):
+        - ("item", alimento): cada ingrediente de 'alimentos_detallados' en cuanto Gemini termina de escribirlo,
+          con el mismo formato que los de analyze_image.
+        - ("result", resultado): el resultado completo, idéntico al que devolvería analyze_image
+          (incluye 'error' si algo falló).
+        Si el análisis está en caché, se emiten sus ingredientes de inmediato.
         """
+        cache_key = self._cache_key(image_path, image_hash)
+        cached_result = self._get_cached(cache_key)
+        if cached_result is not None:
+            for item in cached_result.get("alimentos_detallados", []):
+                yield "item", item
+            yield "result", cached_result
+            return
+
+        response_text = None
         try:
-            pil_image = Image.open(image_path)
-            img_byte_arr = io.BytesIO()
-            pil_image.save(img_byte_arr, format='JPEG')  # Guardar como JPEG para consistencia
-            image_data = img_byte_arr.getvalue()
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-
-            image_url_data = f"data:image/jpeg;base64,{base64_image}"
-
-            # --- PROMPT MEJORADO SIGNIFICATIVAMENTE ---
-            prompt = (
-                "Eres un experto en nutrición y reconocimiento de alimentos. Tu tarea es analizar detalladamente la imagen de comida proporcionada. "
-                "**Debes identificar el nombre típico o general del plato si es un conjunto (ej. 'Chorrillana', 'Ensalada César', 'Tazón de Avena').** "
-                "Si no es un plato combinado, usa el nombre del único alimento (ej. 'Manzana Roja'). "
-                "Luego, **desglosa el plato en CADA UNO DE SUS INGREDIENTES INDIVIDUALES PRINCIPALES Y ESPECÍFICOS** visibles."
-                "Para CADA ingrediente individual identificado (ej. 'carne de res', 'papas fritas', 'cebolla acaramelizada', 'huevo frito' para una chorrillana): "
-                "1. Proporciona su 'nombre' (lo más específico posible, en español, ej. 'Filete de Res', 'Papas Fritas Caseras')."
-                "2. Estima su 'cantidad_g' (peso aproximado en gramos, número entero). "
-                "3. Estima sus valores nutricionales: 'calorias', 'proteinas' (g), 'grasas' (g), y 'carbohidratos' (g) **para esa 'cantidad_g' estimada**."
-                "4. Indica con un booleano 'es_estimado' (true/false) si estas estimaciones son aproximadas basadas en la IA."
-                "Finalmente, calcula y proporciona también las 'calorias_totales', 'proteinas_totales', 'grasas_totales', y 'carbohidratos_totales' del **plato completo** (sumatoria de todos los ingredientes)."
-
-                "La respuesta debe ser EXCLUSIVAMENTE un objeto JSON válido, sin ningún texto adicional antes o después, y debe seguir esta estructura EXACTA:"
-                "\n```json\n"  # <-- Importante pedir el formato en un bloque de código JSON
-                "{\n"
-                "  \"nombre_general_comida\": \"Nombre típico del plato (ej. Chorrillana Clásica, Desayuno con Huevos y Tocino)\",\n"
-                "  \"calorias_totales\": float,\n"
-                "  \"proteinas_totales\": float,\n"
-                "  \"grasas_totales\": float,\n"
-                "  \"carbohidratos_totales\": float,\n"
-                "  \"alimentos_detallados\": [\n"
-                "    {\n"
-                "      \"nombre\": \"nombre del ingrediente (ej. Carne de res, Papas fritas)\",\n"
-                "      \"cantidad_g\": int,\n"
-                "      \"calorias\": float,\n"
-                "      \"proteinas\": float,\n"
-                "      \"grasas\": float,\n"
-                "      \"carbohidratos\": float,\n"
-                "      \"es_estimado\": boolean\n"
-                "    }\n"
-                "  ]\n"
-                "}\n"
-                "```\n"
-                "Si la imagen no contiene alimentos claros o el plato no puede ser desglosado de forma significativa, devuelve el JSON con 'alimentos_detallados' vacío y los totales en 0, y 'nombre_general_comida' como 'No se pudo identificar un plato claro'."
-                "Asegúrate de que la salida sea SOLO el objeto JSON y nada más. Si puedes, proporciona los valores nutricionales con hasta 2 decimales."
-            )
+            payload = self._build_payload(image_path)
+            parser = IncrementalFoodParser()
+            chunks = []
+            for delta in self.client.stream_chat_completion(payload):
+                chunks.append(delta)
+                for raw_item in parser.feed(delta):
+                    try:
+                        yield "item", self._process_item(raw_item)
+                    except (TypeError, ValueError, AttributeError) as e:
+                        print(f"⚠️ Ingrediente malformado en el streaming, se omite: {e}")
+            response_text = "".join(chunks).strip()
+            print(f"Respuesta cruda de OpenRouter/Gemini (streaming, {parser.items_emitted} ingredientes):\n{response_text}")
+            result = self._parse_response_text(response_text)
+        except Exception as e:
+            result = self._error_result(e, response_text)
+        yield "result", self._store_result(cache_key, result)
 
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-            }
-
-            payload = {
-                "model": GEMINI_MODEL_NAME,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": image_url_data}},
-                        ],
-                    }
-                ],
-                "temperature": 0.3,  # Baja la temperatura para respuestas más concisas y menos creativas
-                "max_tokens": 4000  # Suficientes tokens para un desglose detallado
-            }
-
-            response = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=90)
-            response.raise_for_status()  # Lanza un error para códigos de estado HTTP 4xx/5xx
-
-            response_json = response.json()
-            response_text = response_json['choices'][0]['message']['content'].strip()
+    def _build_payload(self, image_path):
+        """Prepara la imagen y construye el cuerpo de la petición de chat completion."""
+        # Reducir la imagen (orientación EXIF, lado máximo, calidad) antes de codificarla en base64
+        prepared = preprocess_image(
+            image_path,
+            max_edge=IMAGE_MAX_EDGE_PX,
+            quality=IMAGE_QUALITY,
+            output_format=IMAGE_OUTPUT_FORMAT,
+            passthrough_max_bytes=IMAGE_PASSTHROUGH_MAX_BYTES,
+        )
+        print(
+            f"🗜️ Imagen preparada: {prepared['original_bytes'] / 1024:.0f} KB → {prepared['output_bytes'] / 1024:.0f} KB "
+            f"({prepared['bytes_saved'] / 1024:.0f} KB ahorrados, {prepared['output_size'][0]}x{prepared['output_size'][1]}"
+            f"{', sin recodificar' if prepared['passthrough'] else ''}).")
+        base64_image = base64.b64encode(prepared["data"]).decode('ascii')
 
-            print(f"Respuesta cruda de OpenRouter/Gemini:\n{response_text}")  # Para depuración
+        image_url_data = f"data:{prepared['mime_type']};base64,{base64_image}"
 
-            # --- MEJORA EN EL PARSEO DEL JSON ---
-            # Busca el bloque JSON dentro de ```json ... ``` o intenta parsear directamente
-            match = re.search(r"```json\n(\{.*\})\n```", response_text, re.DOTALL)
-            if match:
-                json_content = match.group(1)
-            else:
-                # Si no está en un bloque de código, asume que la respuesta directa es el JSON
-                json_content = response_text
-
-            gemini_result = json.loads(json_content)
-
-            # --- VALIDACIÓN DE LA ESTRUCTURA ESPERADA ---
-            # Asegura que el resultado sea un diccionario y contenga la clave esperada
-            if not isinstance(gemini_result, dict) or "alimentos_detallados" not in gemini_result:
-                raise ValueError(
-                    "La respuesta JSON de Gemini no tiene la estructura esperada: debe ser un objeto con 'alimentos_detallados'.")
-
-            # Preparamos los alimentos detallados para el formato final
-            processed_foods = []
-            for item in gemini_result.get("alimentos_detallados", []):
-                processed_foods.append({
-                    "nombre_alimento": item.get("nombre", "Desconocido").strip(),
-                    "cantidad_estimada_g": float(item.get("cantidad_g", 0)),
-                    # Aquí ya usamos los valores nutricionales 'tal cual' de Gemini,
-                    # ya que el prompt le pidió que fueran por la 'cantidad_g' estimada.
-                    "nutrientes_estimados": {
-                        "calorias": round(item.get("calorias", 0.0), 2),
-                        "proteinas": round(item.get("proteinas", 0.0), 2),
-                        "grasas": round(item.get("grasas", 0.0), 2),
-                        "carbohidratos": round(item.get("carbohidratos", 0.0), 2)
-                    },
-                    "es_estimado": item.get("es_estimado", True)  # Asumir True si no está presente
-                })
-
-            # Preparamos el diccionario final que será devuelto a app.py
-            # Las claves de nivel superior se toman directamente del resultado de Gemini
-            final_result = {
-                "nombre_general_comida": gemini_result.get("nombre_general_comida", "Plato sin nombre").strip(),
-                "calorias_totales": round(gemini_result.get("calorias_totales", 0.0), 2),
-                "proteinas_totales": round(gemini_result.get("proteinas_totales", 0.0), 2),
-                "grasas_totales": round(gemini_result.get("grasas_totales", 0.0), 2),
-                "carbohidratos_totales": round(gemini_result.get("carbohidratos_totales", 0.0), 2),
-                "alimentos_detallados": processed_foods,  # Ya procesados
-                "error": None  # No hay error si llegamos hasta aquí
-            }
-
-            return final_result
-
-        except requests.exceptions.RequestException as e:
+        return {
+            "model": GEMINI_MODEL_NAME,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": ANALYSIS_PROMPT},
+                        {"type": "image_url", "image_url": {"url": image_url_data}},
+                    ],
+                }
+            ],
+            "temperature": 0.3,  # Baja la temperatura para respuestas más concisas y menos creativas
+            "max_tokens": 4000  # Suficientes tokens para un desglose detallado
+        }
+
+    @staticmethod
+    def _process_item(item):
+        """Convierte un ingrediente tal como lo escribe Gemini al formato que espera app.py."""
+        return {
+            "nombre_alimento": item.get("nombre", "Desconocido").strip(),
+            "cantidad_estimada_g": float(item.get("cantidad_g", 0)),
+            # Aquí ya usamos los valores nutricionales 'tal cual' de Gemini,
+            # ya que el prompt le pidió que fueran por la 'cantidad_g' estimada.
+            "nutrientes_estimados": {
+                "calorias": round(item.get("calorias", 0.0), 2),
+                "proteinas": round(item.get("proteinas", 0.0), 2),
+                "grasas": round(item.get("grasas", 0.0), 2),
+                "carbohidratos": round(item.get("carbohidratos", 0.0), 2)
+            },
+            "es_estimado": item.get("es_estimado", True)  # Asumir True si no está presente
+        }
+
+    def _parse_response_text(self, response_text):
+        """Extrae y valida el JSON de la respuesta de Gemini y lo lleva al formato final."""
+        # --- MEJORA EN EL PARSEO DEL JSON ---
+        # Busca el bloque JSON dentro de ```json ... ``` o intenta parsear directamente
+        match = re.search(r"```json\n(\{.*\})\n```", response_text, re.DOTALL)
+        if match:
+            json_content = match.group(1)
+        else:
+            # Si no está en un bloque de código, asume que la respuesta directa es el JSON
+            json_content = response_text
+
+        gemini_result = json.loads(json_content)
+
+        # --- VALIDACIÓN DE LA ESTRUCTURA ESPERADA ---
+        # Asegura que el resultado sea un diccionario y contenga la clave esperada
+        if not isinstance(gemini_result, dict) or "alimentos_detallados" not in gemini_result:
+            raise ValueError(
+                "La respuesta JSON de Gemini no tiene la estructura esperada: debe ser un objeto con 'alimentos_detallados'.")
+
+        # Preparamos los alimentos detallados para el formato final
+        processed_foods = [self._process_item(item) for item in gemini_result.get("alimentos_detallados", [])]
+
+        # Preparamos el diccionario final que será devuelto a app.py
+        # Las claves de nivel superior se toman directamente del resultado de Gemini
+        return {
+            "nombre_general_comida": gemini_result.get("nombre_general_comida", "Plato sin nombre").strip(),
+            "calorias_totales": round(gemini_result.get("calorias_totales", 0.0), 2),
+            "proteinas_totales": round(gemini_result.get("proteinas_totales", 0.0), 2),
+            "grasas_totales": round(gemini_result.get("grasas_totales", 0.0), 2),
+            "carbohidratos_totales": round(gemini_result.get("carbohidratos_totales", 0.0), 2),
+            "alimentos_detallados": processed_foods,  # Ya procesados
+            "error": None  # No hay error si llegamos hasta aquí
+        }
+
+    @staticmethod
+    def _error_result(e, response_text=None):
+        """
+        Convierte una excepción del análisis en el diccionario de error que espera app.py.
+        'transient' indica si el fallo es pasajero (OpenRouter no disponible) y no de la imagen en sí.
+        """
+        if isinstance(e, requests.exceptions.RequestException):
             print(f"❌ Error de red o HTTP al comunicarse con OpenRouter: {e}")
             return {"nombre_general_comida": "Error de conexión", "calorias_totales": 0, "proteinas_totales": 0,
                     "grasas_totales": 0, "carbohidratos_totales": 0, "alimentos_detallados": [],
-                    "error": f"Error de conexión con la API: {e}"}
-        except json.JSONDecodeError as e:
+                    "error": f"Error de conexión con la API: {e}", "transient": is_transient_error(e)}
+        if isinstance(e, json.JSONDecodeError):
             print(f"❌ Error al parsear la respuesta JSON de OpenRouter/Gemini: {e}")
             print(
-                f"Respuesta cruda de la API (podría estar truncada o malformada):\n{response_text if 'response_text' in locals() else 'N/A'}")
+                f"Respuesta cruda de la API (podría estar truncada o malformada):\n{response_text if response_text is not None else 'N/A'}")
             return {"nombre_general_comida": "Error de formato de IA", "calorias_totales": 0, "proteinas_totales": 0,
                     "grasas_totales": 0, "carbohidratos_totales": 0, "alimentos_detallados": [],
                     "error": f"Error al procesar la respuesta de la API: {e}"}
-        except ValueError as e:
+        if isinstance(e, ValueError):
             print(f"❌ Error de validación en la respuesta de Gemini: {e}")
             return {"nombre_general_comida": "Error de validación", "calorias_totales": 0, "proteinas_totales": 0,
                     "grasas_totales": 0, "carbohidratos_totales": 0, "alimentos_detallados": [],
                     "error": f"Error de validación de datos: {e}"}
+        print(f"❌ Error general al analizar la imagen: {e}")
+        import traceback
+        traceback.print_exc()  # Esto imprimirá el stack trace completo del error
+        return {"nombre_general_comida": "Error desconocido", "calorias_totales": 0, "proteinas_totales": 0,
+                "grasas_totales": 0, "carbohidratos_totales": 0, "alimentos_detallados": [],
+                "error": f"Error inesperado en el análisis: {e}"}
+
+    def _analyze_uncached(self, image_path):
+        """
+        Llama a la API de OpenRouter (para Gemini) y extrae información de los alimentos.
+        Intenta identificar alimentos, estimar su cantidad en gramos y sus nutrientes.
+        """
+        response_text = None
+        try:
+            payload = self._build_payload(image_path)
+
+            # El cliente reutiliza conexiones, reintenta 429/5xx y lanza un error para códigos 4xx/5xx definitivos
+            response_json = self.client.chat_completion(payload)
+            response_text = response_json['choices'][0]['message']['content'].strip()
+
+            print(f"Respuesta cruda de OpenRouter/Gemini:\n{response_text}")  # Para depuración
+
+            return self._parse_response_text(response_text)
         except Exception as e:
-            print(f"❌ Error general al analizar la imagen: {e}")
-            import traceback
-            traceback.print_exc()  # Esto imprimirá el stack trace completo del error
-            return {"nombre_general_comida": "Error desconocido", "calorias_totales": 0, "proteinas_totales": 0,
-                    "grasas_totales": 0, "carbohidratos_totales": 0, "alimentos_detallados": [],
-                    "error": f"Error inesperado en el análisis: {e}"}
+            return self._error_result(e, response_text)
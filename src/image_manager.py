@@ -1,7 +1,35 @@
+import errno
+import hashlib
+import json
 import os
 import shutil
+import string
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 # CAMBIO: Importar config desde el paquete src
-from src.config import INPUT_IMAGE_DIR, PROCESSING_IMAGE_DIR, PROCESSED_IMAGE_DIR, ERROR_IMAGE_DIR
+from src.config import INPUT_IMAGE_DIR, PROCESSING_IMAGE_DIR, PROCESSED_IMAGE_DIR, ERROR_IMAGE_DIR, IMAGE_STORE_DIR
+from src.config import THUMBNAIL_SIZES, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY, THUMBNAIL_WORKERS
+from src.image_preprocessor import make_thumbnails
+
+# Estados de una imagen del almacén (se guardan en su archivo de metadatos, sin mover la imagen)
+STATUS_PROCESSING = "processing"
+STATUS_PROCESSED = "processed"
+STATUS_ERROR = "error"
+
+HASH_CHUNK_BYTES = 1024 * 1024  # Lectura por bloques al calcular el SHA-256
+
+INPUT_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Prefijo de las imágenes reclamadas de input_images/ en processing_images/: ingest-<uuid>-<nombre original>
+CLAIM_PREFIX = "ingest-"
+
+# Extensión y tipo MIME de las miniaturas según THUMBNAIL_FORMAT
+THUMBNAIL_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+THUMBNAIL_MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
 
 class ImageManager:
     def __init__(self):
@@ -9,21 +37,258 @@ class ImageManager:
         self.processing_dir = PROCESSING_IMAGE_DIR
         self.processed_dir = PROCESSED_IMAGE_DIR
         self.error_dir = ERROR_IMAGE_DIR
+        self.store_dir = IMAGE_STORE_DIR
+        self._metadata_lock = threading.Lock()
         self._ensure_directories_exist()
 
+        # Miniaturas: se generan en segundo plano tras un análisis correcto (ver schedule_thumbnails)
+        self.thumbnail_sizes = sorted(THUMBNAIL_SIZES)
+        self.thumbnail_format = THUMBNAIL_FORMAT.upper()
+        self.thumbnail_mime_type = THUMBNAIL_MIME_TYPES[self.thumbnail_format]
+        self._thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                                                      thread_name_prefix="foodscan-thumbnails")
+        self._thumbnail_lock = threading.Lock()
+        self._thumbnails_pending = set()  # Hashes con miniaturas en cola, para no encolarlas dos veces
+
     def _ensure_directories_exist(self):
         """Crea las carpetas necesarias si no existen."""
         for directory in [self.input_dir, self.processing_dir,
-                          self.processed_dir, self.error_dir]:
+                          self.processed_dir, self.error_dir, self.store_dir]:
             os.makedirs(directory, exist_ok=True)
 
+    # --- Almacén por contenido ---
+    # Cada imagen se guarda una sola vez en store/<hash[0:2]>/<hash[2:4]>/<hash>, donde hash es el
+    # SHA-256 de su contenido, junto a <hash>.json con sus metadatos (estado, extensión, tamaño,
+    # número de subidas). Las subidas repetidas no ocupan más disco y el estado cambia sin mover archivos.
+
+    @staticmethod
+    def compute_hash(image_path):
+        """SHA-256 (hexadecimal) del contenido de la imagen."""
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_valid_hash(value):
+        return isinstance(value, str) and len(value) == 64 and all(c in string.hexdigits for c in value)
+
+    def _shard_dir(self, image_hash):
+        return os.path.join(self.store_dir, image_hash[:2], image_hash[2:4])
+
+    def image_path(self, image_hash):
+        """Ruta de la imagen en el almacén (exista o no)."""
+        return os.path.join(self._shard_dir(image_hash), image_hash)
+
+    def _metadata_path(self, image_hash):
+        return f"{self.image_path(image_hash)}.json"
+
+    def hash_for_path(self, image_path):
+        """Hash de una imagen a partir de su ruta en el almacén, o None si la ruta no es del almacén."""
+        image_hash = os.path.basename(image_path)
+        if self.is_valid_hash(image_hash) and os.path.abspath(image_path) == os.path.abspath(self.image_path(image_hash)):
+            return image_hash
+        return None
+
+    def store_file(self, source_path, extension="", keep_source=False):
+        """
+        Lleva source_path (ej. una subida guardada en processing_images/) al almacén por contenido
+        con un renombrado; si la imagen ya estaba guardada, se descarta la copia nueva.
+        Con keep_source=True source_path se conserva (se enlaza o copia al almacén en vez de moverse).
+        Una imagen nueva queda en estado "processing"; si ya estaba en el almacén se conservan sus
+        metadatos (estado incluido) y solo se anota la nueva subida. Devuelve el hash.
+        """
+        image_hash = self.compute_hash(source_path)
+        target_path = self.image_path(image_hash)
+        size_bytes = os.path.getsize(source_path)
+        duplicated = os.path.exists(target_path)
+        if duplicated:
+            if not keep_source:
+                os.remove(source_path)
+        elif keep_source:
+            os.makedirs(self._shard_dir(image_hash), exist_ok=True)
+            tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.link(source_path, tmp_path)  # Enlace duro: sin copiar datos
+            except OSError:
+                shutil.copy2(source_path, tmp_path)  # Otro disco o sistema de archivos sin enlaces
+            os.replace(tmp_path, target_path)
+        else:
+            os.makedirs(self._shard_dir(image_hash), exist_ok=True)
+            try:
+                os.replace(source_path, target_path)  # Atómico dentro del mismo sistema de archivos
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(source_path, target_path)  # IMAGE_STORE_DIR en otro disco: copia y borra
+
+        now = datetime.now().isoformat()
+        with self._metadata_lock:
+            metadata = self.get_metadata(image_hash)
+            if metadata is None:
+                metadata = {
+                    "hash": image_hash,
+                    "extension": extension.lower(),
+                    "size_bytes": size_bytes,
+                    "uploads": 0,
+                    "created_at": now,
+                    "status": STATUS_PROCESSING,
+                }
+            metadata["uploads"] = metadata.get("uploads", 0) + 1
+            metadata["last_upload_at"] = now
+            metadata["updated_at"] = now
+            self._write_metadata(image_hash, metadata)
+
+        if duplicated:
+            print(f"♻️ Imagen {image_hash[:12]} ya estaba en el almacén ({metadata['uploads']} subidas); se reutiliza.")
+        else:
+            print(f"🖼️ Imagen {image_hash[:12]} guardada en el almacén: {target_path}")
+        return image_hash
+
+    def get_metadata(self, image_hash):
+        """Metadatos de una imagen del almacén, o None si no existe."""
+        try:
+            with open(self._metadata_path(image_hash), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Metadatos ilegibles de la imagen {image_hash[:12]}: {e}")
+            return None
+
+    def _write_metadata(self, image_hash, metadata):
+        path = self._metadata_path(image_hash)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(tmp_path, path)  # Escritura atómica
+
+    def set_status(self, image_hash, status):
+        """
+        Cambia el estado de una imagen del almacén (processing, processed o error).
+        Una imagen ya procesada no vuelve a "error" porque falle un nuevo intento (ej. la misma foto
+        subida otra vez): el fallo solo se anota en 'last_error_at'.
+        """
+        try:
+            with self._metadata_lock:
+                metadata = self.get_metadata(image_hash) or {"hash": image_hash}
+                now = datetime.now().isoformat()
+                if status == STATUS_ERROR and metadata.get("status") == STATUS_PROCESSED:
+                    metadata["last_error_at"] = now
+                    status = STATUS_PROCESSED
+                metadata["status"] = status
+                metadata["updated_at"] = now
+                self._write_metadata(image_hash, metadata)
+            print(f"{'✅' if status == STATUS_PROCESSED else '🟥' if status == STATUS_ERROR else '📥'} "
+                  f"Imagen {image_hash[:12]} → estado '{status}'.")
+        except OSError as e:
+            print(f"❌ Error al actualizar el estado de la imagen {image_hash[:12]}: {e}")
+
+    # --- Miniaturas ---
+    # Se guardan junto a la imagen como <hash>_<lado>.<formato>. Como el nombre depende del contenido,
+    # una miniatura nunca cambia: se pueden servir con caché de larga duración.
+
+    def thumbnail_path(self, image_hash, size):
+        return os.path.join(self._shard_dir(image_hash),
+                            f"{image_hash}_{size}.{THUMBNAIL_EXTENSIONS[self.thumbnail_format]}")
+
+    def generate_thumbnails(self, image_hash, sizes=None):
+        """Genera (o regenera) las miniaturas de una imagen del almacén en los tamaños indicados (por defecto, todos)."""
+        sizes = sizes or self.thumbnail_sizes
+        started_at = time.monotonic()
+        thumbnails = make_thumbnails(self.image_path(image_hash), sizes,
+                                     quality=THUMBNAIL_QUALITY, output_format=self.thumbnail_format)
+        for size, data in thumbnails.items():
+            path = self.thumbnail_path(image_hash, size)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Escritura atómica: nunca se sirve una miniatura a medias
+        sizes_summary = ", ".join(f"{size}px {len(data) / 1024:.1f} KB" for size, data in sorted(thumbnails.items()))
+        print(f"🖼️ Miniaturas de {image_hash[:12]} generadas ({sizes_summary}) en {time.monotonic() - started_at:.2f}s.")
+
+    def schedule_thumbnails(self, image_hash):
+        """Encola la generación de las miniaturas que falten. Devuelve False si no faltaba ninguna o ya estaba en cola."""
+        missing = [size for size in self.thumbnail_sizes if not os.path.exists(self.thumbnail_path(image_hash, size))]
+        if not missing:
+            return False
+        with self._thumbnail_lock:
+            if image_hash in self._thumbnails_pending:
+                return False
+            self._thumbnails_pending.add(image_hash)
+        self._thumbnail_executor.submit(self._generate_in_background, image_hash, missing)
+        return True
+
+    def _generate_in_background(self, image_hash, sizes):
+        try:
+            self.generate_thumbnails(image_hash, sizes)
+        except Exception as e:
+            print(f"❌ Error al generar las miniaturas de {image_hash[:12]}: {e}")
+            traceback.print_exc()
+        finally:
+            with self._thumbnail_lock:
+                self._thumbnails_pending.discard(image_hash)
+
+    def get_thumbnail(self, image_hash, size):
+        """
+        Ruta de la miniatura de lado size (uno de THUMBNAIL_SIZES). Si falta (ej. se añadió un tamaño
+        nuevo o se borró), se genera en el momento. Devuelve None si la imagen no existe o no se puede leer.
+        """
+        if size not in self.thumbnail_sizes:
+            raise ValueError(f"Tamaño de miniatura no configurado: {size}")
+        path = self.thumbnail_path(image_hash, size)
+        if os.path.exists(path):
+            return path
+        if not os.path.exists(self.image_path(image_hash)):
+            return None
+        try:
+            self.generate_thumbnails(image_hash, [size])
+            return path
+        except Exception as e:
+            print(f"❌ Error al generar la miniatura {size}px de {image_hash[:12]}: {e}")
+            return None
+
+    # --- Carpetas de entrada/procesamiento (monitoreo de input_images/) ---
+
     def get_new_images(self):
         """Devuelve lista de imágenes en input_images/"""
-        return [
-            f for f in os.listdir(self.input_dir)
-            if os.path.isfile(os.path.join(self.input_dir, f)) and
-            f.lower().endswith(('.jpg', '.jpeg', '.png'))
-        ]
+        return [entry.name for entry in self.scan_input_images()]
+
+    def scan_input_images(self):
+        """
+        Imágenes de input_images/ como os.DirEntry, en una sola pasada con os.scandir
+        (el tipo de archivo viene del propio listado, sin un stat por archivo).
+        """
+        with os.scandir(self.input_dir) as entries:
+            return [entry for entry in entries
+                    if entry.name.lower().endswith(INPUT_IMAGE_EXTENSIONS) and not entry.name.startswith('.')
+                    and entry.is_file()]
+
+    def claim_input_image(self, image_name):
+        """
+        Reclama una imagen de input_images/ renombrándola a processing_images/ como
+        ingest-<uuid>-<nombre>. El renombrado es atómico: si otro proceso la reclamó antes
+        (o ya no existe) devuelve None; si no, la ruta de la imagen reclamada.
+        """
+        src = os.path.join(self.input_dir, image_name)
+        dst = os.path.join(self.processing_dir, f"{CLAIM_PREFIX}{uuid.uuid4().hex}-{image_name}")
+        try:
+            os.rename(src, dst)
+        except FileNotFoundError:
+            return None
+        return dst
+
+    @staticmethod
+    def claimed_image_name(claimed_path):
+        """Nombre original de una imagen reclamada con claim_input_image."""
+        return os.path.basename(claimed_path)[len(CLAIM_PREFIX):].split("-", 1)[-1]
+
+    def pending_claims(self):
+        """Imágenes reclamadas que no terminaron de procesarse (ej. el proceso se detuvo a medias), más antiguas primero."""
+        with os.scandir(self.processing_dir) as entries:
+            claims = [entry for entry in entries if entry.name.startswith(CLAIM_PREFIX) and entry.is_file()]
+        return [entry.path for entry in sorted(claims, key=lambda entry: entry.stat().st_mtime)]
 
     def move_to_processing(self, image_name):
         """Mueve la imagen a processing_images/"""
@@ -55,4 +320,4 @@ class ImageManager:
             shutil.move(src, dst)
             print(f"🟥 {image_name} → carpeta de errores.")
         except Exception as e:
-            print(f"❌ Error al mover {image_name} a errores: {e}")
\ No newline at end of file
+            print(f"❌ Error al mover {image_name} a errores: {e}")
@@ -0,0 +1,131 @@
+# src/image_preprocessor.py
+import io
+import os
+
+from PIL import Image, ImageOps
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _needs_rotation(pil_image):
+    """Indica si la imagen trae una orientación EXIF distinta de la normal."""
+    try:
+        return pil_image.getexif().get(_EXIF_ORIENTATION_TAG, 1) != 1
+    except Exception:
+        return False
+
+
+def _to_rgb(pil_image):
+    """Convierte a RGB; las transparencias se componen sobre fondo blanco en vez de negro."""
+    if pil_image.mode in ("RGBA", "LA") or (pil_image.mode == "P" and "transparency" in pil_image.info):
+        rgba = pil_image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if pil_image.mode != "RGB":
+        return pil_image.convert("RGB")
+    return pil_image
+
+
+def _passthrough(image_path, source_format, original_bytes, original_size):
+    """Resultado que envía los bytes originales sin recodificar."""
+    with open(image_path, "rb") as f:
+        data = f.read()
+    return {
+        "data": data,
+        "mime_type": _MIME_TYPES[source_format],
+        "original_bytes": original_bytes,
+        "output_bytes": len(data),
+        "bytes_saved": 0,
+        "original_size": original_size,
+        "output_size": original_size,
+        "passthrough": True,
+    }
+
+
+def preprocess_image(image_path, max_edge=1024, quality=85, output_format="JPEG", passthrough_max_bytes=300_000):
+    """
+    Prepara una imagen para enviarla a Gemini con el menor peso razonable.
+    - Si ya es JPEG/WebP, no supera max_edge ni passthrough_max_bytes y no necesita rotación,
+      se envían los bytes originales sin recodificar (también si ya cabe en max_edge y recodificar no reduce el tamaño).
+    - Si no, se decodifica en modo "draft" (JPEG a resolución reducida directamente en el decodificador),
+      se corrige la orientación EXIF, se reduce al lado máximo indicado y se recodifica
+      en output_format ("JPEG" o "WEBP") con la calidad indicada.
+    Devuelve un diccionario con 'data' (bytes), 'mime_type', 'original_bytes', 'output_bytes',
+    'bytes_saved', 'original_size', 'output_size' y 'passthrough'.
+    """
+    output_format = output_format.upper()
+    if output_format not in ("JPEG", "WEBP"):
+        raise ValueError(f"Formato de salida no soportado para el preprocesado: {output_format}")
+
+    original_bytes = os.path.getsize(image_path)
+
+    with Image.open(image_path) as pil_image:
+        source_format = pil_image.format
+        original_size = pil_image.size
+
+        can_passthrough = source_format in ("JPEG", "WEBP") and not _needs_rotation(pil_image)
+        if can_passthrough and max(original_size) <= max_edge and original_bytes <= passthrough_max_bytes:
+            return _passthrough(image_path, source_format, original_bytes, original_size)
+
+        if source_format == "JPEG":
+            # Decodifica directamente a 1/2, 1/4 u 1/8 de la resolución si basta para max_edge
+            pil_image.draft("RGB", (max_edge, max_edge))
+
+        processed = ImageOps.exif_transpose(pil_image)
+        processed = _to_rgb(processed)
+        processed.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        save_kwargs = {"quality": quality}
+        if output_format == "JPEG":
+            save_kwargs.update(optimize=True, progressive=True)
+        else:
+            save_kwargs.update(method=4)
+        processed.save(buffer, format=output_format, **save_kwargs)
+        data = buffer.getvalue()
+
+    if can_passthrough and max(original_size) <= max_edge and len(data) >= original_bytes:
+        # Recodificar no compensa: el original ya está bien comprimido
+        return _passthrough(image_path, source_format, original_bytes, original_size)
+
+    return {
+        "data": data,
+        "mime_type": _MIME_TYPES[output_format],
+        "original_bytes": original_bytes,
+        "output_bytes": len(data),
+        "bytes_saved": original_bytes - len(data),
+        "original_size": original_size,
+        "output_size": processed.size,
+        "passthrough": False,
+    }
+
+
+def make_thumbnails(image_path, sizes, quality=80, output_format="WEBP"):
+    """
+    Genera miniaturas de una imagen decodificándola una sola vez: la más grande se reduce desde
+    el original y cada una de las siguientes desde la anterior.
+    sizes: lados máximos en píxeles (ej. [128, 512]). Las miniaturas nunca agrandan la imagen.
+    Devuelve un diccionario lado -> bytes codificados en output_format ("WEBP" o "JPEG").
+    """
+    output_format = output_format.upper()
+    if output_format not in ("JPEG", "WEBP"):
+        raise ValueError(f"Formato de salida no soportado para las miniaturas: {output_format}")
+
+    thumbnails = {}
+    with Image.open(image_path) as pil_image:
+        if pil_image.format == "JPEG":
+            pil_image.draft("RGB", (max(sizes), max(sizes)))
+        current = _to_rgb(ImageOps.exif_transpose(pil_image))
+        for size in sorted(set(sizes), reverse=True):
+            current.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            save_kwargs = {"quality": quality}
+            if output_format == "JPEG":
+                save_kwargs.update(optimize=True, progressive=True)
+            else:
+                save_kwargs.update(method=4)
+            current.save(buffer, format=output_format, **save_kwargs)
+            thumbnails[size] = buffer.getvalue()
+    return thumbnails
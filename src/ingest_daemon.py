@@ -0,0 +1,352 @@
+# src/ingest_daemon.py
+"""
+Demonio que procesa las fotos que se dejan en input_images/ (cámaras, básculas, carpetas compartidas).
+
+    python -m src.ingest_daemon                 # Vigila input_images/ hasta recibir Ctrl+C o SIGTERM
+    python -m src.ingest_daemon --workers 8     # Más imágenes a la vez
+    python -m src.ingest_daemon --once          # Procesa lo que haya en la carpeta y termina
+
+Flujo de cada imagen:
+1. Detección: con inotify (Linux) el kernel avisa en cuanto un archivo termina de escribirse
+   (IN_CLOSE_WRITE) o se mueve a la carpeta (IN_MOVED_TO). Sin inotify se recorre la carpeta con
+   os.scandir cada MONITOR_INTERVAL_SECONDS.
+2. Reclamo: un worker renombra la imagen a processing_images/ (atómico: con varios demonios, solo
+   uno la procesa) y la enlaza en el almacén por contenido de ImageManager.
+3. MealPipeline: análisis con Gemini → BD local → registro, en un pool de INGEST_WORKERS hilos.
+4. La imagen reclamada se borra solo cuando el resultado es definitivo. Si el proceso se detiene
+   a medias, al arrancar se vuelven a procesar las reclamadas pendientes (entrega "al menos una vez").
+
+Contrapresión: la cola interna admite INGEST_MAX_PENDING imágenes. Con la cola llena el vigilante
+deja de leer eventos (el kernel los acumula) y las imágenes esperan en input_images/ sin reclamar.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from src.config import FOOD_SECTIONS, MONITOR_INTERVAL_SECONDS, STORAGE_BACKEND
+from src.config import INGEST_WORKERS, INGEST_MAX_PENDING, INGEST_SETTLE_SECONDS, INGEST_RESCAN_SECONDS
+from src.config import INGEST_MAX_ATTEMPTS, INGEST_RETRY_DELAY_SECONDS, INGEST_DEFAULT_MEAL_TYPE
+from src.image_manager import INPUT_IMAGE_EXTENSIONS
+
+# Constantes de <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (seguido del nombre)
+INOTIFY_READ_BYTES = 64 * 1024
+
+
+class InotifyWatcher:
+    """Vigila un directorio con inotify a través de ctypes (sin dependencias). Lanza OSError si no está disponible."""
+
+    def __init__(self, path):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify solo está disponible en Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno_value = ctypes.get_errno()
+            raise OSError(errno_value, f"inotify_init1: {os.strerror(errno_value)}")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno_value = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno_value, f"inotify_add_watch: {os.strerror(errno_value)}")
+
+    def read_events(self, timeout):
+        """
+        Espera hasta timeout segundos y devuelve los nombres de los archivos terminados o movidos
+        a la carpeta. Devuelve None si el kernel descartó eventos (hay que recorrer la carpeta).
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, INOTIFY_READ_BYTES)
+        names = []
+        overflow = False
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif name:
+                names.append(os.fsdecode(name))
+        return None if overflow else names
+
+    def close(self):
+        os.close(self.fd)
+
+
+def meal_type_for(image_name, default=INGEST_DEFAULT_MEAL_TYPE):
+    """Sección de comida según el prefijo del nombre (ej. "cena_1234.jpg" → "cena"), o default."""
+    prefix = os.path.splitext(image_name)[0].lower().replace("-", "_").split("_", 1)[0]
+    return prefix if prefix in FOOD_SECTIONS else default
+
+
+class IngestDaemon:
+    """
+    Vigila input_images/ y procesa cada imagen nueva con MealPipeline en un pool acotado de hilos.
+    Los hilos bastan para repartir la carga: cada imagen pasa casi todo el tiempo esperando a
+    Gemini y a la base de datos, y el trabajo de CPU (PIL, SHA-256) libera el GIL.
+    """
+
+    def __init__(self, meal_pipeline, image_manager, workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING):
+        self.meal_pipeline = meal_pipeline
+        self.image_manager = image_manager
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._queued = set()  # Nombres de input_images/ ya en cola (inotify y los recorridos pueden repetirlos)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.processed = 0
+        self.failed = 0
+        self.deferred = 0
+        self.retried = 0
+        self.started_at = time.monotonic()
+
+    # --- Encolado (hilo vigilante) ---
+
+    def _put(self, item):
+        """Encola item esperando si la cola está llena (contrapresión). Devuelve False si se está deteniendo."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def enqueue_input(self, image_name):
+        if not image_name.lower().endswith(INPUT_IMAGE_EXTENSIONS) or image_name.startswith('.'):
+            return
+        with self._lock:
+            if image_name in self._queued:
+                return
+            self._queued.add(image_name)
+        if not self._put(("input", image_name)):
+            with self._lock:
+                self._queued.discard(image_name)
+
+    def scan_input(self):
+        """Encola las imágenes de input_images/ que ya terminaron de escribirse."""
+        settled_before = time.time() - INGEST_SETTLE_SECONDS
+        for entry in self.image_manager.scan_input_images():
+            try:
+                if entry.stat().st_mtime > settled_before:
+                    continue  # Puede estar escribiéndose todavía: se verá en el próximo evento o recorrido
+            except FileNotFoundError:
+                continue  # Otro proceso la reclamó mientras se recorría la carpeta
+            self.enqueue_input(entry.name)
+
+    def recover_claims(self):
+        """Vuelve a encolar las imágenes reclamadas que quedaron a medias en una ejecución anterior."""
+        claims = self.image_manager.pending_claims()
+        if claims:
+            print(f"🔁 IngestDaemon: {len(claims)} imágenes reclamadas sin terminar; se vuelven a procesar.")
+        for claimed_path in claims:
+            self._put(("claimed", claimed_path))
+
+    # --- Procesamiento (workers) ---
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            kind, value = item
+            try:
+                if kind == "input":
+                    claimed_path = self.image_manager.claim_input_image(value)
+                    with self._lock:
+                        self._queued.discard(value)  # Un archivo nuevo con el mismo nombre puede volver a encolarse
+                    if claimed_path is None:
+                        continue  # Otro demonio la reclamó antes
+                else:
+                    claimed_path = value
+                self._process_claim(claimed_path)
+            except Exception as e:
+                print(f"❌ IngestDaemon: Error inesperado con {value}: {e}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def _process_claim(self, claimed_path):
+        """
+        Procesa una imagen reclamada. Se borra cuando el resultado es definitivo (registrada, o
+        el análisis falló por la propia imagen: 4xx). Los fallos pasajeros (503: OpenRouter caído,
+        timeout, 429 agotado) y los del registro (500) se reintentan sin marcar la imagen como error;
+        agotados los intentos se deja en processing_images/ (y en estado "processing" en el almacén)
+        para la próxima ejecución.
+        """
+        image_name = self.image_manager.claimed_image_name(claimed_path)
+        extension = os.path.splitext(image_name)[1].lower()
+        meal_type = meal_type_for(image_name)
+        image_hash = None
+        for attempt in range(1, INGEST_MAX_ATTEMPTS + 1):
+            started_at = time.monotonic()
+            try:
+                if image_hash is None:
+                    # Una sola vez por imagen: cada llamada anota una subida más en sus metadatos
+                    image_hash = self.image_manager.store_file(claimed_path, extension, keep_source=True)
+                # Los fallos pasajeros se reintentan aquí: la imagen no se marca como error entre intentos
+                _, status_code = self.meal_pipeline.process_image(
+                    self.image_manager.image_path(image_hash), f"{image_hash}{extension}", meal_type,
+                    finish_on_transient_error=False)
+            except Exception as e:
+                print(f"❌ IngestDaemon: Error al procesar {image_name}: {e}")
+                traceback.print_exc()
+                status_code = 500
+
+            if status_code < 500:
+                os.remove(claimed_path)
+                with self._lock:
+                    if status_code == 200:
+                        self.processed += 1
+                    else:
+                        self.failed += 1
+                print(f"{'✅' if status_code == 200 else '🟥'} IngestDaemon: {image_name} ({meal_type}) "
+                      f"terminada en {time.monotonic() - started_at:.2f}s.")
+                return
+
+            if attempt < INGEST_MAX_ATTEMPTS and not self._stop.wait(INGEST_RETRY_DELAY_SECONDS * attempt):
+                with self._lock:
+                    self.retried += 1
+                print(f"🔁 IngestDaemon: Reintentando {image_name} (intento {attempt + 1}/{INGEST_MAX_ATTEMPTS}).")
+                continue
+            break
+
+        with self._lock:
+            self.deferred += 1
+        print(f"⚠️ IngestDaemon: {image_name} queda pendiente en {claimed_path}; se reintentará al reiniciar.")
+
+    # --- Ciclo principal ---
+
+    def start_workers(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"foodscan-ingest-{index}")
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def run(self, once=False):
+        """Procesa las imágenes de input_images/ hasta stop(); con once=True, solo las que ya están."""
+        self.start_workers()
+        self.recover_claims()
+        self.scan_input()
+        if once:
+            self._queue.join()
+        else:
+            self._watch()
+        self._shutdown()
+
+    def _watch(self):
+        try:
+            watcher = InotifyWatcher(self.image_manager.input_dir)
+            print(f"🔌 IngestDaemon: Vigilando {self.image_manager.input_dir} con inotify.")
+        except OSError as e:
+            watcher = None
+            print(f"⚠️ IngestDaemon: inotify no disponible ({e}); se recorrerá la carpeta cada {MONITOR_INTERVAL_SECONDS}s.")
+
+        last_scan = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if watcher is None:
+                    self._stop.wait(MONITOR_INTERVAL_SECONDS)
+                    self.scan_input()
+                    continue
+                names = watcher.read_events(timeout=1.0)
+                if names is None:
+                    print("⚠️ IngestDaemon: El kernel descartó eventos de inotify; se recorre la carpeta completa.")
+                    self.scan_input()
+                    last_scan = time.monotonic()
+                    continue
+                for name in names:
+                    self.enqueue_input(name)
+                if time.monotonic() - last_scan >= INGEST_RESCAN_SECONDS:
+                    self.scan_input()  # Recoge lo que no generó evento (ej. archivos que aún se escribían)
+                    last_scan = time.monotonic()
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    def _shutdown(self):
+        """Deja terminar las imágenes en curso; lo que quedaba en cola sigue en input_images/ sin reclamar."""
+        self._stop.set()
+        while True:
+            try:
+                kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if kind == "input":
+                with self._lock:
+                    self._queued.discard(value)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        print(f"✅ IngestDaemon: Detenido. {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started_at
+            return {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "max_pending": self._queue.maxsize,
+                "processed": self.processed,
+                "failed": self.failed,
+                "retried": self.retried,
+                "deferred": self.deferred,
+                "images_per_minute": round(60 * (self.processed + self.failed) / elapsed, 2) if elapsed else 0.0,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa las imágenes que llegan a input_images/ de FoodScan.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help=f"Imágenes que se procesan a la vez (por defecto {INGEST_WORKERS}).")
+    parser.add_argument("--max-pending", type=int, default=INGEST_MAX_PENDING,
+                        help=f"Imágenes en cola antes de dejar de leer la carpeta (por defecto {INGEST_MAX_PENDING}).")
+    parser.add_argument("--once", action="store_true", help="Procesa lo que haya en la carpeta y termina.")
+    args = parser.parse_args(argv)
+
+    # Importados aquí para que --help no conecte con la base de datos ni configure Gemini
+    from src.data_logger import create_data_logger
+    from src.gemini_analyzer import GeminiAnalyzer
+    from src.image_manager import ImageManager
+    from src.meal_pipeline import MealPipeline
+
+    data_logger = create_data_logger(STORAGE_BACKEND)
+    image_manager = ImageManager()
+    meal_pipeline = MealPipeline(GeminiAnalyzer(), data_logger, image_manager, batch_workers=1)
+    daemon = IngestDaemon(meal_pipeline, image_manager, workers=args.workers, max_pending=args.max_pending)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    try:
+        daemon.run(once=args.once)
+    finally:
+        data_logger.close_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
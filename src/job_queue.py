@@ -0,0 +1,187 @@
+# src/job_queue.py
+import queue
+import threading
+import time
+import traceback
+import uuid
+from abc import ABC, abstractmethod
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de trabajos alcanzó su profundidad máxima."""
+
+
+class JobQueue(ABC):
+    """
+    Interfaz de una cola de trabajos en segundo plano.
+    app.py solo usa estos métodos, de modo que la implementación local en proceso
+    puede reemplazarse más adelante (Redis, RQ, Celery...) sin cambiar la API HTTP.
+    """
+
+    @abstractmethod
+    def submit(self, func, *args, **kwargs):
+        """Encola func(*args, **kwargs) y devuelve el id del trabajo. Lanza QueueFullError si no cabe."""
+
+    @abstractmethod
+    def get(self, job_id):
+        """
+        Devuelve el estado del trabajo como diccionario, o None si no existe (o ya expiró).
+        Debe responder en cualquier proceso del servidor, no solo en el que recibió el trabajo.
+        """
+
+    @abstractmethod
+    def stats(self):
+        """Métricas de la cola (profundidad, trabajos en curso, completados...)."""
+
+    @abstractmethod
+    def shutdown(self, wait=True):
+        """Detiene los workers; con wait=True espera a que terminen los trabajos encolados."""
+
+
+class LocalJobQueue(JobQueue):
+    """
+    Cola en memoria con un pool acotado de hilos.
+    - workers: número de trabajos que se ejecutan a la vez.
+    - max_depth: trabajos que pueden esperar en cola; por encima se rechazan (QueueFullError).
+    - result_ttl_seconds: tiempo que se conserva el resultado de un trabajo terminado.
+    - job_store: almacenamiento compartido del estado (un DataLogger, ver save_job/get_job).
+      El trabajo se ejecuta en el proceso que lo recibió, pero con varios workers de gunicorn
+      la consulta puede llegar a otro proceso, que lo lee de job_store.
+      Sin job_store el estado solo existe en este proceso (servidor de un único proceso).
+    La función encolada debe devolver (cuerpo, código HTTP), como MealPipeline.process_image.
+    """
+
+    def __init__(self, workers=4, max_depth=32, result_ttl_seconds=3600, job_store=None):
+        self.result_ttl_seconds = result_ttl_seconds
+        self.job_store = job_store
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"foodscan-job-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"🧵 LocalJobQueue: {workers} workers, profundidad máxima {max_depth}.")
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] and now - job["finished_at"] > self.result_ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _persist(self, job):
+        """Copia el estado del trabajo en job_store para que otros procesos puedan consultarlo."""
+        if self.job_store is not None:
+            self.job_store.save_job(job, self.result_ttl_seconds)
+
+    def submit(self, func, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "http_status": None,
+            "error": None,
+        }
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job_id] = job
+        # Antes de encolar: así el worker nunca puede guardar "running" y quedar pisado por "queued"
+        self._persist(dict(job))
+        try:
+            self._queue.put_nowait((job_id, func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+                self.rejected += 1
+            # El estado "queued" ya se guardó: sin borrarlo quedaría huérfano en job_store hasta que expire
+            if self.job_store is not None:
+                self.job_store.delete_job(job_id)
+            raise QueueFullError("La cola de análisis está llena. Intenta de nuevo en unos segundos.")
+        return job_id
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            job_id, func, args, kwargs = item
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job["status"] = "running"
+                    job["started_at"] = time.time()
+                    job = dict(job)
+                self._running += 1
+            if job is not None:
+                self._persist(job)
+            try:
+                body, http_status = func(*args, **kwargs)
+                outcome = {"status": "done" if http_status < 400 else "error", "result": body,
+                           "http_status": http_status}
+            except Exception as e:
+                print(f"❌ LocalJobQueue: El trabajo {job_id} lanzó una excepción: {e}")
+                traceback.print_exc()
+                outcome = {"status": "error", "result": None, "http_status": 500,
+                           "error": f"Error inesperado al procesar el trabajo: {e}"}
+            with self._lock:
+                self._running -= 1
+                if outcome["status"] == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.update(outcome)
+                    job["finished_at"] = time.time()
+                    job = dict(job)
+            if job is not None:
+                self._persist(job)
+            self._queue.task_done()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        # Trabajo recibido por otro proceso del servidor
+        return self.job_store.get_job(job_id) if self.job_store is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "local",
+                "workers": len(self._threads),
+                "queue_depth": self._queue.qsize(),
+                "max_depth": self._queue.maxsize,
+                "running": self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "tracked_jobs": len(self._jobs),
+            }
+
+    def shutdown(self, wait=True):
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+def create_job_queue(backend, workers, max_depth, result_ttl_seconds, job_store=None):
+    """Crea la cola de trabajos configurada. Por ahora solo existe el backend 'local'."""
+    if backend == "local":
+        return LocalJobQueue(workers=workers, max_depth=max_depth, result_ttl_seconds=result_ttl_seconds,
+                             job_store=job_store)
+    raise ValueError(f"Backend de cola de trabajos desconocido: {backend}")
@@ -0,0 +1,236 @@
+# src/meal_pipeline.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from src.food_utils import resolve_meal
+from src.image_manager import STATUS_PROCESSED, STATUS_ERROR
+
+
+class MealPipeline:
+    """
+    Flujo completo de una imagen de comida: análisis con Gemini → cruce con la BD local →
+    registro en la base de datos → estado de la imagen (procesada/error) en ImageManager.
+    Lo comparten el endpoint /analizar (síncrono o en segundo plano) y cualquier otro
+    punto de entrada que procese imágenes.
+    """
+
+    def __init__(self, gemini_analyzer, data_logger, image_manager, batch_workers=4):
+        self.gemini_analyzer = gemini_analyzer
+        self.data_logger = data_logger
+        self.image_manager = image_manager
+        # Pool compartido por todos los lotes: acota las llamadas simultáneas a Gemini
+        self._batch_executor = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="foodscan-batch")
+
+    def analyze(self, image_path, image_name):
+        """Llama a GeminiAnalyzer y devuelve su resultado estructurado."""
+        print(f"🔎 Iniciando análisis de la imagen {image_name} con Gemini...")
+        # El hash del almacén de imágenes sirve también de clave para la caché de análisis
+        gemini_raw_analysis = self.gemini_analyzer.analyze_image(
+            image_path, image_hash=self.image_manager.hash_for_path(image_path))
+        print(f"🗃️ Estado de la caché de análisis para {image_name}: {gemini_raw_analysis.get('cache_status')}")
+        print(f"DEBUG: '{gemini_raw_analysis.get('nombre_general_comida')}' con "
+              f"{len(gemini_raw_analysis.get('alimentos_detallados', []))} alimentos detallados.")
+        return gemini_raw_analysis
+
+    @staticmethod
+    def build_entry(gemini_raw_analysis):
+        """
+        Cruza el análisis de Gemini con la BD local.
+        Devuelve (documento para DataLogger, respuesta para la aplicación móvil).
+        """
+        # Extraer los datos principales de la respuesta de Gemini
+        nombre_general_comida = gemini_raw_analysis.get("nombre_general_comida", "Plato sin nombre")
+        alimentos_detallados_gemini = gemini_raw_analysis.get("alimentos_detallados", [])
+
+        # Resolver todos los ingredientes contra la BD local en una sola llamada
+        meal = resolve_meal(alimentos_detallados_gemini)
+        print(f"🍽️ {meal['coincidencias_bd']}/{len(meal['alimentos_detallados'])} alimentos calculados con la BD local.")
+
+        # Preparar el objeto final para guardar en la base de datos (DataLogger)
+        full_meal_data_for_db = {
+            "nombre_general_comida": nombre_general_comida,  # Nombre general del plato de Gemini
+            "calorias_totales": meal["calorias_totales"],
+            "proteinas_totales": meal["proteinas_totales"],
+            "grasas_totales": meal["grasas_totales"],
+            "carbohidratos_totales": meal["carbohidratos_totales"],
+            "alimentos_detallados": meal["alimentos_detallados"]
+        }
+
+        # --- Respuesta final para la aplicación móvil (ResultActivity) ---
+        response_data = {
+            "nombre": nombre_general_comida,
+            "calorias": meal["calorias_totales"],
+            "proteinas": meal["proteinas_totales"],
+            "grasas": meal["grasas_totales"],
+            "carbohidratos": meal["carbohidratos_totales"],
+            "alimentos_detallados": meal["alimentos_respuesta"],
+            "cache": gemini_raw_analysis.get("cache_status", "disabled")  # "hit" si se reutilizó un análisis previo
+        }
+        return full_meal_data_for_db, response_data
+
+    @staticmethod
+    def analysis_failure(gemini_raw_analysis):
+        """
+        (cuerpo, código HTTP) de un análisis fallido: 503 si el fallo es pasajero (OpenRouter caído,
+        timeout, 429 tras los reintentos; se puede repetir más tarde) y 400 si la imagen no se pudo analizar.
+        """
+        analysis = gemini_raw_analysis or {}
+        details = analysis.get("error", "Análisis de Gemini falló o no devolvió resultados válidos.")
+        if analysis.get("transient"):
+            return {"error": "El servicio de análisis no está disponible temporalmente. Intenta de nuevo más tarde.",
+                    "details": details}, 503
+        return {"error": "No se pudieron identificar alimentos en la imagen o el análisis de Gemini falló.",
+                "details": details}, 400
+
+    def _add_image_hash(self, full_meal_data_for_db, image_path):
+        """Añade a la entrada el hash de su imagen en el almacén ('image_hash'), si está en él."""
+        image_hash = self.image_manager.hash_for_path(image_path)
+        if image_hash is not None:
+            full_meal_data_for_db["image_hash"] = image_hash
+
+    def finish(self, image_path, image_name, success):
+        """
+        Marca la imagen como procesada o con error. Las imágenes del almacén por contenido solo
+        cambian de estado; las que están fuera (carpeta de procesamiento) se mueven como antes.
+        """
+        image_hash = self.image_manager.hash_for_path(image_path)
+        if image_hash is not None:
+            self.image_manager.set_status(image_hash, STATUS_PROCESSED if success else STATUS_ERROR)
+            if success:
+                self.image_manager.schedule_thumbnails(image_hash)  # En segundo plano: no retrasa la respuesta
+            return
+
+        if success:
+            self.image_manager.move_to_processed(image_name)
+        else:
+            self.image_manager.move_to_error(image_name)
+        # Eliminar el archivo temporal del directorio de procesamiento
+        if os.path.exists(image_path):
+            os.remove(image_path)
+
+    def process_image(self, image_path, image_name, meal_type, finish_on_transient_error=True):
+        """
+        Ejecuta el flujo completo para una imagen ya guardada en la carpeta de procesamiento.
+        Devuelve (cuerpo de la respuesta, código HTTP), igual que espera /analizar.
+        Con finish_on_transient_error=False los fallos que se pueden repetir (5xx) dejan la imagen
+        como está, sin marcarla como error, para que el llamador la reintente (ver IngestDaemon).
+        """
+        gemini_raw_analysis = self.analyze(image_path, image_name)
+        return self._log_analysis(image_path, image_name, meal_type, gemini_raw_analysis,
+                                  finish_on_transient_error=finish_on_transient_error)
+
+    def _log_analysis(self, image_path, image_name, meal_type, gemini_raw_analysis, finish_on_transient_error=True):
+        """Registra un análisis ya obtenido y mueve la imagen. Devuelve (cuerpo, código HTTP)."""
+        # --- Manejo de la respuesta de Gemini ---
+        if not gemini_raw_analysis or gemini_raw_analysis.get("error"):
+            body, status_code = self.analysis_failure(gemini_raw_analysis)
+            if status_code < 500 or finish_on_transient_error:
+                self.finish(image_path, image_name, success=False)
+                print(f"❌ Análisis fallido, moviendo a error y limpiando {image_path}")
+            else:
+                print(f"⚠️ Análisis fallido de forma pasajera para {image_name}; se reintentará.")
+            return body, status_code
+
+        full_meal_data_for_db, response_data = self.build_entry(gemini_raw_analysis)
+        self._add_image_hash(full_meal_data_for_db, image_path)
+
+        # Llama a DataLogger para registrar la entrada completa
+        log_success = self.data_logger.log_food_entry(
+            analysis_result=full_meal_data_for_db,
+            image_name=image_name,
+            meal_type=meal_type,
+            log_time=datetime.now()  # Guarda el timestamp actual
+        )
+
+        if not log_success:
+            print("❌ Falló el registro en MongoDB.")
+            if finish_on_transient_error:
+                self.finish(image_path, image_name, success=False)
+            return {"error": "Error al registrar la entrada en la base de datos."}, 500
+
+        # Mover la imagen a la carpeta de procesados después de un éxito total
+        self.finish(image_path, image_name, success=True)
+        print(f"✅ Análisis completado y entrada registrada para {image_name}.")
+        return response_data, 200
+
+    def process_image_stream(self, image_path, image_name, meal_type):
+        """
+        Variante en streaming de process_image. Generador de eventos (tipo, datos):
+        - ("ingrediente", alimento): cada ingrediente ya cruzado con la BD local, en el formato
+          de 'alimentos_detallados' de la respuesta de /analizar, en cuanto Gemini lo termina.
+        - ("resultado", respuesta) o ("error", error): al final, tras registrar la entrada en la base de datos.
+        Si el generador se cierra antes de terminar (el cliente se desconectó) o el análisis lanza una
+        excepción, la imagen se marca igualmente como error para que no quede "en procesamiento".
+        """
+        print(f"🔎 Iniciando análisis en streaming de la imagen {image_name} con Gemini...")
+        gemini_raw_analysis = None
+        image_hash = self.image_manager.hash_for_path(image_path)
+        finished = False
+        try:
+            for event_type, data in self.gemini_analyzer.analyze_image_stream(image_path, image_hash=image_hash):
+                if event_type == "item":
+                    yield "ingrediente", resolve_meal([data])["alimentos_respuesta"][0]
+                elif event_type == "result":
+                    gemini_raw_analysis = data
+
+            body, status_code = self._log_analysis(image_path, image_name, meal_type, gemini_raw_analysis)
+            finished = True  # _log_analysis ya llamó a finish()
+        finally:
+            if not finished:
+                print(f"⚠️ Análisis en streaming de {image_name} interrumpido; se marca como error.")
+                self.finish(image_path, image_name, success=False)
+        if status_code == 200:
+            yield "resultado", body
+        else:
+            yield "error", dict(body, status=status_code)
+
+    def _safe_analyze(self, image_path, image_name):
+        """analyze() que nunca lanza: los errores inesperados se devuelven como resultado con 'error'."""
+        try:
+            return self.analyze(image_path, image_name)
+        except Exception as e:
+            print(f"❌ Error inesperado al analizar {image_name}: {e}")
+            return {"error": f"Error inesperado en el análisis: {e}"}
+
+    def process_images(self, items):
+        """
+        Procesa varias imágenes a la vez.
+        items: lista de tuplas (ruta de la imagen, nombre de la imagen, meal_type).
+        Los análisis con Gemini se lanzan en paralelo en el pool acotado y todas las entradas
+        correctas se registran con una única escritura masiva.
+        Devuelve una lista de (cuerpo, código HTTP) en el mismo orden que items.
+        """
+        futures = [self._batch_executor.submit(self._safe_analyze, image_path, image_name)
+                   for image_path, image_name, _ in items]
+        analyses = [future.result() for future in futures]
+
+        results = [None] * len(items)
+        pending_entries = []
+        pending_positions = []
+        for position, ((image_path, image_name, meal_type), analysis) in enumerate(zip(items, analyses)):
+            if not analysis or analysis.get("error"):
+                self.finish(image_path, image_name, success=False)
+                results[position] = self.analysis_failure(analysis)
+                continue
+
+            full_meal_data_for_db, response_data = self.build_entry(analysis)
+            self._add_image_hash(full_meal_data_for_db, image_path)
+            results[position] = (response_data, 200)
+            pending_entries.append({
+                "analysis_result": full_meal_data_for_db,
+                "image_name": image_name,
+                "meal_type": meal_type,
+                "log_time": datetime.now()
+            })
+            pending_positions.append(position)
+
+        logged = self.data_logger.log_food_entries(pending_entries)
+        for position, success in zip(pending_positions, logged):
+            image_path, image_name, _ = items[position]
+            self.finish(image_path, image_name, success=success)
+            if not success:
+                results[position] = ({"error": "Error al registrar la entrada en la base de datos."}, 500)
+
+        print(f"📦 Lote procesado: {sum(1 for _, code in results if code == 200)}/{len(items)} imágenes registradas.")
+        return results
@@ -0,0 +1,50 @@
+# src/nutrient_table.py
+import numpy as np
+
+# Orden de las columnas de la matriz de nutrientes (valores por 100g)
+NUTRIENT_COLUMNS = ("calorias", "proteinas", "grasas", "carbohidratos")
+
+
+class NutrientTable:
+    """
+    Representación columnar de una tabla de alimentos.
+    - index: nombre del alimento -> fila.
+    - values: matriz float64 de forma (n_alimentos, 4) con calorías, proteínas,
+      grasas y carbohidratos por 100g, en el orden de NUTRIENT_COLUMNS.
+    Es una copia derivada de FOOD_DATABASE (que sigue siendo la fuente editable) pensada para
+    escalar muchos ingredientes de una vez; no ahorra memoria. Se usa float64 para que cada
+    valor escalado sea el mismo float que daba el cálculo con floats de Python; el redondeo
+    y los totales los hace resolve_meal.
+    """
+
+    def __init__(self, names, values):
+        self.names = list(names)
+        self.index = {name: row for row, name in enumerate(self.names)}
+        self.values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(self.names), len(NUTRIENT_COLUMNS))
+
+    @classmethod
+    def from_food_database(cls, food_database):
+        """Construye la tabla a partir de un diccionario con el formato de FOOD_DATABASE."""
+        names = list(food_database)
+        values = np.array(
+            [[float(food_database[name].get(f"{column}_por_100g", 0.0)) for column in NUTRIENT_COLUMNS]
+             for name in names],
+            dtype=np.float64,
+        )
+        return cls(names, values)
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, name):
+        """Devuelve la fila de un alimento o None si no está en la tabla."""
+        return self.index.get(name)
+
+    def scale(self, rows, grams):
+        """
+        Escala en bloque los valores por 100g de las filas indicadas a sus cantidades en gramos.
+        Devuelve una matriz float64 de forma (len(rows), 4).
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        grams = np.asarray(grams, dtype=np.float64)
+        return self.values[rows] * (grams[:, None] / 100.0)
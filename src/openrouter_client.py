@@ -0,0 +1,283 @@
+# src/openrouter_client.py
+import json
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Se lanza cuando el circuito está abierto y la llamada se rechaza sin contactar a OpenRouter."""
+
+
+def is_transient_error(error):
+    """
+    True si el error de la llamada a OpenRouter es pasajero y tiene sentido repetirla más tarde:
+    circuito abierto, fallo de red o timeout, o 429/5xx que siguieron fallando tras los reintentos.
+    Un 4xx distinto de 429 (petición rechazada) no lo es.
+    """
+    if isinstance(error, (CircuitOpenError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.ChunkedEncodingError)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code in OpenRouterClient.RETRY_STATUS_CODES
+    return False
+
+
+class CircuitBreaker:
+    """
+    Circuito simple de tres estados:
+    - "closed": las llamadas pasan normalmente.
+    - "open": tras failure_threshold fallos seguidos se rechazan las llamadas durante reset_timeout segundos.
+    - "half_open": pasado ese tiempo se deja pasar una llamada de prueba; si funciona se cierra el circuito.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = "half_open"
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self):
+        """Indica si se puede realizar una llamada ahora mismo."""
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self._state != "open":
+                    self.times_opened += 1
+                    print(f"🔌 OpenRouter: circuito ABIERTO tras {self._consecutive_failures} fallos consecutivos.")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class OpenRouterClient:
+    """
+    Cliente HTTP de OpenRouter reutilizable (uno por GeminiAnalyzer):
+    - Sesión con pool de conexiones keep-alive (evita un handshake TCP+TLS por imagen).
+    - Reintentos acotados con backoff exponencial con jitter, respetando 'Retry-After'.
+    - Timeouts separados de conexión y de lectura, y un plazo total (total_timeout) que incluye los reintentos.
+    - Solo se reintenta lo que seguro no llegó a procesarse: los fallos al establecer la conexión
+      (ConnectTimeout, DNS, conexión rechazada) y los códigos de RETRY_STATUS_CODES. Un timeout de lectura
+      o una conexión cortada después de enviar la petición ("Connection aborted") no se reintentan:
+      la respuesta (de pago) puede estar generándose.
+    - Circuito que falla rápido mientras OpenRouter no responde.
+    - Métricas de latencia y reintentos por llamada.
+    """
+
+    RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, api_key, url, pool_size=10, max_retries=3, backoff_base=1.0, backoff_max=20.0,
+                 connect_timeout=5.0, read_timeout=60.0, total_timeout=90.0, circuit_breaker=None):
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+        # Los reintentos los gestiona este cliente, no urllib3
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=500)  # Latencias (s) de las últimas llamadas completadas
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected_by_circuit = 0
+
+    def _retry_delay(self, attempt, response=None):
+        """Segundos a esperar antes del reintento número 'attempt' (empezando en 1)."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    try:
+                        wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                        return min(max(wait, 0.0), self.backoff_max)
+                    except (TypeError, ValueError):
+                        pass
+        # "Full jitter": aleatorio entre 0 y base * 2^(intento-1), acotado a backoff_max
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    def _record_call(self, started_at, retries, failed):
+        with self._stats_lock:
+            self.calls += 1
+            self.retries += retries
+            if failed:
+                self.failures += 1
+            self._latencies.append(time.monotonic() - started_at)
+
+    @staticmethod
+    def _failed_while_connecting(error):
+        """
+        True si el ConnectionError ocurrió al abrir la conexión, antes de enviar nada.
+        requests también lanza ConnectionError por "Connection aborted" (RemoteDisconnected, reset...)
+        con la petición ya enviada: esos no se pueden repetir sin arriesgar un doble cobro.
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        cause = error.args[0] if error.args else None
+        # requests envuelve el fallo de urllib3 en MaxRetryError; su 'reason' es el error original
+        return isinstance(getattr(cause, "reason", cause), NewConnectionError)  # Incluye NameResolutionError
+
+    def post(self, payload, stream=False):
+        """
+        Envía payload a la URL de OpenRouter con reintentos y devuelve la respuesta HTTP correcta.
+        Lanza CircuitOpenError si el circuito está abierto, o la excepción de requests del último intento.
+        """
+        if not self.circuit_breaker.allow_request():
+            with self._stats_lock:
+                self.rejected_by_circuit += 1
+            raise CircuitOpenError("OpenRouter no disponible temporalmente (circuito abierto). Intenta más tarde.")
+
+        started_at = time.monotonic()
+        deadline = started_at + self.total_timeout
+        attempt = 0
+        while True:
+            response = None
+            try:
+                # La lectura nunca se extiende más allá del plazo total
+                read_timeout = max(0.1, min(self.read_timeout, deadline - time.monotonic()))
+                response = self.session.post(self.url, json=payload, timeout=(self.connect_timeout, read_timeout),
+                                             stream=stream)
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    response.raise_for_status()  # Errores 4xx definitivos: no se reintentan
+                    self.circuit_breaker.record_success()
+                    self._record_call(started_at, attempt, failed=False)
+                    return response
+                error = requests.exceptions.HTTPError(
+                    f"{response.status_code} Error de OpenRouter: {response.reason}", response=response)
+            except requests.exceptions.HTTPError as e:
+                # 4xx distinto de 429: OpenRouter responde, así que no cuenta como caída del servicio
+                self.circuit_breaker.record_success()
+                self._record_call(started_at, attempt, failed=True)
+                raise e
+            except requests.exceptions.ConnectionError as e:
+                if not self._failed_while_connecting(e):
+                    # Conexión cortada con la petición ya enviada: no se reintenta, pero cuenta como fallo
+                    self.circuit_breaker.record_failure()
+                    self._record_call(started_at, attempt, failed=True)
+                    raise
+                error = e  # La petición no llegó a enviarse: se puede repetir sin duplicar el cobro
+            except requests.exceptions.RequestException:
+                # ReadTimeout, ChunkedEncodingError, InvalidURL...: no se reintentan, pero cuentan como fallo
+                # (y liberan la llamada de prueba del circuito si estaba entreabierto)
+                self.circuit_breaker.record_failure()
+                self._record_call(started_at, attempt, failed=True)
+                raise
+
+            attempt += 1
+            delay = self._retry_delay(attempt, response)
+            if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                self.circuit_breaker.record_failure()
+                self._record_call(started_at, attempt - 1, failed=True)
+                if response is not None:
+                    response.close()
+                raise error
+
+            if response is not None:
+                response.close()
+            print(f"🔁 OpenRouter: reintento {attempt}/{self.max_retries} en {delay:.1f}s ({error}).")
+            time.sleep(delay)
+
+    def chat_completion(self, payload):
+        """Realiza una llamada de chat completion y devuelve el JSON de la respuesta."""
+        return self.post(payload).json()
+
+    def stream_chat_completion(self, payload):
+        """
+        Realiza una llamada de chat completion en modo streaming (server-sent events) y va
+        devolviendo los fragmentos de texto de la respuesta a medida que llegan.
+        Los reintentos y el circuito solo aplican al establecimiento de la conexión.
+        """
+        payload = dict(payload, stream=True)
+        response = self.post(payload, stream=True)
+        with response:
+            for raw_line in response.iter_lines(decode_unicode=False):
+                if not raw_line or raw_line.startswith(b":"):
+                    continue  # Líneas vacías y comentarios de keep-alive (": OPENROUTER PROCESSING")
+                if not raw_line.startswith(b"data:"):
+                    continue
+                data = raw_line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    return
+                event = json.loads(data.decode("utf-8"))
+                if event.get("error"):
+                    message = event["error"].get("message") if isinstance(event["error"], dict) else event["error"]
+                    raise requests.exceptions.RequestException(f"Error de OpenRouter durante el streaming: {message}")
+                for choice in event.get("choices", []):
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            calls, retries = self.calls, self.retries
+            failures, rejected = self.failures, self.rejected_by_circuit
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "calls": calls,
+            "failures": failures,
+            "retries": retries,
+            "avg_retries_per_call": round(retries / calls, 3) if calls else 0.0,
+            "rejected_by_circuit": rejected,
+            "circuit_state": self.circuit_breaker.state,
+            "circuit_times_opened": self.circuit_breaker.times_opened,
+            "latency_p50_s": percentile(0.50),
+            "latency_p95_s": percentile(0.95),
+            "latency_max_s": round(latencies[-1], 3) if latencies else None,
+        }
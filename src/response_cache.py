@@ -0,0 +1,106 @@
+# src/response_cache.py
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Caché en memoria de respuestas ya generadas (cuerpo en bytes) de los endpoints del historial.
+    Cada entrada guarda la versión de la colección con la que se generó: si la versión actual
+    es otra, la entrada no se usa, de modo que una escritura desde cualquier proceso la invalida.
+    Además clear() libera la memoria en cuanto este proceso registra o borra una entrada.
+    - max_entries: número máximo de respuestas (LRU).
+    - max_body_bytes: las respuestas más grandes no se guardan.
+    """
+
+    def __init__(self, max_entries=128, max_body_bytes=2_000_000):
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self._entries = OrderedDict()  # clave -> (versión, cuerpo, mimetype, cabeceras)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.too_large = 0
+
+    def get(self, key, version):
+        """Devuelve (cuerpo, mimetype, cabeceras) si hay una respuesta para key generada con version."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != version:
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2], dict(entry[3])
+
+    def put(self, key, version, body, mimetype, headers=None):
+        if len(body) > self.max_body_bytes:
+            with self._lock:
+                self.too_large += 1
+            return
+        with self._lock:
+            self._entries[key] = (version, body, mimetype, dict(headers or {}))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def tee(self, key, version, chunks, mimetype, headers=None):
+        """
+        Reenvía los fragmentos de una respuesta en streaming y guarda el cuerpo resultante solo si
+        el generador original terminó sin errores y el cliente la recibió entera: una respuesta
+        cortada (error del cursor, desconexión) nunca se guarda. Deja de acumular al superar max_body_bytes.
+        """
+        collected = []
+        size = 0
+        completed = False
+        try:
+            for chunk in chunks:
+                if collected is not None:
+                    data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                    size += len(data)
+                    if size > self.max_body_bytes:
+                        collected = None
+                        with self._lock:
+                            self.too_large += 1
+                    else:
+                        collected.append(data)
+                yield chunk
+            completed = True
+        finally:
+            # Si el cliente corta la conexión, cerrar también el generador original (y su cursor)
+            if hasattr(chunks, "close"):
+                chunks.close()
+        if completed and collected is not None:
+            self.put(key, version, b"".join(collected), mimetype, headers)
+
+    def clear(self):
+        """Descarta todas las respuestas guardadas (se llama tras cada escritura en el historial)."""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(len(entry[1]) for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "too_large": self.too_large,
+            }
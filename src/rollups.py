@@ -0,0 +1,55 @@
+# src/rollups.py
+"""
+Mantenimiento de la colección de totales diarios (daily_rollups).
+
+    python -m src.rollups --verify    # Compara los totales guardados con los recalculados desde las entradas
+    python -m src.rollups --rebuild   # Recalcula y reescribe todos los totales diarios
+
+Al activar DAILY_ROLLUPS_ENABLED sobre una base con historial hay que ejecutar --rebuild una vez:
+hasta entonces /resumen sigue agregando desde las entradas (ver DataLogger.daily_rollups_complete).
+Conviene ejecutar --verify periódicamente: si un $inc falla después de registrar una entrada, los totales se desajustan.
+"""
+import argparse
+import sys
+
+from src.config import STORAGE_BACKEND
+from src.data_logger import create_data_logger
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica o reconstruye los totales diarios de FoodScan.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--verify", action="store_true", help="Solo comprueba los totales, sin modificarlos.")
+    action.add_argument("--rebuild", action="store_true", help="Recalcula y reescribe los totales diarios.")
+    parser.add_argument("--max-mismatches", type=int, default=20,
+                        help="Número máximo de diferencias a mostrar con --verify (por defecto 20).")
+    args = parser.parse_args(argv)
+
+    data_logger = create_data_logger(STORAGE_BACKEND)
+    try:
+        if not data_logger.is_healthy() or not data_logger.has_daily_rollups():
+            print("❌ No hay conexión con la base de datos o DAILY_ROLLUPS_ENABLED está desactivado.")
+            return 2
+
+        if args.rebuild:
+            result = data_logger.rebuild_daily_rollups()
+            print(f"✅ Reconstrucción completa: {result['written']} documentos escritos, {result['removed']} eliminados.")
+
+        report = data_logger.verify_daily_rollups()
+        if report["ok"]:
+            print(f"✅ Totales diarios correctos ({report['checked']} documentos comprobados).")
+            return 0
+
+        print(f"⚠️ {len(report['mismatches'])} de {report['checked']} totales diarios no coinciden con las entradas:")
+        for mismatch in report["mismatches"][:args.max_mismatches]:
+            print(f"   - {mismatch['date']} / {mismatch['meal_type']}: "
+                  f"esperado {mismatch['esperado']}, guardado {mismatch['guardado']}")
+        if not args.rebuild:
+            print("   Ejecuta 'python -m src.rollups --rebuild' para corregirlos.")
+        return 1
+    finally:
+        data_logger.close_connection()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
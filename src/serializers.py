@@ -0,0 +1,98 @@
+# src/serializers.py
+import json
+from datetime import datetime
+
+from bson import ObjectId
+
+# Campos numéricos de una entrada y de cada alimento de 'alimentos_detallados'
+TOTAL_FIELDS = ["calorias_totales", "proteinas_totales", "grasas_totales", "carbohidratos_totales"]
+NUTRIENT_FIELDS = ["calorias", "proteinas", "grasas", "carbohidratos"]
+
+
+class HistoryJSONEncoder(json.JSONEncoder):
+    """Encoder JSON para documentos de MongoDB: ObjectId como string y datetime en ISO 8601."""
+
+    def default(self, o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        if isinstance(o, datetime):
+            # 'YYYY-MM-DDTHH:MM:SS.ffffff' (sin 'Z' si es naive), igual que antes en app.py
+            return o.isoformat()
+        return super().default(o)
+
+
+_encoder = HistoryJSONEncoder(separators=(",", ":"))
+
+
+def _to_number(value):
+    """Convierte value a float; los valores no numéricos se guardan como 0.0."""
+    if isinstance(value, float):
+        return value
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def validate_entry(document):
+    """
+    Normaliza una entrada antes de guardarla en la base de datos: los totales y los nutrientes
+    de cada alimento quedan como float. Así las lecturas pueden serializar los documentos tal cual.
+    Modifica y devuelve el mismo diccionario.
+    """
+    for key in TOTAL_FIELDS:
+        if key in document:
+            document[key] = _to_number(document[key])
+    for food_item in document.get("alimentos_detallados") or []:
+        nutrientes = food_item.get("nutrientes")
+        if isinstance(nutrientes, dict):
+            for nutrient_key in NUTRIENT_FIELDS:
+                if nutrient_key in nutrientes:
+                    nutrientes[nutrient_key] = _to_number(nutrientes[nutrient_key])
+    return document
+
+
+def dumps(obj):
+    """Serializa obj (entradas, listas...) a JSON con HistoryJSONEncoder."""
+    return _encoder.encode(obj)
+
+
+def stream_json_array(entries):
+    """
+    Genera una lista JSON fragmento a fragmento a partir de un iterable de entradas
+    (por ejemplo, un cursor de MongoDB), sin tener todas las entradas en memoria a la vez.
+    """
+    yield "["
+    first = True
+    for entry in entries:
+        if first:
+            first = False
+            yield dumps(entry)
+        else:
+            yield "," + dumps(entry)
+    yield "]"
+
+
+def to_display_entry(entry):
+    """
+    Prepara una entrada para la plantilla web: _id como string, 'formatted_timestamp'
+    legible y totales/nutrientes redondeados a 2 decimales. Modifica y devuelve la misma entrada.
+    """
+    if isinstance(entry.get('_id'), ObjectId):
+        entry['_id'] = str(entry['_id'])
+
+    if isinstance(entry.get('timestamp'), datetime):
+        # Formatear la fecha y hora para una visualización amigable
+        entry['formatted_timestamp'] = entry['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+    else:
+        entry['formatted_timestamp'] = "Fecha desconocida"
+
+    for key in TOTAL_FIELDS:
+        entry[key] = round(entry.get(key) or 0.0, 2)
+
+    for food_item in entry.get("alimentos_detallados") or []:
+        nutrientes = food_item.get("nutrientes")
+        if isinstance(nutrientes, dict):
+            for nutrient_key in NUTRIENT_FIELDS:
+                nutrientes[nutrient_key] = round(nutrientes.get(nutrient_key) or 0.0, 2)
+    return entry
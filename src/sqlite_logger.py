@@ -0,0 +1,706 @@
+# src/sqlite_logger.py
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from src.config import SQLITE_PATH, SQLITE_BUSY_TIMEOUT_SECONDS, DAILY_ROLLUPS_ENABLED
+from src.data_logger import (DataLogger, SUMMARY_PERIOD_FORMATS, SUMMARY_TOTAL_FIELDS, STREAM_BATCH_SIZE,
+                             encode_cursor, decode_cursor)
+from src.serializers import dumps
+
+# Formato de los timestamps guardados: ancho fijo para que el orden de los strings sea el cronológico
+# (datetime.isoformat() omite los microsegundos cuando son 0)
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Columnas por las que get_food_entries acepta filtrar con query_filter (igualdad): clave -> columna
+FILTER_COLUMNS = {"_id": "id", "meal_type": "meal_type", "image_name": "image_name"}
+
+# Conexiones inactivas que se conservan para reutilizarlas
+MAX_IDLE_CONNECTIONS = 16
+
+TOTAL_COLUMNS = list(SUMMARY_TOTAL_FIELDS)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS food_entries (
+    id TEXT PRIMARY KEY,            -- ObjectId en hexadecimal (mismo _id que en MongoDB)
+    timestamp TEXT NOT NULL,        -- Hora local del servidor, TIMESTAMP_FORMAT
+    meal_type TEXT,
+    image_name TEXT,
+    {", ".join(f"{column} REAL" for column in TOTAL_COLUMNS)},
+    document TEXT NOT NULL          -- Resto de la entrada en JSON (alimentos_detallados, etc.)
+);
+CREATE INDEX IF NOT EXISTS timestamp_desc ON food_entries (timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS meal_type_timestamp ON food_entries (meal_type, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS image_hash ON food_entries (json_extract(document, '$.image_hash'));
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    date TEXT NOT NULL,
+    meal_type TEXT NOT NULL,        -- '' si la entrada no tenía meal_type
+    comidas INTEGER NOT NULL DEFAULT 0,
+    {", ".join(f"{column} REAL NOT NULL DEFAULT 0" for column in TOTAL_COLUMNS)},
+    updated_at TEXT,
+    PRIMARY KEY (date, meal_type)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    id TEXT PRIMARY KEY,
+    epoch TEXT NOT NULL,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    job_id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,       -- time.time() a partir del cual el trabajo deja de devolverse
+    document TEXT NOT NULL          -- Estado del trabajo en JSON
+);
+CREATE INDEX IF NOT EXISTS analysis_jobs_expires_at ON analysis_jobs (expires_at);
+"""
+
+VERSION_COUNTER_ID = "food_entries_version"
+ROLLUPS_MARKER_ID = "daily_rollups_complete"  # Fila de counters: los totales diarios cubren todo el historial
+
+
+def _format_timestamp(moment):
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def _parse_timestamp(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _shift_modifier(timezone_shift):
+    """Convierte un desfase "+HH:MM"/"-HH:MM" en el modificador de minutos de las funciones de fecha de SQLite."""
+    if not timezone_shift:
+        return "+0 minutes"
+    sign = -1 if timezone_shift.startswith("-") else 1
+    hours, minutes = timezone_shift.lstrip("+-").split(":")
+    return f"{sign * (int(hours) * 60 + int(minutes)):+d} minutes"
+
+
+def _period_key(day, period):
+    """Clave del periodo (ver SUMMARY_PERIOD_FORMATS) a la que pertenece el día 'YYYY-MM-DD'."""
+    if period == "day":
+        return day
+    if period == "month":
+        return day[:7]
+    iso_year, iso_week, _ = date.fromisoformat(day).isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
+
+
+def _apply_projection(document, projection):
+    """
+    Aplica una proyección al estilo MongoDB sobre un documento ya leído: de inclusión
+    ({"campo": 1}) o de exclusión ({"campo": 0}). Solo campos de primer nivel.
+    """
+    if not projection:
+        return document
+    included = [key for key, value in projection.items() if value and key != "_id"]
+    if included:
+        keep = set(included)
+        if projection.get("_id", 1):
+            keep.add("_id")
+        return {key: value for key, value in document.items() if key in keep}
+    for key in projection:
+        document.pop(key, None)
+    return document
+
+
+class SQLiteDataLogger(DataLogger):
+    """
+    Historial en un archivo SQLite local (sin servidor), para instalaciones de un solo nodo,
+    quioscos o pruebas sin conexión. Mismas consultas, resúmenes y borrados que MongoDataLogger:
+    - food_entries: columnas indexadas (timestamp, meal_type) y totales; el resto de la entrada en JSON.
+    - daily_rollups y counters se actualizan en la misma transacción que cada registro o borrado,
+      de modo que los totales diarios y la versión nunca quedan desajustados.
+    Modo WAL: las lecturas no esperan a las escrituras; varios procesos pueden compartir el archivo.
+    Cada hilo toma una conexión de un pool pequeño (las conexiones de sqlite3 no se comparten entre hilos a la vez).
+    """
+
+    INDEXES = {
+        "timestamp_desc": [("timestamp", -1), ("id", -1)],
+        "meal_type_timestamp": [("meal_type", 1), ("timestamp", -1), ("id", -1)],
+    }
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or SQLITE_PATH
+        self._pool = queue.LifoQueue()
+        self._opened_connections = 0
+        self._pool_lock = threading.Lock()
+        self.last_error = None
+        self._healthy = False
+        self._rollups_complete = False  # Caché de daily_rollups_complete (una vez completos, siguen así)
+        self.state_since = time.time()
+
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with self._connection() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+                if not DAILY_ROLLUPS_ENABLED:
+                    # Sin mantenimiento de totales, las escrituras de ahora en adelante los dejarían incompletos
+                    conn.execute("DELETE FROM counters WHERE id = ?", (ROLLUPS_MARKER_ID,))
+            self._healthy = True
+            print(f"✅ DataLogger: Base de datos SQLite lista en {self.path}")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ DataLogger: No se pudo abrir la base de datos SQLite {self.path}: {e}")
+            traceback.print_exc()
+
+    # --- Conexiones ---
+
+    def _open_connection(self):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")  # Con WAL: seguro ante caídas del proceso, sin fsync por commit
+        with self._pool_lock:
+            self._opened_connections += 1
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Toma una conexión del pool (o abre una nueva) y la devuelve al terminar."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open_connection()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._pool.qsize() < MAX_IDLE_CONNECTIONS:
+                self._pool.put(conn)
+            else:
+                conn.close()
+                with self._pool_lock:
+                    self._opened_connections -= 1
+
+    @contextmanager
+    def _transaction(self):
+        """Transacción de escritura (BEGIN IMMEDIATE): confirma al salir o deshace si hubo una excepción."""
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def _available(self, action):
+        if self._healthy:
+            return True
+        print(f"⚠️ DataLogger: Base de datos SQLite no disponible, no se puede {action}.")
+        return False
+
+    # --- Estado y diagnóstico ---
+
+    def is_healthy(self):
+        return self._healthy
+
+    def get_health(self):
+        try:
+            size_bytes = os.path.getsize(self.path)
+        except OSError:
+            size_bytes = None
+        return {
+            "backend": "sqlite",
+            "state": "healthy" if self._healthy else "unhealthy",
+            "since": datetime.fromtimestamp(self.state_since).isoformat(),
+            "last_error": self.last_error,
+            "path": self.path,
+            "size_bytes": size_bytes,
+            "connections": {"open": self._opened_connections, "idle": self._pool.qsize()},
+        }
+
+    def get_index_stats(self):
+        """Índices de food_entries con sus columnas (SQLite no registra cuántas veces se usa cada uno)."""
+        if not self._healthy:
+            return None
+        try:
+            with self._connection() as conn:
+                stats = []
+                for _, name, *_ in conn.execute("PRAGMA index_list(food_entries)").fetchall():
+                    columns = conn.execute(f"PRAGMA index_xinfo('{name}')").fetchall()
+                    stats.append({
+                        "name": name,
+                        "key": {column[2]: -1 if column[3] else 1 for column in columns if column[5] and column[2]},
+                        "accesses": None,
+                        "since": None,
+                        "managed": name in self.INDEXES,
+                    })
+                return stats
+        except Exception as e:
+            print(f"❌ DataLogger: Error al obtener los índices de SQLite: {e}")
+            return None
+
+    def get_version(self):
+        """Versión actual del historial "<época>-<contador>" (misma semántica que en MongoDB)."""
+        if not self._healthy:
+            return None
+        try:
+            with self._connection() as conn:
+                row = conn.execute("SELECT epoch, value FROM counters WHERE id = ?", (VERSION_COUNTER_ID,)).fetchone()
+                if row is None:
+                    conn.execute("INSERT OR IGNORE INTO counters (id, epoch, value) VALUES (?, ?, 0)",
+                                 (VERSION_COUNTER_ID, uuid.uuid4().hex[:8]))
+                    row = conn.execute("SELECT epoch, value FROM counters WHERE id = ?", (VERSION_COUNTER_ID,)).fetchone()
+            return f"{row[0]}-{row[1]}"
+        except Exception as e:
+            print(f"❌ DataLogger: Error al leer la versión del historial: {e}")
+            return None
+
+    @staticmethod
+    def _bump_version(conn):
+        """Incrementa la versión del historial dentro de la transacción de conn."""
+        conn.execute(
+            "INSERT INTO counters (id, epoch, value) VALUES (?, ?, 1) "
+            "ON CONFLICT(id) DO UPDATE SET value = value + 1",
+            (VERSION_COUNTER_ID, uuid.uuid4().hex[:8]))
+
+    # --- Totales diarios ---
+
+    def has_daily_rollups(self):
+        return DAILY_ROLLUPS_ENABLED
+
+    @staticmethod
+    def _set_rollups_marker(conn):
+        conn.execute("INSERT OR IGNORE INTO counters (id, epoch, value) VALUES (?, ?, 1)",
+                     (ROLLUPS_MARKER_ID, _format_timestamp(datetime.now())))
+
+    def daily_rollups_complete(self):
+        if not DAILY_ROLLUPS_ENABLED or not self._healthy:
+            return False
+        if self._rollups_complete:
+            return True
+        try:
+            with self._transaction() as conn:
+                marked = conn.execute("SELECT 1 FROM counters WHERE id = ?", (ROLLUPS_MARKER_ID,)).fetchone()
+                if marked is None:
+                    if conn.execute("SELECT 1 FROM food_entries LIMIT 1").fetchone() is not None:
+                        return False  # Historial anterior a los totales diarios: falta --rebuild
+                    # Base vacía: los totales se mantienen desde la primera entrada
+                    self._set_rollups_marker(conn)
+            self._rollups_complete = True
+            return True
+        except Exception as e:
+            print(f"❌ DataLogger: Error al comprobar la marca de totales diarios: {e}")
+            return False
+
+    def _apply_rollups(self, conn, documents, sign):
+        """Suma (sign=1) o resta (sign=-1) las entradas en daily_rollups dentro de la transacción de conn."""
+        if not DAILY_ROLLUPS_ENABLED or not documents:
+            return
+        increments = {}
+        for document in documents:
+            key = (document["timestamp"].strftime("%Y-%m-%d"), document.get("meal_type") or "")
+            totals = increments.setdefault(key, {"comidas": 0, **{field: 0.0 for field in TOTAL_COLUMNS}})
+            for field, amount in self._rollup_amounts(document).items():
+                totals[field] += sign * amount
+
+        columns = ["comidas", *TOTAL_COLUMNS]
+        updated_at = _format_timestamp(datetime.now())
+        conn.executemany(
+            f"INSERT INTO daily_rollups (date, meal_type, {', '.join(columns)}, updated_at) "
+            f"VALUES (?, ?, {', '.join('?' for _ in columns)}, ?) "
+            f"ON CONFLICT(date, meal_type) DO UPDATE SET "
+            f"{', '.join(f'{column} = {column} + excluded.{column}' for column in columns)}, updated_at = excluded.updated_at",
+            [(day, meal_type, *(totals[column] for column in columns), updated_at)
+             for (day, meal_type), totals in increments.items()])
+
+    @staticmethod
+    def _rollup_row(row):
+        day, meal_type, comidas, *totals = row
+        return {"date": day, "meal_type": meal_type or None, "comidas": comidas, **dict(zip(TOTAL_COLUMNS, totals))}
+
+    def get_daily_rollups(self, first_day, last_day, meal_type=None):
+        if not DAILY_ROLLUPS_ENABLED or not self._healthy:
+            return None
+        sql = (f"SELECT date, meal_type, comidas, {', '.join(TOTAL_COLUMNS)} FROM daily_rollups "
+               f"WHERE date BETWEEN ? AND ?")
+        params = [first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")]
+        if meal_type:
+            sql += " AND meal_type = ?"
+            params.append(meal_type)
+        try:
+            with self._connection() as conn:
+                rows = conn.execute(sql + " ORDER BY date, meal_type", params).fetchall()
+            return [self._rollup_row(row) for row in rows]
+        except Exception as e:
+            print(f"❌ DataLogger: Error al leer los totales diarios: {e}")
+            return None
+
+    def compute_daily_rollups(self):
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT date(timestamp) AS day, meal_type, COUNT(*), "
+                f"{', '.join(f'TOTAL({column})' for column in TOTAL_COLUMNS)} "
+                f"FROM food_entries GROUP BY day, meal_type").fetchall()
+        return {(row[0], row[1] or None): self._rollup_row(row) for row in rows}
+
+    def _stored_daily_rollups(self):
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT date, meal_type, comidas, {', '.join(TOTAL_COLUMNS)} FROM daily_rollups").fetchall()
+        return {(row[0], row[1] or None): self._rollup_row(row) for row in rows}
+
+    def rebuild_daily_rollups(self):
+        """Recalcula daily_rollups desde las entradas en una sola transacción (las lecturas ven los totales anteriores hasta el final)."""
+        if not DAILY_ROLLUPS_ENABLED or not self._healthy:
+            return None
+        columns = ["comidas", *TOTAL_COLUMNS]
+        with self._transaction() as conn:
+            stored = set(conn.execute("SELECT date, meal_type FROM daily_rollups").fetchall())
+            conn.execute("DELETE FROM daily_rollups")
+            conn.execute(
+                f"INSERT INTO daily_rollups (date, meal_type, {', '.join(columns)}, updated_at) "
+                f"SELECT date(timestamp) AS day, COALESCE(meal_type, ''), COUNT(*), "
+                f"{', '.join(f'TOTAL({column})' for column in TOTAL_COLUMNS)}, ? "
+                f"FROM food_entries GROUP BY day, COALESCE(meal_type, '')",
+                (_format_timestamp(datetime.now()),))
+            rebuilt = set(conn.execute("SELECT date, meal_type FROM daily_rollups").fetchall())
+            self._set_rollups_marker(conn)  # Desde ahora los resúmenes pueden leerse de daily_rollups
+        self._rollups_complete = True
+        written, removed = len(rebuilt), len(stored - rebuilt)
+        print(f"✅ DataLogger: Totales diarios reconstruidos: {written} escritos, {removed} eliminados.")
+        return {"written": written, "removed": removed}
+
+    # --- Escrituras ---
+
+    def log_food_entry(self, analysis_result, image_name, meal_type, log_time=None):
+        """Registra una entrada de comida (una transacción con sus totales diarios y la versión)."""
+        food_entry = self._build_document(analysis_result, image_name, meal_type, log_time)
+        logged = self._insert_documents([food_entry])[0]
+        if logged:
+            print(f"✅ DataLogger: Entrada de comida registrada con ID: {food_entry['_id']}")
+        return logged
+
+    def _insert_documents(self, documents):
+        """
+        Inserta documentos ya preparados en una sola transacción, junto con sus totales diarios y la versión.
+        Un documento cuyo _id ya existe cuenta como registrado (la transacción que lo insertó ya sumó sus totales).
+        Devuelve una lista de booleanos, uno por documento.
+        """
+        if not documents:
+            return []
+        if not self._available("registrar las entradas"):
+            return [False] * len(documents)
+
+        results = [False] * len(documents)
+        rows = []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())  # Como insert_many: el documento recibe su _id
+            try:
+                payload = {key: value for key, value in document.items() if key not in ("_id", "timestamp")}
+                rows.append((index, (str(document["_id"]), _format_timestamp(document["timestamp"]),
+                                     document.get("meal_type"), document.get("image_name"),
+                                     *(document.get(column) for column in TOTAL_COLUMNS), dumps(payload))))
+            except Exception as e:
+                print(f"❌ DataLogger: Entrada no válida para SQLite ({document.get('image_name')}): {e}")
+
+        try:
+            inserted = []
+            with self._transaction() as conn:
+                for index, row in rows:
+                    cursor = conn.execute(
+                        f"INSERT INTO food_entries (id, timestamp, meal_type, image_name, {', '.join(TOTAL_COLUMNS)}, document) "
+                        f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in TOTAL_COLUMNS)}, ?) ON CONFLICT(id) DO NOTHING", row)
+                    results[index] = True
+                    if cursor.rowcount:
+                        inserted.append(documents[index])
+                self._apply_rollups(conn, inserted, 1)
+                if inserted:
+                    self._bump_version(conn)
+        except Exception as e:
+            print(f"❌ DataLogger: Error al registrar las entradas de comida en SQLite: {e}")
+            traceback.print_exc()
+            return [False] * len(documents)
+
+        if len(documents) > 1:
+            print(f"✅ DataLogger: {len(inserted)} entradas de comida registradas en bloque.")
+        if inserted:
+            self._notify_write_listeners()
+        return results
+
+    def delete_food_entry(self, entry_id):
+        if not self._available("eliminar la entrada"):
+            return False
+        try:
+            entry_id = str(entry_id if isinstance(entry_id, ObjectId) else ObjectId(str(entry_id)))
+        except (InvalidId, TypeError):
+            print(f"❌ DataLogger: Error: El ID '{entry_id}' no es un ObjectId válido.")
+            return False
+
+        try:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    f"SELECT timestamp, meal_type, {', '.join(TOTAL_COLUMNS)} FROM food_entries WHERE id = ?",
+                    (entry_id,)).fetchone()
+                if row is None:
+                    print(f"⚠️ DataLogger: No se encontró la entrada con ID {entry_id} para eliminar.")
+                    return False
+                conn.execute("DELETE FROM food_entries WHERE id = ?", (entry_id,))
+                deleted = {"timestamp": _parse_timestamp(row[0]), "meal_type": row[1], **dict(zip(TOTAL_COLUMNS, row[2:]))}
+                self._apply_rollups(conn, [deleted], -1)
+                self._bump_version(conn)
+        except Exception as e:
+            print(f"❌ DataLogger: Error al eliminar la entrada de comida: {e}")
+            traceback.print_exc()
+            return False
+
+        print(f"✅ DataLogger: Entrada con ID {entry_id} eliminada con éxito.")
+        self._notify_write_listeners()
+        return True
+
+    def get_entries_by_image_hash(self, image_hashes):
+        if not self._available("buscar entradas por imagen"):
+            return None
+        image_hashes = list(image_hashes)
+        if not image_hashes:
+            return {}
+        try:
+            with self._connection() as conn:
+                # Misma expresión que el índice image_hash, para que SQLite lo use
+                rows = conn.execute(
+                    f"SELECT json_extract(document, '$.image_hash'), id, meal_type, timestamp FROM food_entries "
+                    f"WHERE json_extract(document, '$.image_hash') IN ({', '.join('?' for _ in image_hashes)}) "
+                    f"ORDER BY timestamp DESC, id DESC",
+                    image_hashes).fetchall()
+        except Exception as e:
+            print(f"❌ DataLogger: Error al buscar entradas por imagen: {e}")
+            traceback.print_exc()
+            return None
+        found = {}
+        for image_hash, entry_id, meal_type, timestamp in rows:
+            found.setdefault(image_hash, []).append(
+                {"_id": ObjectId(entry_id), "meal_type": meal_type or None, "timestamp": _parse_timestamp(timestamp)})
+        return found
+
+    # --- Trabajos en segundo plano ---
+
+    def save_job(self, job, ttl_seconds):
+        if not self._available("guardar el estado del trabajo"):
+            return False
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM analysis_jobs WHERE expires_at < ?", (now,))
+                conn.execute(
+                    "INSERT INTO analysis_jobs (job_id, expires_at, document) VALUES (?, ?, ?) "
+                    "ON CONFLICT(job_id) DO UPDATE SET expires_at = excluded.expires_at, document = excluded.document",
+                    (job["job_id"], now + ttl_seconds, dumps(job)))
+            return True
+        except Exception as e:
+            print(f"❌ DataLogger: Error al guardar el estado del trabajo {job['job_id']}: {e}")
+            return False
+
+    def get_job(self, job_id):
+        if not self._available("leer el estado del trabajo"):
+            return None
+        try:
+            with self._connection() as conn:
+                row = conn.execute("SELECT document FROM analysis_jobs WHERE job_id = ? AND expires_at >= ?",
+                                   (job_id, time.time())).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"❌ DataLogger: Error al leer el estado del trabajo {job_id}: {e}")
+            return None
+
+    def delete_job(self, job_id):
+        if not self._available("borrar el estado del trabajo"):
+            return False
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM analysis_jobs WHERE job_id = ?", (job_id,))
+            return True
+        except Exception as e:
+            print(f"❌ DataLogger: Error al borrar el estado del trabajo {job_id}: {e}")
+            return False
+
+    # --- Lecturas ---
+
+    @staticmethod
+    def _history_where(start_date=None, end_date=None, meal_type=None, query_filter=None, cursor=None):
+        """
+        Construye el WHERE del historial: (sql, parámetros). Lanza InvalidCursorError si el cursor no es
+        válido y ValueError si query_filter usa campos que no son columnas (ver FILTER_COLUMNS).
+        """
+        conditions = []
+        params = []
+        for key, value in (query_filter or {}).items():
+            if key not in FILTER_COLUMNS or isinstance(value, dict):
+                raise ValueError(f"Filtro no soportado por el backend SQLite: {key}")
+            conditions.append(f"{FILTER_COLUMNS[key]} = ?")
+            params.append(str(value) if isinstance(value, ObjectId) else value)
+        if start_date:
+            conditions.append("timestamp >= ?")
+            params.append(_format_timestamp(start_date))
+        if end_date:
+            conditions.append("timestamp <= ?")
+            params.append(_format_timestamp(end_date))
+        if meal_type:
+            conditions.append("meal_type = ?")
+            params.append(meal_type)
+        if cursor:
+            cursor_timestamp, cursor_id = decode_cursor(cursor)
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend([_format_timestamp(cursor_timestamp), str(cursor_id)])
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    @staticmethod
+    def _row_to_entry(row, projection=None):
+        entry_id, timestamp, document = row
+        entry = {"_id": ObjectId(entry_id), "timestamp": _parse_timestamp(timestamp), **json.loads(document)}
+        return _apply_projection(entry, projection)
+
+    def get_food_entries(self, start_date=None, end_date=None, meal_type=None, query_filter=None,
+                         limit=None, cursor=None, projection=None):
+        if not self._available("obtener entradas"):
+            return []
+
+        where, params = self._history_where(start_date, end_date, meal_type, query_filter, cursor)
+        try:
+            with self._connection() as conn:
+                rows = conn.execute(
+                    f"SELECT id, timestamp, document FROM food_entries{where} "
+                    f"ORDER BY timestamp DESC, id DESC LIMIT ?", [*params, limit or -1]).fetchall()
+            return [self._row_to_entry(row, projection) for row in rows]
+        except Exception as e:
+            print(f"❌ DataLogger: Error al obtener entradas de comida: {e}")
+            traceback.print_exc()
+            return []
+
+    def stream_food_entries_page(self, limit, cursor=None, projection=None, **filters):
+        """
+        Como en MongoDB: primero las claves (timestamp, id) de limit + 1 entradas, cubiertas por el índice;
+        después las entradas completas se leen por lotes mientras se consume el iterador.
+        Ambas consultas van en la misma transacción de lectura (BEGIN diferido) sobre una sola conexión:
+        la segunda solo se acota por abajo con la última clave, así que tiene que ver el mismo snapshot
+        de WAL que la primera (si no, una entrada registrada entre ambas se colaría en la página).
+        La conexión queda en manos del iterador y vuelve al pool cuando este termina o se cierra.
+        """
+        if not self._available("obtener entradas"):
+            return iter(()), None
+
+        where, params = self._history_where(cursor=cursor, **filters)
+        stack = ExitStack()
+        try:
+            conn = stack.enter_context(self._connection())
+            conn.execute("BEGIN")  # Diferido: el snapshot se fija en la primera lectura
+            keys = []
+            if limit is not None:
+                keys = conn.execute(
+                    f"SELECT timestamp, id FROM food_entries{where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    [*params, limit + 1]).fetchall()
+        except Exception as e:
+            stack.close()  # Deshace la transacción y devuelve la conexión
+            print(f"❌ DataLogger: Error al obtener entradas de comida: {e}")
+            traceback.print_exc()
+            return iter(()), None
+
+        next_cursor = None
+        if limit is not None and len(keys) > limit:
+            last_timestamp, last_id = keys[limit - 1]
+            next_cursor = encode_cursor({"timestamp": _parse_timestamp(last_timestamp), "_id": last_id})
+            where = (where + " AND " if where else " WHERE ") + "(timestamp, id) >= (?, ?)"
+            params = [*params, last_timestamp, last_id]
+
+        sql = f"SELECT id, timestamp, document FROM food_entries{where} ORDER BY timestamp DESC, id DESC"
+        return self._iterate_rows(stack, conn, sql, params, projection), next_cursor
+
+    def _iterate_rows(self, stack, conn, sql, params, projection):
+        """
+        Lee las filas por lotes con la conexión (y la transacción de lectura) de stream_food_entries_page;
+        al terminar, stack la cierra y devuelve la conexión al pool.
+        Un error a mitad se registra y se vuelve a lanzar (como en MongoDataLogger._iterate_cursor).
+        """
+        try:
+            rows = conn.execute(sql, params)
+            try:
+                while True:
+                    batch = rows.fetchmany(STREAM_BATCH_SIZE)
+                    if not batch:
+                        break
+                    for row in batch:
+                        yield self._row_to_entry(row, projection)
+            finally:
+                rows.close()  # Si el cliente corta la respuesta, liberar la consulta antes de devolver la conexión
+        except Exception as e:
+            print(f"❌ DataLogger: Error al leer entradas de comida de SQLite: {e}")
+            traceback.print_exc()
+            raise
+        finally:
+            stack.close()
+
+    def get_nutrition_summary(self, start_date, end_date, period="day", by_meal_type=False, meal_type=None,
+                              timezone_shift=None):
+        """
+        Agrupa por día (con el desfase horario aplicado) y meal_type en SQLite, sobre el índice de timestamp;
+        las semanas y meses se suman después a partir de esos días.
+        """
+        if period not in SUMMARY_PERIOD_FORMATS:
+            raise ValueError(f"Periodo de resumen no soportado: {period}")
+
+        if not self._available("obtener el resumen"):
+            return None
+
+        if (period == "day" and not timezone_shift and start_date.time() == datetime.min.time()
+                and end_date.time() == datetime.max.time() and self.daily_rollups_complete()):
+            summary = self._summary_from_rollups(start_date.date(), end_date.date(), by_meal_type, meal_type)
+            if summary is not None:
+                return summary
+
+        sql = (f"SELECT date(timestamp, ?) AS day, meal_type, COUNT(*), "
+               f"{', '.join(f'TOTAL({column})' for column in TOTAL_COLUMNS)} "
+               f"FROM food_entries WHERE timestamp >= ? AND timestamp <= ?")
+        params = [_shift_modifier(timezone_shift), _format_timestamp(start_date), _format_timestamp(end_date)]
+        if meal_type:
+            sql += " AND meal_type = ?"
+            params.append(meal_type)
+        sql += " GROUP BY day, meal_type"
+
+        try:
+            with self._connection() as conn:
+                rows = conn.execute(sql, params).fetchall()
+        except Exception as e:
+            print(f"❌ DataLogger: Error al calcular el resumen nutricional: {e}")
+            traceback.print_exc()
+            return None
+
+        grouped = {}
+        for day, row_meal_type, comidas, *totals in rows:
+            periodo = _period_key(day, period)
+            key = (periodo, row_meal_type) if by_meal_type else (periodo,)
+            item = grouped.setdefault(key, {"periodo": periodo, "comidas": 0,
+                                            **{total_key: 0.0 for total_key in SUMMARY_TOTAL_FIELDS.values()}})
+            if by_meal_type:
+                item["meal_type"] = row_meal_type
+            item["comidas"] += comidas
+            for total_key, value in zip(SUMMARY_TOTAL_FIELDS.values(), totals):
+                item[total_key] += value
+        summary = [grouped[key] for key in sorted(grouped, key=lambda k: tuple(part or "" for part in k))]
+        for item in summary:
+            for total_key in SUMMARY_TOTAL_FIELDS.values():
+                item[total_key] = round(item[total_key], 2)
+        return summary
+
+    def close_connection(self):
+        """Cierra las conexiones inactivas del pool."""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._pool_lock:
+                self._opened_connections -= 1
+        print("✅ DataLogger: Conexión a SQLite cerrada.")
@@ -0,0 +1,80 @@
+# src/stream_parser.py
+import json
+
+
+class IncrementalFoodParser:
+    """
+    Extrae los objetos de la lista "alimentos_detallados" a medida que llegan fragmentos de texto
+    de una respuesta JSON en streaming, sin esperar a que el documento esté completo.
+    Cada objeto se devuelve en cuanto se cierra su '}'. Tolera el bloque ```json ... ``` alrededor
+    y no se confunde con llaves o corchetes dentro de cadenas.
+    """
+
+    def __init__(self, array_key="alimentos_detallados"):
+        self.array_key = array_key
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+        self._array_depth = None  # Profundidad dentro de la lista buscada (None: aún no encontrada)
+        self._object_start = None
+        self.finished = False  # True cuando se cerró la lista
+        self.items_emitted = 0
+
+    def feed(self, chunk):
+        """Añade un fragmento de texto y devuelve la lista de objetos completados en él."""
+        if not chunk or self.finished:
+            return []
+        self._text += chunk
+        completed = []
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            ch = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._array_depth is None:
+                        # Solo interesan las cadenas mientras buscamos la clave de la lista
+                        try:
+                            self._last_string = json.loads(text[self._string_start:pos + 1])
+                        except ValueError:
+                            self._last_string = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch == ":":
+                self._pending_key = self._last_string
+            elif ch == ",":
+                self._pending_key = None
+            elif ch in "{[":
+                if ch == "{" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._object_start = pos
+                self._depth += 1
+                if ch == "[" and self._array_depth is None and self._pending_key == self.array_key:
+                    self._array_depth = self._depth
+            elif ch in "}]":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if ch == "}" and self._depth == self._array_depth and self._object_start is not None:
+                        try:
+                            completed.append(json.loads(text[self._object_start:pos + 1]))
+                            self.items_emitted += 1
+                        except ValueError:
+                            pass  # Objeto malformado: se omite, el parseo final decidirá
+                        self._object_start = None
+                    elif ch == "]" and self._depth == self._array_depth - 1:
+                        self.finished = True
+                        self._pos = pos + 1
+                        return completed
+        self._pos = len(text)
+        return completed
@@ -0,0 +1,210 @@
+# src/write_behind.py
+import threading
+import time
+import traceback
+from collections import deque
+
+
+class _PendingItem:
+    __slots__ = ("seq", "enqueued_at", "item", "attempts")
+
+    def __init__(self, seq, item):
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.item = item
+        self.attempts = 0
+
+
+class WriteBehindQueue:
+    """
+    Cola acotada de escrituras diferidas con un hilo que las envía por lotes.
+    - write_batch(items): función que escribe una lista de elementos y devuelve una lista de
+      booleanos (uno por elemento) indicando cuáles se escribieron.
+    - max_queue: elementos que pueden esperar; con la cola llena submit() devuelve False
+      y el llamador debe escribir por su cuenta (no se bloquea la petición).
+    - batch_size / flush_interval: el lote se envía al reunir batch_size elementos o cuando el
+      más antiguo lleva flush_interval segundos esperando, lo que ocurra primero.
+    - max_attempts: intentos por elemento antes de descartarlo (los fallos se reintentan en el siguiente lote).
+    - is_ready(): si devuelve False (ej. base de datos caída) los lotes esperan en la cola sin gastar intentos.
+    """
+
+    def __init__(self, write_batch, max_queue=1000, batch_size=50, flush_interval=0.5, max_attempts=3,
+                 is_ready=None, name="foodscan-write-behind"):
+        self.write_batch = write_batch
+        self.is_ready = is_ready or (lambda: True)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._pending = deque()
+        self._in_flight = []
+        self._cond = threading.Condition()
+        self._next_seq = 0
+        self._flush_requested = False
+        self._closing = False
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.retried = 0
+        self.rejected = 0
+        self.batches = 0
+        self._flush_latencies = deque(maxlen=500)  # Duración (s) de cada escritura por lotes
+        self._queue_waits = deque(maxlen=500)  # Tiempo (s) desde submit hasta quedar escrito
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        print(f"🧵 WriteBehindQueue: lotes de {batch_size} o cada {flush_interval}s, cola máxima {max_queue}.")
+
+    def submit(self, item):
+        """Encola item para escribirlo en segundo plano. Devuelve False si la cola está llena o cerrada."""
+        with self._cond:
+            if self._closing or len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                return False
+            self._pending.append(_PendingItem(self._next_seq, item))
+            self._next_seq += 1
+            self.submitted += 1
+            self._cond.notify_all()  # Despierta al hilo: arranca el temporizador o completa el lote
+            return True
+
+    def _lowest_unfinished_seq(self):
+        if self._in_flight:
+            return self._in_flight[0].seq
+        if self._pending:
+            return self._pending[0].seq
+        return self._next_seq
+
+    def flush(self, timeout=None):
+        """
+        Espera a que todo lo encolado antes de la llamada esté escrito (o descartado).
+        Devuelve False si se agotó timeout antes de conseguirlo.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._next_seq
+            if self._lowest_unfinished_seq() >= target:
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._lowest_unfinished_seq() < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _next_batch(self):
+        """Espera hasta que toque enviar un lote y lo saca de la cola. Devuelve None al cerrar sin pendientes."""
+        with self._cond:
+            while not self._pending:
+                if self._closing:
+                    return None
+                self._cond.wait()
+            deadline = self._pending[0].enqueued_at + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._flush_requested and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not self._pending:
+                self._flush_requested = False
+            self._in_flight = batch
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            if not self.is_ready():
+                # Devolver el lote a la cola tal cual y esperar; con la cola llena, submit() rechaza
+                with self._cond:
+                    self._pending.extendleft(reversed(batch))
+                    self._in_flight = []
+                    self._cond.notify_all()
+                    if self._closing:
+                        print(f"❌ WriteBehindQueue: Cierre sin destino disponible; se pierden {len(self._pending)} elementos.")
+                        self.dropped += len(self._pending)
+                        self._pending.clear()
+                        return
+                time.sleep(self.flush_interval)
+                continue
+
+            started_at = time.monotonic()
+            try:
+                results = self.write_batch([pending.item for pending in batch])
+            except Exception as e:
+                print(f"❌ WriteBehindQueue: Error inesperado al escribir un lote de {len(batch)}: {e}")
+                traceback.print_exc()
+                results = [False] * len(batch)
+            finished_at = time.monotonic()
+
+            retry = []
+            with self._cond:
+                self.batches += 1
+                self._flush_latencies.append(finished_at - started_at)
+                for pending, ok in zip(batch, results):
+                    if ok:
+                        self.written += 1
+                        self._queue_waits.append(finished_at - pending.enqueued_at)
+                    elif pending.attempts + 1 < self.max_attempts:
+                        pending.attempts += 1
+                        self.retried += 1
+                        retry.append(pending)
+                    else:
+                        self.dropped += 1
+                        print(f"❌ WriteBehindQueue: Elemento descartado tras {self.max_attempts} intentos.")
+                # Los reintentos vuelven al principio de la cola, conservando el orden
+                self._pending.extendleft(reversed(retry))
+                self._in_flight = []
+                self._cond.notify_all()
+            if retry:
+                time.sleep(self.flush_interval)  # Pausa antes de reintentar para no insistir en bucle
+
+    def close(self, timeout=None):
+        """Deja de aceptar elementos, escribe todo lo pendiente y detiene el hilo."""
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"⚠️ WriteBehindQueue: Cierre sin terminar, {len(self._pending)} elementos pendientes.")
+        else:
+            print("✅ WriteBehindQueue: Cola vaciada y detenida.")
+
+    def stats(self):
+        with self._cond:
+            flush_latencies = sorted(self._flush_latencies)
+            queue_waits = sorted(self._queue_waits)
+            stats = {
+                "queue_depth": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "max_queue": self.max_queue,
+                "batch_size": self.batch_size,
+                "flush_interval_s": self.flush_interval,
+                "submitted": self.submitted,
+                "written": self.written,
+                "retried": self.retried,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "avg_batch_size": round(self.written / self.batches, 2) if self.batches else 0.0,
+            }
+
+        def percentile_ms(values, p):
+            if not values:
+                return None
+            return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 1)
+
+        stats.update({
+            "flush_latency_p50_ms": percentile_ms(flush_latencies, 0.50),
+            "flush_latency_p95_ms": percentile_ms(flush_latencies, 0.95),
+            "queue_wait_p50_ms": percentile_ms(queue_waits, 0.50),
+            "queue_wait_p95_ms": percentile_ms(queue_waits, 0.95),
+        })
+        return stats
@@ -0,0 +1,120 @@
+# tests/test_write_behind.py
+import threading
+
+from src.write_behind import WriteBehindQueue
+
+
+class RecordingWriter:
+    """write_batch de prueba: guarda cada lote y devuelve los resultados que indique fail_calls."""
+
+    def __init__(self, fail_calls=0, gate=None):
+        self.batches = []
+        self.fail_calls = fail_calls  # Número de llamadas iniciales que fallan por completo
+        self.gate = gate  # Si se indica, cada lote espera a que se active antes de escribirse
+        self.started = threading.Event()
+
+    def __call__(self, items):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(items))
+        if len(self.batches) <= self.fail_calls:
+            return [False] * len(items)
+        return [True] * len(items)
+
+
+def make_queue(writer, **kwargs):
+    options = {"max_queue": 100, "batch_size": 100, "flush_interval": 10, "max_attempts": 3}
+    options.update(kwargs)
+    return WriteBehindQueue(writer, **options)
+
+
+def test_flush_waits_for_earlier_writes():
+    gate = threading.Event()
+    writer = RecordingWriter(gate=gate)
+    queue = make_queue(writer)
+    try:
+        for item in ("a", "b", "c"):
+            assert queue.submit(item)
+        # flush() adelanta el lote aunque no se haya llenado ni pasado flush_interval,
+        # pero no vuelve mientras la escritura siga en curso
+        assert queue.flush(timeout=0.2) is False
+        assert writer.started.is_set()
+        gate.set()
+        assert queue.flush(timeout=5) is True
+        assert writer.batches == [["a", "b", "c"]]
+        assert queue.stats()["written"] == 3
+    finally:
+        gate.set()
+        queue.close(timeout=5)
+
+
+def test_flush_returns_immediately_when_nothing_is_pending():
+    writer = RecordingWriter()
+    queue = make_queue(writer)
+    try:
+        assert queue.flush(timeout=0) is True
+        assert writer.batches == []
+    finally:
+        queue.close(timeout=5)
+
+
+def test_failed_items_are_retried_in_order():
+    writer = RecordingWriter(fail_calls=1)
+    queue = make_queue(writer, flush_interval=0.01)
+    try:
+        for item in ("a", "b", "c"):
+            queue.submit(item)
+        assert queue.flush(timeout=5) is True
+        assert writer.batches == [["a", "b", "c"], ["a", "b", "c"]]
+        stats = queue.stats()
+        assert (stats["written"], stats["retried"], stats["dropped"]) == (3, 3, 0)
+    finally:
+        queue.close(timeout=5)
+
+
+def test_items_are_dropped_after_max_attempts():
+    writer = RecordingWriter(fail_calls=10)
+    queue = make_queue(writer, flush_interval=0.01, max_attempts=2)
+    try:
+        queue.submit("a")
+        queue.submit("b")
+        assert queue.flush(timeout=5) is True
+        assert writer.batches == [["a", "b"], ["a", "b"]]
+        stats = queue.stats()
+        assert (stats["written"], stats["retried"], stats["dropped"]) == (0, 2, 2)
+        assert stats["queue_depth"] == 0
+    finally:
+        queue.close(timeout=5)
+
+
+def test_close_drains_pending_items():
+    writer = RecordingWriter()
+    queue = make_queue(writer)
+    for item in range(5):
+        queue.submit(item)
+    # Ni el lote está lleno ni ha pasado flush_interval: es close() quien debe escribirlo
+    queue.close(timeout=5)
+    assert [item for batch in writer.batches for item in batch] == [0, 1, 2, 3, 4]
+    assert queue.stats()["queue_depth"] == 0
+    assert queue.submit(5) is False
+
+
+def test_submit_returns_false_when_queue_is_full():
+    gate = threading.Event()
+    writer = RecordingWriter(gate=gate)
+    queue = make_queue(writer, max_queue=2, batch_size=1, flush_interval=0)
+    try:
+        assert queue.submit("en curso")
+        assert writer.started.wait(5)  # El primer elemento ya salió de la cola y se está escribiendo
+        assert queue.submit("a")
+        assert queue.submit("b")
+        assert queue.submit("c") is False
+        assert queue.stats()["rejected"] == 1
+        gate.set()
+        assert queue.flush(timeout=5) is True
+        assert queue.submit("c") is True
+    finally:
+        gate.set()
+        queue.close(timeout=5)
+    assert [item for batch in writer.batches for item in batch] == ["en curso", "a", "b", "c"]